@@ -1,5 +1,8 @@
 import json
+import logging
 import os
+import threading
+from collections import OrderedDict
 import openai
 from dotenv import load_dotenv
 
@@ -24,6 +27,7 @@ from langchain.tools.render import format_tool_to_openai_function
 from common.query_engines.agent_summary_sql_vector import get_agent_summaries_query_engine
 from common.query_engines.call_transcript_sql_vector import get_call_transcripts_query_engine
 from dbConfig.postgres_config import get_message_history, save_message_history
+from dbConfig.pool_registry import get_active_environment_token
 
 load_dotenv()  # take environment variables from .env.
 
@@ -35,8 +39,25 @@ db_name = os.getenv("DB_NAME")
 
 # openai.api_key = openai_api_key
 
-def answer_followup_question(query, user_id, session_id):
-    messages = get_message_history(user_id)
+agent_cache_size = int(os.getenv("FOLLOWUP_AGENT_CACHE_SIZE", "8"))
+
+# environment_token -> (agent runnable, query engine tools)
+_agent_executors = OrderedDict()
+_agent_cache_lock = threading.Lock()
+
+
+def _new_repl_tool():
+    # One REPL per request: the steps of one agent run share variables,
+    # concurrent requests sharing the cached agent don't.
+    repl = PythonREPL()
+    return Tool(
+        name="python_repl",
+        description="A Python shell. Use this to execute python commands. Input should be a valid python command. If you want to see the output of a value, you should print it out with `print(...)`.",
+        func=repl.run,
+    )
+
+
+def _build_agent():
     gpt4 = OpenAI(temperature=0, model="gpt-4-1106-preview")
     service_context_gpt4 = ServiceContext.from_defaults(
         llm=gpt4,
@@ -69,25 +90,11 @@ def answer_followup_question(query, user_id, session_id):
     call_summaries_tool = LlamaIndexTool.from_tool_config(
         call_summaries_tool_config)
 
-    python_repl = PythonREPL()
-    repl_tool = Tool(
-        name="python_repl",
-        description="A Python shell. Use this to execute python commands. Input should be a valid python command. If you want to see the output of a value, you should print it out with `print(...)`.",
-        func=python_repl.run,
-    )
-
     llm = ChatOpenAI(temperature=0, model="gpt-4-1106-preview")
-    chat_history = []
-
-    for message in messages:
-        if message["message_role"] == "user":
-            chat_history.append(HumanMessage(content=str(message["message"])))
-        elif message["message_role"] == "system":
-            chat_history.append(AIMessage(content=str(message["message"])))
 
-    chat_history = chat_history[::-1]
-
-    tools = [call_transcript_tool, call_summaries_tool, repl_tool]
+    query_engine_tools = [call_transcript_tool, call_summaries_tool]
+    # The REPL tool's function spec is the same for every request
+    tools = query_engine_tools + [_new_repl_tool()]
 
     prompt = ChatPromptTemplate.from_messages(
         [
@@ -118,7 +125,64 @@ def answer_followup_question(query, user_id, session_id):
         | OpenAIFunctionsAgentOutputParser()
     )
 
-    agent_executor = AgentExecutor(agent=agent, tools=tools, verbose=True)
+    return agent, query_engine_tools
+
+
+def get_followup_agent(environment_token=None):
+    """Return an AgentExecutor over the tenant's prebuilt agent, building the agent on first use.
+
+    The agent and its query engine tools are bound to the tenant's vector
+    stores, so they are cached per environment_token. Each call gets its own
+    executor with a fresh python_repl tool.
+    """
+    environment_token = environment_token or get_active_environment_token()
+    with _agent_cache_lock:
+        cached = _agent_executors.get(environment_token)
+        if cached is not None:
+            _agent_executors.move_to_end(environment_token)
+
+    if cached is None:
+        logging.info(f"Building follow-up agent for {environment_token}")
+        cached = _build_agent()
+        with _agent_cache_lock:
+            cached = _agent_executors.setdefault(environment_token, cached)
+            _agent_executors.move_to_end(environment_token)
+            while len(_agent_executors) > agent_cache_size:
+                evicted_token, _ = _agent_executors.popitem(last=False)
+                logging.info(f"Evicting follow-up agent for {evicted_token}")
+
+    agent, query_engine_tools = cached
+    return AgentExecutor(agent=agent, tools=query_engine_tools + [_new_repl_tool()], verbose=True)
+
+
+def warm_up_followup_agent(environment_token):
+    try:
+        get_followup_agent(environment_token)
+    except Exception as e:
+        logging.error(f"Failed to warm up follow-up agent for {environment_token}: {e}")
+
+
+def invalidate_followup_agents(environment_token=None):
+    with _agent_cache_lock:
+        if environment_token is None:
+            _agent_executors.clear()
+        else:
+            _agent_executors.pop(environment_token, None)
+
+
+def answer_followup_question(query, user_id, session_id):
+    messages = get_message_history(user_id)
+    agent_executor = get_followup_agent()
+
+    chat_history = []
+
+    for message in messages:
+        if message["message_role"] == "user":
+            chat_history.append(HumanMessage(content=str(message["message"])))
+        elif message["message_role"] == "system":
+            chat_history.append(AIMessage(content=str(message["message"])))
+
+    chat_history = chat_history[::-1]
 
     response = agent_executor.invoke(
         {"input": query, "chat_history": chat_history}
@@ -1,8 +1,8 @@
+import os
+
 from llama_index.llms import OpenAI
 from llama_index import (
     Prompt,
-    StorageContext,
-    VectorStoreIndex,
     ServiceContext,
 )
 from dbConfig.constants import (
@@ -14,10 +14,52 @@ from llama_index.vector_stores.types import (
     FilterCondition,
     FilterOperator,
 )
-from dbConfig.postgres_config import get_daily_summary_count_by_summary_date, get_vector_store, save_message_history
+from common.tree_summarizer import TreeSummarizer
+from dbConfig.node_fetch import SUMMARY_RETRIEVAL_MODE, iter_summary_pages
+from dbConfig.postgres_config import (
+    get_daily_summary_count_by_summary_date,
+    get_vector_index,
+    get_weekly_summary_cache,
+    save_message_history,
+    save_weekly_summary_cache,
+)
+
+# Serve a range from weekly_summary_cache while none of its daily summaries changed
+WEEKLY_SUMMARY_CACHE = os.getenv("WEEKLY_SUMMARY_CACHE", "true").lower() == "true"
+
+WEEKLY_SUMMARY_QUERY = "Can you give me a summary about all the calls happened in the week?"
 
 
 def summary_for_date_range(user_id, week_start_date, week_end_date, session_id):
+    cached, data_version = (
+        get_weekly_summary_cache(week_start_date, week_end_date) if WEEKLY_SUMMARY_CACHE else (None, None)
+    )
+    if cached is not None:
+        summary_details = cached["summary_details"]
+    else:
+        summary_details = generate_summary_for_date_range(week_start_date, week_end_date)
+        if not isinstance(summary_details, dict):
+            return summary_details
+        if data_version is not None:
+            save_weekly_summary_cache(week_start_date, week_end_date, summary_details, data_version)
+
+    # A cache hit still starts a follow-up session, which reads the summary from the history
+    save_message_history(WEEKLY_SUMMARY_QUERY.strip(), "user",
+                         user_id, session_id, week_end_date, week_start_date)
+    save_message_history(summary_details["summary"], "system",
+                         user_id, session_id, week_end_date, week_start_date)
+    print("Successfully saved message history.")
+
+    return {
+        **summary_details,
+        "cache": {
+            "hit": cached is not None,
+            "age_seconds": cached["age_seconds"] if cached is not None else 0.0,
+        },
+    }
+
+
+def generate_summary_for_date_range(week_start_date, week_end_date):
     weekly_summaries_count = get_daily_summary_count_by_summary_date(
         week_start_date, week_end_date
     )
@@ -63,10 +105,6 @@ def summary_for_date_range(user_id, week_start_date, week_end_date, session_id):
     qa_template = Prompt(template)
     gpt4 = OpenAI(temperature=0, model="gpt-4-1106-preview")
 
-    vector_store = get_vector_store(daily_summaries_embeddings_table_name)
-
-    storage_context = StorageContext.from_defaults(vector_store=vector_store)
-
     service_context_gpt4 = ServiceContext.from_defaults(
         llm=gpt4,
         chunk_size=1024,
@@ -84,31 +122,33 @@ def summary_for_date_range(user_id, week_start_date, week_end_date, session_id):
         condition=FilterCondition.AND,
     )
 
-    index = VectorStoreIndex.from_documents(
-        [], service_context=service_context_gpt4, storage_context=storage_context
-    )
-    query_engine = index.as_query_engine(
-        text_qa_template=qa_template,
-        query_mode="compact_accumulate",
-        similarity_top_k=row_count,
-        filters=filters,
-        verbose=True,
-    )
-    query = "Can you give me a summary about all the calls happened in the week?"
-    response = query_engine.query(query)
-
-    save_message_history(query.strip(), "user",
-                         user_id, session_id, week_end_date, week_start_date)
-    save_message_history(str(response), "system",
-                         user_id, session_id, week_end_date, week_start_date)
-    print("Successfully saved message history.")
+    query = WEEKLY_SUMMARY_QUERY
+    if SUMMARY_RETRIEVAL_MODE == "direct":
+        summarizer = TreeSummarizer(service_context_gpt4, qa_template)
+        response = summarizer.summarize(
+            query, iter_summary_pages(daily_summaries_embeddings_table_name, week_start_date, week_end_date)
+        )
+    else:
+        index = get_vector_index(
+            daily_summaries_embeddings_table_name, service_context=service_context_gpt4
+        )
+        query_engine = index.as_query_engine(
+            service_context=service_context_gpt4,
+            text_qa_template=qa_template,
+            query_mode="compact_accumulate",
+            similarity_top_k=row_count,
+            filters=filters,
+            verbose=True,
+        )
+        response = query_engine.query(query)
 
     try:
         summary_details = {
             'summary': str(response),
-            'total_calls': weekly_total_calls_count,
-            'successful_calls': weekly_successful_calls_count,
-            'unsuccessful_calls': weekly_unsuccessful_calls_count
+            # Strings, as jsonify rendered the Decimal counts, so cached details are plain JSON
+            'total_calls': str(weekly_total_calls_count),
+            'successful_calls': str(weekly_successful_calls_count),
+            'unsuccessful_calls': str(weekly_unsuccessful_calls_count)
         }
         return summary_details
     except Exception as e:
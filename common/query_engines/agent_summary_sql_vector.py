@@ -1,10 +1,8 @@
 import os
 from dotenv import load_dotenv
-from dbConfig.postgres_config import get_vector_store
+from dbConfig.postgres_config import get_vector_index
 from dbConfig.constants import agent_summaries_embeddings_table_name
 from llama_index import (
-    StorageContext,
-    VectorStoreIndex,
     Prompt,
 )
 from llama_index.query_engine import RetrieverQueryEngine
@@ -22,15 +20,7 @@ db_password = os.getenv("DB_PASSWORD")
 db_name = os.getenv("DB_NAME")
 
 def get_agent_summaries_query_engine(service_context):
-    vector_store = get_vector_store(agent_summaries_embeddings_table_name)
-    storage_context = StorageContext.from_defaults(vector_store=vector_store)
-
-    vector_index = VectorStoreIndex.from_documents(
-        [],
-        service_context=service_context,
-        show_progress=False,
-        storage_context=storage_context,
-    )
+    vector_index = get_vector_index(agent_summaries_embeddings_table_name, service_context=service_context)
 
     vector_store_prompt_template = """
         You are an sales coach who help managerial people with the overview of the calls happened in the week.
@@ -84,7 +74,10 @@ def get_agent_summaries_query_engine(service_context):
         ],
     )
     vector_auto_retriever = VectorIndexAutoRetriever(
-        vector_index, vector_store_info=vector_store_info, similarity_top_k=30
+        vector_index,
+        vector_store_info=vector_store_info,
+        similarity_top_k=30,
+        service_context=service_context,
     )
 
     retriever_query_engine = RetrieverQueryEngine.from_args(
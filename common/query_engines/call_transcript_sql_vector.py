@@ -1,7 +1,5 @@
 import os
 from llama_index import (
-    StorageContext,
-    VectorStoreIndex,
     Prompt,
 )
 from common.get_google_creds import access_secret_file
@@ -12,7 +10,7 @@ from llama_index.query_engine import RetrieverQueryEngine
 from llama_index.indices.vector_store.retrievers import VectorIndexAutoRetriever
 from llama_index.query_engine.retriever_query_engine import RetrieverQueryEngine
 from dotenv import load_dotenv
-from dbConfig.postgres_config import get_vector_store
+from dbConfig.postgres_config import get_vector_index
 
 load_dotenv()  # take environment variables from .env.
 
@@ -23,15 +21,7 @@ db_password = os.getenv("DB_PASSWORD")
 db_name = os.getenv("DB_NAME")
 
 def get_call_transcripts_query_engine(service_context):
-    vector_store = get_vector_store(call_transcription_table_name)
-    storage_context = StorageContext.from_defaults(vector_store=vector_store)
-
-    vector_index = VectorStoreIndex.from_documents(
-        [],
-        service_context=service_context,
-        show_progress=False,
-        storage_context=storage_context,
-    )
+    vector_index = get_vector_index(call_transcription_table_name, service_context=service_context)
 
     vector_store_prompt_template = """
         Act as if you are a sales data analyst responsible for providing managerial personnel with a synthesized overview of daily sales calls of an agent. Act as if you are expert in math calculations and differentiating between successful and unsuccessful calls. In the data you will find parameter called as "call_disposition" which means outcome of the call. Using the call recording transcripts provided, offer an answer.
@@ -100,7 +90,10 @@ def get_call_transcripts_query_engine(service_context):
         ],
     )
     vector_auto_retriever = VectorIndexAutoRetriever(
-        vector_index, vector_store_info=vector_store_info, similarity_top_k=30
+        vector_index,
+        vector_store_info=vector_store_info,
+        similarity_top_k=30,
+        service_context=service_context,
     )
 
     retriever_query_engine = RetrieverQueryEngine.from_args(
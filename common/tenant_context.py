@@ -0,0 +1,45 @@
+import contextvars
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+
+@dataclass(frozen=True)
+class TenantContext:
+    """Connection settings of one tenant, resolved once from the secret payload.
+
+    Requests and consumer messages activate their tenant with use_tenant() /
+    set_current_tenant() instead of writing these values into os.environ, so
+    concurrent threads working for different tenants don't see each other's
+    settings.
+    """
+    environment_token: str
+    db: dict = field(default_factory=dict)
+    mssql: dict = field(default_factory=dict)
+    rabbitmq: dict = field(default_factory=dict)
+    gcp: dict = field(default_factory=dict)
+
+
+_current_tenant = contextvars.ContextVar("current_tenant", default=None)
+
+
+def get_current_tenant():
+    return _current_tenant.get()
+
+
+def set_current_tenant(tenant):
+    return _current_tenant.set(tenant)
+
+
+@contextmanager
+def use_tenant(tenant):
+    reset_token = _current_tenant.set(tenant)
+    try:
+        yield tenant
+    finally:
+        _current_tenant.reset(reset_token)
+
+
+def submit_with_context(executor, fn, *args, **kwargs):
+    """executor.submit that carries the caller's tenant (and other context variables) into the worker."""
+    context = contextvars.copy_context()
+    return executor.submit(context.run, fn, *args, **kwargs)
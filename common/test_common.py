@@ -1,3 +1,57 @@
+import math
+from types import SimpleNamespace
+
+import pytest
+
+
 # Example content of test_common.py
 def test_example():
     assert 1 == 1
+
+
+class _Node:
+    def __init__(self, text):
+        self.text = text
+
+    def get_content(self, metadata_mode=None):
+        return self.text
+
+
+class _CountingPredictor:
+    """Stands in for the LLM: a summary records how many rows it covers and how many reductions deep it is."""
+
+    def predict(self, prompt, context_str, query_str):
+        parts = [dict(field.split("=") for field in text.split()) for text in context_str.split("\n\n")]
+        rows = sum(int(part["n"]) for part in parts)
+        depth = max(int(part["d"]) for part in parts) + 1
+        return f"n={rows} d={depth}"
+
+
+def _tree_summarizer(group_tokens):
+    tree_summarizer = pytest.importorskip("common.tree_summarizer")
+    service_context = SimpleNamespace(llm_predictor=_CountingPredictor())
+    return tree_summarizer.TreeSummarizer(
+        service_context, None, tokenizer=str.split, group_tokens=group_tokens, concurrency=2,
+    )
+
+
+def test_pack_keeps_groups_within_the_token_budget():
+    summarizer = _tree_summarizer(group_tokens=5)
+    groups = summarizer.pack(["a b", "c d", "e", "f g h", "i j k l m n o"])
+    assert groups == [["a b", "c d", "e"], ["f g h"], ["i j k l m"]]
+
+
+def test_small_input_is_summarized_in_one_call():
+    summarizer = _tree_summarizer(group_tokens=100)
+    pages = [[_Node("n=1 d=0") for _ in range(5)]]
+    assert summarizer.summarize("q", pages) == "n=5 d=1"
+    assert summarizer.llm_calls == 1
+
+
+def test_every_row_goes_through_a_logarithmic_number_of_reductions():
+    summarizer = _tree_summarizer(group_tokens=10)
+    # 5 rows per group, 60 rows arriving over 12 pages
+    pages = [[_Node("n=1 d=0") for _ in range(5)] for _ in range(12)]
+    rows, depth = (int(field.split("=")[1]) for field in summarizer.summarize("q", pages).split())
+    assert rows == 60
+    assert depth <= math.ceil(math.log(60, 5)) + 1
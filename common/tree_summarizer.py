@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import os
+
+import tiktoken
+from llama_index.schema import MetadataMode
+
+logger = logging.getLogger(__name__)
+
+# Prompt budget of one LLM call: rows (or partial summaries) are packed into
+# groups of at most this many tokens, leaving room for the template itself.
+TREE_SUMMARY_GROUP_TOKENS = int(os.getenv("TREE_SUMMARY_GROUP_TOKENS", "6000"))
+# LLM calls of one summary in flight at the same time
+TREE_SUMMARY_CONCURRENCY = int(os.getenv("TREE_SUMMARY_CONCURRENCY", "4"))
+
+
+class TreeSummarizer:
+    """Map-reduce summarization over pages of nodes, within a fixed token budget per call.
+
+    Rows are read page by page into the buffer of level 0. Whenever a level's
+    buffer no longer fits one prompt, its full groups of at most group_tokens
+    are summarized (up to concurrency at once) and the summaries added to the
+    next level, which reduces the same way. After the last page the leftovers
+    move up level by level until the top fits one final call. At most about
+    one group budget per level plus one page is held in memory, and an input
+    that fits one prompt is answered with a single call, as the compact mode was.
+
+    The template gets the texts as context_str and the query as query_str at
+    every level, so partial summaries have the shape of the final answer.
+    """
+
+    def __init__(self, service_context, text_qa_template, tokenizer=None,
+                 group_tokens=TREE_SUMMARY_GROUP_TOKENS, concurrency=TREE_SUMMARY_CONCURRENCY):
+        self.llm_predictor = service_context.llm_predictor
+        self.template = text_qa_template
+        self.tokenize = tokenizer or tiktoken.encoding_for_model("gpt-4-1106-preview").encode
+        self.group_tokens = group_tokens
+        self.concurrency = concurrency
+        self.llm_calls = 0
+        self.levels = 0
+
+    def _count(self, text):
+        return len(self.tokenize(text))
+
+    def _truncate(self, text, tokens):
+        count = self._count(text)
+        if count <= tokens:
+            return text
+        # Proportional cut; only reached by a single row or summary larger than a whole group
+        logger.warning("Truncating a text of %s tokens to fit a summary group of %s", count, tokens)
+        return text[: len(text) * tokens // count]
+
+    def pack(self, texts):
+        """Split texts into consecutive groups whose token counts add up to at most group_tokens."""
+        groups = []
+        group, group_tokens = [], 0
+        for text in texts:
+            text = self._truncate(text, self.group_tokens)
+            tokens = self._count(text)
+            if group and group_tokens + tokens > self.group_tokens:
+                groups.append(group)
+                group, group_tokens = [], 0
+            group.append(text)
+            group_tokens += tokens
+        if group:
+            groups.append(group)
+        return groups
+
+    async def _summarize(self, semaphore, query, texts):
+        async with semaphore:
+            self.llm_calls += 1
+            # The shared rate limiter blocks inside the LLM callback, so calls run on
+            # worker threads (which inherit the tenant context) instead of the loop.
+            return await asyncio.to_thread(
+                self.llm_predictor.predict, self.template, context_str="\n\n".join(texts), query_str=query,
+            )
+
+    async def _reduce(self, semaphore, query, texts):
+        groups = self.pack(texts)
+        logger.info("Summarizing %s texts in %s groups", len(texts), len(groups))
+        return list(await asyncio.gather(*(self._summarize(semaphore, query, group) for group in groups)))
+
+    def _total_tokens(self, texts):
+        return sum(self._count(text) for text in texts)
+
+    async def _push(self, semaphore, query, levels, level, texts):
+        """Add texts to a level's buffer; once it exceeds a group, its full groups move up as summaries."""
+        while len(levels) <= level:
+            levels.append([])
+        self.levels = max(self.levels, level)
+        levels[level].extend(texts)
+        if self._total_tokens(levels[level]) <= self.group_tokens:
+            return
+        groups = self.pack(levels[level])
+        # The last group may still take more texts, so it stays buffered
+        full_groups, levels[level] = groups[:-1], groups[-1]
+        if not full_groups:
+            return
+        logger.info("Summarizing %s groups of level %s", len(full_groups), level)
+        summaries = await asyncio.gather(*(self._summarize(semaphore, query, group) for group in full_groups))
+        await self._push(semaphore, query, levels, level + 1, summaries)
+
+    async def asummarize(self, query, pages):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        pages = iter(pages)
+        # levels[0] buffers rows, levels[n] summaries of n reductions, so every
+        # row goes through about log(rows) reductions whatever page it came in.
+        levels = [[]]
+        while True:
+            # Reading a page is a blocking database round trip
+            page = await asyncio.to_thread(next, pages, None)
+            if page is None:
+                break
+            await self._push(
+                semaphore, query, levels, 0, [node.get_content(metadata_mode=MetadataMode.LLM) for node in page],
+            )
+
+        # What is left below the top level moves up one reduction per level
+        level = 0
+        while level < len(levels) - 1:
+            buffered, levels[level] = levels[level], []
+            if len(buffered) > 1:
+                buffered = await self._reduce(semaphore, query, buffered)
+            await self._push(semaphore, query, levels, level + 1, buffered)
+            level += 1
+
+        top = levels[-1]
+        if not top:
+            return ""
+        while len(top) > 1 and self._total_tokens(top) > self.group_tokens:
+            self.levels += 1
+            reduced = await self._reduce(semaphore, query, top)
+            if self._total_tokens(reduced) >= self._total_tokens(top):
+                # Summaries as long as their inputs would never converge
+                logger.warning("Summary tree stopped shrinking at %s texts", len(reduced))
+                break
+            top = reduced
+
+        groups = self.pack(top)
+        if len(groups) > 1:
+            groups = [[self._truncate(text, max(self.group_tokens // len(top), 1)) for text in top]]
+        return await self._summarize(semaphore, query, groups[0])
+
+    def summarize(self, query, pages):
+        """Summarize an iterable of node pages (lists of NodeWithScore) into one answer."""
+        response = asyncio.run(self.asummarize(query, pages))
+        logger.info("Tree summary used %s LLM calls over %s levels", self.llm_calls, self.levels + 1)
+        return response
@@ -0,0 +1,586 @@
+import argparse
+import contextvars
+import logging
+import os
+import re
+import threading
+
+from dbConfig.pool_registry import get_active_environment_token, get_connection, get_dedicated_connection
+
+logger = logging.getLogger(__name__)
+
+# Rows updated per statement while backfilling typed columns of an existing table
+MIGRATION_BACKFILL_BATCH_SIZE = int(os.getenv("MIGRATION_BACKFILL_BATCH_SIZE", "10000"))
+# Backfill and build indexes on a background thread the first time a table is
+# queried; with false they only run through `python -m dbConfig.migrations`.
+MIGRATE_IN_BACKGROUND = os.getenv("MIGRATE_IN_BACKGROUND", "true").lower() == "true"
+
+# The vector tables are created lazily by PGVectorStore on first insert, so
+# each one is migrated the first time it is queried after it exists. Typed
+# columns are filled by a trigger from metadata_, which keeps every insert
+# path (vector store, bulk ingest) covered without changing it. The indexes
+# are built CONCURRENTLY (connections are autocommit) so inserts aren't blocked.
+_SCHEMA_MIGRATIONS_TABLE = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        name TEXT PRIMARY KEY,
+        applied_at numeric DEFAULT EXTRACT(EPOCH FROM CURRENT_TIMESTAMP)
+    )
+"""
+
+_METADATA_DATE_FUNCTION = """
+    CREATE OR REPLACE FUNCTION metadata_date(value text) RETURNS date AS $$
+    BEGIN
+        RETURN value::timestamp::date;
+    EXCEPTION WHEN others THEN
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql IMMUTABLE
+"""
+
+_CALL_TRANSCRIPT_COLUMNS = [
+    "ALTER TABLE data_call_transcripts ADD COLUMN IF NOT EXISTS call_date date",
+    "ALTER TABLE data_call_transcripts ADD COLUMN IF NOT EXISTS representative_name text",
+    "ALTER TABLE data_call_transcripts ADD COLUMN IF NOT EXISTS call_disposition text",
+    """
+    CREATE OR REPLACE FUNCTION set_call_transcript_columns() RETURNS trigger AS $$
+    BEGIN
+        NEW.call_date := metadata_date(NEW.metadata_->>'date');
+        NEW.representative_name := COALESCE(NEW.metadata_->>'user_name', NEW.metadata_->>'sales_representative_name');
+        NEW.call_disposition := NEW.metadata_->>'call_disposition';
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS set_call_transcript_columns ON data_call_transcripts",
+    """
+    CREATE TRIGGER set_call_transcript_columns
+    BEFORE INSERT OR UPDATE OF metadata_ ON data_call_transcripts
+    FOR EACH ROW EXECUTE FUNCTION set_call_transcript_columns()
+    """,
+]
+
+_CALL_TRANSCRIPT_INDEXES = [
+    """
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS data_call_transcripts_call_date_idx
+    ON data_call_transcripts (call_date, representative_name, call_disposition)
+    """,
+    # Looked up by the idempotent transcript ingest
+    """
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS data_call_transcripts_file_name_idx
+    ON data_call_transcripts ((metadata_->>'file_name'))
+    """,
+]
+
+
+def _summary_date_columns(table_name):
+    return [
+        f"ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS summary_date date",
+        """
+        CREATE OR REPLACE FUNCTION set_summary_date_column() RETURNS trigger AS $$
+        BEGIN
+            NEW.summary_date := metadata_date(NEW.metadata_->>'summary_date');
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql
+        """,
+        f"DROP TRIGGER IF EXISTS set_summary_date_column ON {table_name}",
+        f"""
+        CREATE TRIGGER set_summary_date_column
+        BEFORE INSERT OR UPDATE OF metadata_ ON {table_name}
+        FOR EACH ROW EXECUTE FUNCTION set_summary_date_column()
+        """,
+    ]
+
+
+def _summary_date_indexes(table_name):
+    return [f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {table_name}_summary_date_idx ON {table_name} (summary_date)"]
+
+
+# table -> (migration name, statements run before the backfill, indexes built after it)
+MIGRATIONS = {
+    "data_call_transcripts": ("typed_columns_v1", _CALL_TRANSCRIPT_COLUMNS, _CALL_TRANSCRIPT_INDEXES),
+    "data_agent_summaries": (
+        "typed_columns_v1", _summary_date_columns("data_agent_summaries"), _summary_date_indexes("data_agent_summaries"),
+    ),
+    "data_sales_representative_summaries": (
+        "typed_columns_v1",
+        _summary_date_columns("data_sales_representative_summaries"),
+        _summary_date_indexes("data_sales_representative_summaries"),
+    ),
+    "data_daily_summaries": (
+        "typed_columns_v1", _summary_date_columns("data_daily_summaries"), _summary_date_indexes("data_daily_summaries"),
+    ),
+}
+
+_migrated = set()
+_schema_applied = set()
+_scheduled = set()
+_key_locks = {}
+_key_locks_lock = threading.Lock()
+
+
+def _key_lock(key):
+    """Lock of one (environment_token, migration) pair, so tenants and tables don't wait on each other."""
+    with _key_locks_lock:
+        return _key_locks.setdefault(key, threading.Lock())
+
+
+def _backfill(cursor, table_name):
+    """Re-fire the trigger for existing rows in id ranges, so no statement locks the whole table."""
+    cursor.execute(f"SELECT min(id), max(id) FROM {table_name}")
+    min_id, max_id = cursor.fetchone()
+    if min_id is None:
+        return 0
+    updated = 0
+    for start_id in range(min_id, max_id + 1, MIGRATION_BACKFILL_BATCH_SIZE):
+        cursor.execute(
+            f"UPDATE {table_name} SET metadata_ = metadata_ WHERE id >= %s AND id < %s",
+            (start_id, start_id + MIGRATION_BACKFILL_BATCH_SIZE),
+        )
+        updated += cursor.rowcount
+    return updated
+
+
+def _index_name(statement):
+    return re.search(r"IF NOT EXISTS\s+(\w+)", statement).group(1)
+
+
+def _is_applied(cursor, migration):
+    cursor.execute(_SCHEMA_MIGRATIONS_TABLE)
+    cursor.execute("SELECT 1 FROM schema_migrations WHERE name = %s", (migration,))
+    return cursor.fetchone() is not None
+
+
+def _apply_schema(conn, table_name):
+    """Add the typed columns and their trigger, so every new row gets them.
+
+    Only catalog changes, so it is quick enough for the query path. Returns
+    None if the table doesn't exist yet, "complete" if the whole migration was
+    applied before and "schema" otherwise.
+    """
+    name, statements, _ = MIGRATIONS[table_name]
+    migration = f"{table_name}:{name}"
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT to_regclass(%s)", (table_name,))
+        if cursor.fetchone()[0] is None:
+            # Not created yet; try again once the first rows are written
+            return None
+        if _is_applied(cursor, migration):
+            return "complete"
+
+        # Its own advisory lock: a backfill holding the migration's lock must not stall queries
+        cursor.execute("SELECT pg_advisory_lock(hashtext(%s))", (f"{migration}:schema",))
+        try:
+            if not _is_applied(cursor, f"{migration}:schema"):
+                logger.info("Applying schema of migration %s", migration)
+                cursor.execute(_METADATA_DATE_FUNCTION)
+                for statement in statements:
+                    cursor.execute(statement)
+                cursor.execute("INSERT INTO schema_migrations(name) VALUES(%s)", (f"{migration}:schema",))
+            return "schema"
+        finally:
+            cursor.execute("SELECT pg_advisory_unlock(hashtext(%s))", (f"{migration}:schema",))
+    finally:
+        cursor.close()
+
+
+def _migrate_table(conn, table_name):
+    """Apply the whole migration of a table: schema, backfill of existing rows and index builds.
+
+    Meant for a dedicated connection (see run_migrations); the backfill commits
+    batch by batch and the indexes are built CONCURRENTLY, so inserts keep going.
+    """
+    if _apply_schema(conn, table_name) is None:
+        return False
+    name, _, indexes = MIGRATIONS[table_name]
+    migration = f"{table_name}:{name}"
+    cursor = conn.cursor()
+    try:
+        # Replicas starting together wait here instead of migrating the same table twice
+        cursor.execute("SELECT pg_advisory_lock(hashtext(%s))", (migration,))
+        try:
+            if _is_applied(cursor, migration):
+                return True
+
+            logger.info("Applying migration %s", migration)
+            updated = _backfill(cursor, table_name)
+            # A concurrent build that was interrupted leaves an invalid index that IF NOT EXISTS
+            # would keep. Only this migration's own indexes are dropped, and only under its
+            # lock, which every builder of them holds; an index being built right now by
+            # anything else is invalid too.
+            cursor.execute(
+                """
+                SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+                WHERE i.indrelid = %s::regclass AND NOT i.indisvalid AND c.relname = ANY(%s)
+                """,
+                (table_name, [_index_name(statement) for statement in indexes]),
+            )
+            for (invalid_index,) in cursor.fetchall():
+                cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {invalid_index}")
+            for statement in indexes:
+                cursor.execute(statement)
+            cursor.execute("INSERT INTO schema_migrations(name) VALUES(%s)", (migration,))
+            logger.info("Applied migration %s (%s rows backfilled)", migration, updated)
+            return True
+        finally:
+            cursor.execute("SELECT pg_advisory_unlock(hashtext(%s))", (migration,))
+    finally:
+        cursor.close()
+
+
+def _schedule(key, job):
+    """Run job() once per key on a background thread, in the caller's tenant context."""
+    if not MIGRATE_IN_BACKGROUND:
+        return
+    with _key_locks_lock:
+        if key in _scheduled:
+            return
+        _scheduled.add(key)
+
+    def run():
+        try:
+            if job():
+                _migrated.add(key)
+        except Exception as e:
+            logger.error("Background migration %s failed: %s", key, e, exc_info=True)
+        finally:
+            # A failed or deferred job is scheduled again by the next query
+            with _key_locks_lock:
+                _scheduled.discard(key)
+
+    thread = threading.Thread(target=contextvars.copy_context().run, args=(run,), name=f"migrate-{key[1]}", daemon=True)
+    thread.start()
+
+
+def _migrate_in_background(environment_token, table_name):
+    with get_dedicated_connection(environment_token) as conn:
+        return _migrate_table(conn, table_name)
+
+
+def ensure_migrated(table_name, environment_token=None):
+    """Make sure new rows of a vector table get its typed columns, once per tenant and process.
+
+    Only the schema runs here. Existing rows are backfilled and the indexes
+    built on a background thread (or by `python -m dbConfig.migrations`), so
+    until that finished the typed columns of older rows may still be NULL.
+    """
+    environment_token = environment_token or get_active_environment_token()
+    key = (environment_token, table_name)
+    if key in _migrated:
+        return
+    if key not in _schema_applied:
+        with _key_lock(key):
+            if key not in _schema_applied:
+                with get_connection(environment_token) as conn:
+                    status = _apply_schema(conn, table_name)
+                if status is None:
+                    return
+                _schema_applied.add(key)
+                if status == "complete":
+                    _migrated.add(key)
+                    return
+    _schedule(key, lambda: _migrate_in_background(environment_token, table_name))
+
+
+_CALL_COUNT_ROLLUPS_TABLE = """
+    CREATE TABLE IF NOT EXISTS call_count_rollups (
+        environment_token TEXT NOT NULL,
+        summary_date DATE NOT NULL,
+        representative_name TEXT NOT NULL DEFAULT '',
+        call_disposition TEXT NOT NULL DEFAULT '',
+        call_count INTEGER NOT NULL DEFAULT 0,
+        row_count INTEGER NOT NULL DEFAULT 0,
+        talk_time_seconds NUMERIC NOT NULL DEFAULT 0,
+        PRIMARY KEY (environment_token, summary_date, representative_name, call_disposition)
+    )
+"""
+
+# The calls (file_name) counted in call_count_rollups, written by the same
+# statement as their increment, so counting a call twice or subtracting one
+# that was never counted is a no-op.
+_CALL_COUNT_ROLLUP_CALLS_TABLE = """
+    CREATE TABLE IF NOT EXISTS call_count_rollup_calls (
+        environment_token TEXT NOT NULL,
+        file_name TEXT NOT NULL,
+        content_hash TEXT,
+        PRIMARY KEY (environment_token, file_name)
+    )
+"""
+
+# add_call_to_rollup and delete_transcript_rows write the calls table before the
+# rollup; locking both in that order keeps their writes out until the recount
+# below is committed, without deadlocking them.
+_CALL_COUNT_ROLLUPS_LOCK = (
+    "LOCK TABLE call_count_rollup_calls, call_count_rollups IN SHARE ROW EXCLUSIVE MODE"
+)
+
+_CALL_COUNT_ROLLUP_CALLS_BACKFILL = """
+    INSERT INTO call_count_rollup_calls (environment_token, file_name, content_hash)
+    SELECT %s, metadata_->>'file_name', max(metadata_->>'content_hash')
+    FROM data_call_transcripts
+    WHERE call_date IS NOT NULL AND metadata_->>'file_name' IS NOT NULL
+    GROUP BY metadata_->>'file_name'
+    ON CONFLICT (environment_token, file_name) DO NOTHING
+"""
+
+# One call is one ingested recording (file_name); its rows share the call's metadata.
+# Calls ingested since the rollup table was created are already counted by
+# add_call_to_rollup, so the recount replaces rather than adds to those rows.
+_CALL_COUNT_ROLLUPS_BACKFILL = """
+    INSERT INTO call_count_rollups
+        (environment_token, summary_date, representative_name, call_disposition, call_count, row_count, talk_time_seconds)
+    SELECT %s, call_date, representative_name, call_disposition, count(*), sum(row_count), sum(talk_time_seconds)
+    FROM (
+        SELECT
+            call_date,
+            COALESCE(representative_name, '') AS representative_name,
+            COALESCE(call_disposition, '') AS call_disposition,
+            count(*) AS row_count,
+            COALESCE(max(substring(metadata_->>'call_talk_time' from '^[0-9]+(?:[.][0-9]+)?')::numeric), 0) AS talk_time_seconds
+        FROM data_call_transcripts
+        WHERE call_date IS NOT NULL
+        GROUP BY call_date, 2, 3, metadata_->>'file_name'
+    ) calls
+    GROUP BY call_date, representative_name, call_disposition
+    ON CONFLICT (environment_token, summary_date, representative_name, call_disposition) DO UPDATE SET
+        call_count = EXCLUDED.call_count,
+        row_count = EXCLUDED.row_count,
+        talk_time_seconds = EXCLUDED.talk_time_seconds
+"""
+
+
+def _backfill_call_count_rollups(environment_token):
+    """Fill the rollup from existing transcripts, after their typed columns were backfilled.
+
+    The recount overwrites the rollup, so it runs in one transaction that
+    holds the rollup tables' locks: a call ingested or deleted meanwhile is
+    applied after it, against the recounted rows, instead of being lost.
+    """
+    migration = f"call_count_rollups:{environment_token}:v2"
+    with get_dedicated_connection(environment_token) as conn:
+        if not _migrate_table(conn, "data_call_transcripts"):
+            return False
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT pg_advisory_lock(hashtext(%s))", (migration,))
+            try:
+                if not _is_applied(cursor, migration):
+                    conn.autocommit = False
+                    try:
+                        with conn:
+                            cursor.execute(_CALL_COUNT_ROLLUPS_LOCK)
+                            cursor.execute(_CALL_COUNT_ROLLUP_CALLS_BACKFILL, (environment_token,))
+                            cursor.execute(_CALL_COUNT_ROLLUPS_BACKFILL, (environment_token,))
+                            logger.info("Backfilled %s call count rollup rows for %s", cursor.rowcount, environment_token)
+                            cursor.execute("INSERT INTO schema_migrations(name) VALUES(%s)", (migration,))
+                    finally:
+                        conn.autocommit = True
+            finally:
+                cursor.execute("SELECT pg_advisory_unlock(hashtext(%s))", (migration,))
+        finally:
+            cursor.close()
+    return True
+
+
+def ensure_call_count_rollups(environment_token=None):
+    """Create the call count rollup of a tenant, and have it filled from existing transcripts once.
+
+    The fill runs with the transcripts' own backfill, in the background or by
+    `python -m dbConfig.migrations`; until then only calls ingested since are counted.
+    """
+    environment_token = environment_token or get_active_environment_token()
+    key = (environment_token, "call_count_rollups")
+    if key in _migrated:
+        return
+    migration = f"call_count_rollups:{environment_token}:v2"
+    with _key_lock(key):
+        if key in _migrated:
+            return
+        with get_connection(environment_token) as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(_CALL_COUNT_ROLLUPS_TABLE)
+                cursor.execute(_CALL_COUNT_ROLLUP_CALLS_TABLE)
+                if _is_applied(cursor, migration):
+                    _migrated.add(key)
+                    return
+                cursor.execute("SELECT to_regclass('data_call_transcripts')")
+                if cursor.fetchone()[0] is None:
+                    # Nothing to count yet; every call is added as it is ingested
+                    cursor.execute("INSERT INTO schema_migrations(name) VALUES(%s) ON CONFLICT DO NOTHING", (migration,))
+                    _migrated.add(key)
+                    return
+            finally:
+                cursor.close()
+    ensure_migrated("data_call_transcripts", environment_token)
+    _schedule(key, lambda: _backfill_call_count_rollups(environment_token))
+
+
+# Every write to data_daily_summaries stamps its summary_date with the next
+# value of one sequence, so the largest stamp over a date range changes
+# whenever any daily summary in that range is inserted, updated or deleted.
+_DAILY_SUMMARY_VERSIONS = [
+    "CREATE SEQUENCE IF NOT EXISTS daily_summary_version_seq",
+    """
+    CREATE TABLE IF NOT EXISTS daily_summary_versions (
+        summary_date DATE PRIMARY KEY,
+        version BIGINT NOT NULL
+    )
+    """,
+    """
+    CREATE OR REPLACE FUNCTION bump_daily_summary_version() RETURNS trigger AS $$
+    DECLARE
+        changed_date date;
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            changed_date := metadata_date(OLD.metadata_->>'summary_date');
+        ELSE
+            changed_date := metadata_date(NEW.metadata_->>'summary_date');
+        END IF;
+        IF changed_date IS NOT NULL THEN
+            INSERT INTO daily_summary_versions(summary_date, version)
+            VALUES (changed_date, nextval('daily_summary_version_seq'))
+            ON CONFLICT (summary_date) DO UPDATE SET version = EXCLUDED.version;
+        END IF;
+        IF TG_OP = 'UPDATE' AND OLD.metadata_->>'summary_date' IS DISTINCT FROM NEW.metadata_->>'summary_date' THEN
+            changed_date := metadata_date(OLD.metadata_->>'summary_date');
+            IF changed_date IS NOT NULL THEN
+                INSERT INTO daily_summary_versions(summary_date, version)
+                VALUES (changed_date, nextval('daily_summary_version_seq'))
+                ON CONFLICT (summary_date) DO UPDATE SET version = EXCLUDED.version;
+            END IF;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS bump_daily_summary_version ON data_daily_summaries",
+    """
+    CREATE TRIGGER bump_daily_summary_version
+    AFTER INSERT OR UPDATE OR DELETE ON data_daily_summaries
+    FOR EACH ROW EXECUTE FUNCTION bump_daily_summary_version()
+    """,
+]
+
+# The weekly call totals come from call_count_rollups, so a changed rollup row
+# stamps its date the same way and invalidates the cached weeks covering it.
+_CALL_COUNT_ROLLUP_VERSIONS = [
+    _CALL_COUNT_ROLLUPS_TABLE,
+    """
+    CREATE OR REPLACE FUNCTION bump_call_count_rollup_version() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP <> 'INSERT' THEN
+            INSERT INTO daily_summary_versions(summary_date, version)
+            VALUES (OLD.summary_date, nextval('daily_summary_version_seq'))
+            ON CONFLICT (summary_date) DO UPDATE SET version = EXCLUDED.version;
+        END IF;
+        IF TG_OP <> 'DELETE' THEN
+            INSERT INTO daily_summary_versions(summary_date, version)
+            VALUES (NEW.summary_date, nextval('daily_summary_version_seq'))
+            ON CONFLICT (summary_date) DO UPDATE SET version = EXCLUDED.version;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS bump_call_count_rollup_version ON call_count_rollups",
+    """
+    CREATE TRIGGER bump_call_count_rollup_version
+    AFTER INSERT OR UPDATE OR DELETE ON call_count_rollups
+    FOR EACH ROW EXECUTE FUNCTION bump_call_count_rollup_version()
+    """,
+    # Entries cached before this trigger existed may already hold stale totals
+    "DELETE FROM weekly_summary_cache",
+]
+
+_WEEKLY_SUMMARY_CACHE_TABLE = """
+    CREATE TABLE IF NOT EXISTS weekly_summary_cache (
+        environment_token TEXT NOT NULL,
+        week_start_date DATE NOT NULL,
+        week_end_date DATE NOT NULL,
+        summary_details JSONB NOT NULL,
+        data_version BIGINT NOT NULL,
+        created_at numeric DEFAULT EXTRACT(EPOCH FROM CURRENT_TIMESTAMP),
+        PRIMARY KEY (environment_token, week_start_date, week_end_date)
+    )
+"""
+
+
+def ensure_weekly_summary_cache(environment_token=None):
+    """Create the weekly summary cache and the version triggers that invalidate it, once per tenant.
+
+    Returns False while data_daily_summaries does not exist yet: without its
+    trigger a cached summary could not be invalidated, so callers bypass the
+    cache until the first daily summary is stored.
+    """
+    environment_token = environment_token or get_active_environment_token()
+    key = (environment_token, "weekly_summary_cache")
+    if key in _migrated:
+        return True
+    with _key_lock(key):
+        if key in _migrated:
+            return True
+        migrations = [
+            ("weekly_summary_cache:v1", [_METADATA_DATE_FUNCTION, *_DAILY_SUMMARY_VERSIONS, _WEEKLY_SUMMARY_CACHE_TABLE]),
+            ("weekly_summary_cache:v2", _CALL_COUNT_ROLLUP_VERSIONS),
+        ]
+        with get_connection(environment_token) as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("SELECT to_regclass('data_daily_summaries')")
+                if cursor.fetchone()[0] is None:
+                    return False
+                cursor.execute(_SCHEMA_MIGRATIONS_TABLE)
+                for migration, statements in migrations:
+                    cursor.execute("SELECT pg_advisory_lock(hashtext(%s))", (migration,))
+                    try:
+                        if not _is_applied(cursor, migration):
+                            logger.info("Applying migration %s", migration)
+                            for statement in statements:
+                                cursor.execute(statement)
+                            cursor.execute("INSERT INTO schema_migrations(name) VALUES(%s)", (migration,))
+                    finally:
+                        cursor.execute("SELECT pg_advisory_unlock(hashtext(%s))", (migration,))
+            finally:
+                cursor.close()
+        _migrated.add(key)
+        return True
+
+
+def run_migrations(environment_token=None):
+    """Apply every migration of a tenant in the foreground, e.g. as a deploy step."""
+    environment_token = environment_token or get_active_environment_token()
+    with get_dedicated_connection(environment_token) as conn:
+        for table_name in MIGRATIONS:
+            if _migrate_table(conn, table_name):
+                _migrated.add((environment_token, table_name))
+            else:
+                logger.info("Skipping %s for %s: the table doesn't exist yet", table_name, environment_token)
+    ensure_call_count_rollups(environment_token)
+    if (environment_token, "call_count_rollups") not in _migrated and _backfill_call_count_rollups(environment_token):
+        _migrated.add((environment_token, "call_count_rollups"))
+    ensure_weekly_summary_cache(environment_token)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill typed columns and build indexes of the vector tables")
+    parser.add_argument("environment_tokens", nargs="*", help="Tenants to migrate (defaults to the DB_* settings)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s: %(message)s")
+
+    global MIGRATE_IN_BACKGROUND
+    MIGRATE_IN_BACKGROUND = False
+    if not args.environment_tokens:
+        run_migrations()
+        return
+
+    from common.tenant_context import use_tenant
+    from self_jobs.config_loader import resolve_tenant_context
+    for environment_token in args.environment_tokens:
+        with use_tenant(resolve_tenant_context(environment_token.upper())):
+            run_migrations(environment_token.upper())
+
+
+if __name__ == "__main__":
+    main()
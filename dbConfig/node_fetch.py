@@ -0,0 +1,83 @@
+import logging
+import os
+
+from llama_index.schema import NodeWithScore, TextNode
+from llama_index.vector_stores.utils import legacy_metadata_dict_to_node, metadata_dict_to_node
+
+from dbConfig.migrations import ensure_migrated
+from dbConfig.pool_registry import get_connection
+
+logger = logging.getLogger(__name__)
+
+# "direct" reads the rows a summary needs straight from the table by its typed
+# columns, page by page into common.tree_summarizer; "vector" goes through a
+# similarity search with metadata filters.
+SUMMARY_RETRIEVAL_MODE = os.getenv("SUMMARY_RETRIEVAL_MODE", "direct")
+NODE_FETCH_PAGE_SIZE = int(os.getenv("NODE_FETCH_PAGE_SIZE", "500"))
+
+
+def _row_to_node(text, metadata):
+    # Same reconstruction PGVectorStore does for query results
+    try:
+        node = metadata_dict_to_node(metadata)
+        node.set_content(str(text))
+    except Exception:
+        node_metadata, node_info, relationships = legacy_metadata_dict_to_node(metadata)
+        node = TextNode(
+            text=str(text),
+            id_=metadata.get("doc_id"),
+            metadata=node_metadata,
+            start_char_idx=node_info.get("start", None),
+            end_char_idx=node_info.get("end", None),
+            relationships=relationships,
+        )
+    return node
+
+
+def iter_node_pages(table_name, where, params, environment_token=None, page_size=None):
+    """Yield the nodes of data_<table_name> matching where as lists of at most page_size, in insertion order.
+
+    Pages are read by keyset on id, each with its own short connection
+    checkout, so a slow consumer between pages does not hold a pooled
+    connection or an open transaction.
+    """
+    page_size = page_size or NODE_FETCH_PAGE_SIZE
+    ensure_migrated(f"data_{table_name}", environment_token)
+    last_id = 0
+    fetched = 0
+    while True:
+        with get_connection(environment_token) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"SELECT id, text, metadata_ FROM data_{table_name} WHERE ({where}) AND id > %s ORDER BY id LIMIT %s",
+                (*params, last_id, page_size),
+            )
+            rows = cursor.fetchall()
+            cursor.close()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        fetched += len(rows)
+        yield [NodeWithScore(node=_row_to_node(text, metadata), score=1.0) for _, text, metadata in rows]
+        if len(rows) < page_size:
+            break
+    logger.info("Fetched %s nodes from data_%s in pages of %s", fetched, table_name, page_size)
+
+
+def iter_call_transcript_pages(representative_name, call_date, environment_token=None):
+    return iter_node_pages(
+        "call_transcripts",
+        "call_date >= %s::date AND call_date < %s::date + 1 AND representative_name = %s",
+        (call_date, call_date, representative_name),
+        environment_token,
+    )
+
+
+def iter_summary_pages(table_name, start_date, end_date, environment_token=None):
+    """Pages of a summaries table whose summary_date falls between start_date and end_date (inclusive)."""
+    return iter_node_pages(
+        table_name,
+        "summary_date >= %s::date AND summary_date < %s::date + 1",
+        (start_date, end_date),
+        environment_token,
+    )
@@ -0,0 +1,233 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extras
+import psycopg2.pool
+
+from common.tenant_context import get_current_tenant
+
+psycopg2.extras.register_uuid()
+
+DEFAULT_TENANT = "DEFAULT"
+
+pool_min_connections = int(os.getenv("DB_POOL_MIN_CONNECTIONS", "1"))
+pool_max_connections = int(os.getenv("DB_POOL_MAX_CONNECTIONS", "10"))
+pool_checkout_timeout = float(os.getenv("DB_POOL_CHECKOUT_TIMEOUT", "30"))
+
+_tenant_settings = {}
+_pools = {}
+_registry_lock = threading.Lock()
+
+
+class _TenantPool:
+    """A bounded ThreadedConnectionPool plus the bookkeeping used for saturation reporting.
+
+    psycopg2's ThreadedConnectionPool raises PoolError when maxconn is reached;
+    the semaphore makes callers wait for a free connection instead.
+    """
+
+    def __init__(self, environment_token, settings):
+        self.environment_token = environment_token
+        self.max_connections = pool_max_connections
+        self.pool = psycopg2.pool.ThreadedConnectionPool(
+            min(pool_min_connections, pool_max_connections),
+            pool_max_connections,
+            host=settings["host"],
+            port=settings["port"],
+            user=settings["user"],
+            password=settings["password"],
+            database=settings["database"],
+        )
+        self.slots = threading.BoundedSemaphore(pool_max_connections)
+        self.stats_lock = threading.Lock()
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.checkouts = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.total_wait_seconds = 0.0
+        # Set once the tenant's settings changed; connections are closed as they come back
+        self.retired = False
+
+    def checkout(self):
+        start_time = time.monotonic()
+        acquired = self.slots.acquire(blocking=False)
+        if not acquired:
+            with self.stats_lock:
+                self.waits += 1
+            logging.warning(
+                "Postgres pool for %s is saturated (%s/%s connections in use), waiting",
+                self.environment_token, self.in_use, self.max_connections,
+            )
+            acquired = self.slots.acquire(timeout=pool_checkout_timeout)
+        if not acquired:
+            with self.stats_lock:
+                self.timeouts += 1
+            raise psycopg2.pool.PoolError(
+                f"Timed out after {pool_checkout_timeout}s waiting for a connection "
+                f"for environment_token {self.environment_token}"
+            )
+
+        try:
+            conn = self.pool.getconn()
+        except Exception:
+            self.slots.release()
+            raise
+        with self.stats_lock:
+            self.in_use += 1
+            self.checkouts += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+            self.total_wait_seconds += time.monotonic() - start_time
+        return conn
+
+    def checkin(self, conn, broken=False):
+        try:
+            self.pool.putconn(conn, close=broken or bool(conn.closed) or self.retired)
+        finally:
+            with self.stats_lock:
+                self.in_use -= 1
+                drained = self.retired and self.in_use == 0
+            self.slots.release()
+            if drained:
+                self.pool.closeall()
+
+    def retire(self):
+        """Stop reusing this pool's connections without breaking the ones still checked out.
+
+        Idle connections are closed now if nothing is checked out; otherwise
+        each connection is closed on checkin and the pool once the last one is back.
+        """
+        with self.stats_lock:
+            self.retired = True
+            drained = self.in_use == 0
+        if drained:
+            self.pool.closeall()
+
+    def stats(self):
+        with self.stats_lock:
+            return {
+                "in_use": self.in_use,
+                "max_connections": self.max_connections,
+                "peak_in_use": self.peak_in_use,
+                "checkouts": self.checkouts,
+                "waits": self.waits,
+                "timeouts": self.timeouts,
+                "avg_wait_ms": round(
+                    1000 * self.total_wait_seconds / self.checkouts, 2
+                ) if self.checkouts else 0.0,
+                "saturated": self.in_use >= self.max_connections,
+            }
+
+
+def register_tenant_database(environment_token, settings):
+    """Record the Postgres settings for a tenant; its pool is created on first checkout.
+
+    If the settings changed since the pool was created, the old pool is retired:
+    queries in flight finish on their connections, which are closed as they are returned.
+    """
+    settings = dict(settings)
+    with _registry_lock:
+        if _tenant_settings.get(environment_token) == settings:
+            return
+        _tenant_settings[environment_token] = settings
+        stale_pool = _pools.pop(environment_token, None)
+    if stale_pool is not None:
+        logging.info("DB settings changed for %s, retiring old pool", environment_token)
+        stale_pool.retire()
+
+
+def get_active_environment_token():
+    tenant = get_current_tenant()
+    return tenant.environment_token if tenant is not None else DEFAULT_TENANT
+
+
+def get_tenant_database_settings(environment_token=None):
+    environment_token = environment_token or get_active_environment_token()
+    settings = _tenant_settings.get(environment_token)
+    tenant = get_current_tenant()
+    if settings is None and tenant is not None and tenant.environment_token == environment_token:
+        settings = tenant.db
+    if settings is None and environment_token == DEFAULT_TENANT:
+        settings = {
+            "host": os.getenv("DB_HOST"),
+            "port": os.getenv("DB_PORT"),
+            "user": os.getenv("DB_USER"),
+            "password": os.getenv("DB_PASSWORD"),
+            "database": os.getenv("DB_NAME"),
+        }
+    if settings is None or None in settings.values():
+        raise KeyError(f"No valid DB configuration for environment_token {environment_token}")
+    return settings
+
+
+def _get_pool(environment_token):
+    tenant_pool = _pools.get(environment_token)
+    if tenant_pool is not None:
+        return tenant_pool
+    settings = get_tenant_database_settings(environment_token)
+    with _registry_lock:
+        tenant_pool = _pools.get(environment_token)
+        if tenant_pool is None:
+            logging.info(
+                "Creating Postgres pool for %s (max %s connections)",
+                environment_token, pool_max_connections,
+            )
+            tenant_pool = _TenantPool(environment_token, settings)
+            _pools[environment_token] = tenant_pool
+    return tenant_pool
+
+
+@contextmanager
+def get_connection(environment_token=None):
+    """Check out an autocommit connection from the tenant's pool for the duration of the block."""
+    tenant_pool = _get_pool(environment_token or get_active_environment_token())
+    conn = tenant_pool.checkout()
+    broken = False
+    try:
+        conn.autocommit = True
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
+    finally:
+        tenant_pool.checkin(conn, broken=broken)
+
+
+@contextmanager
+def get_dedicated_connection(environment_token=None):
+    """Open an autocommit connection of the tenant's database outside its pool, closed after the block.
+
+    For sessions held across long work (e.g. advisory locks), which would
+    otherwise occupy a pooled connection while the same work checks out others.
+    """
+    settings = get_tenant_database_settings(environment_token)
+    conn = psycopg2.connect(
+        host=settings["host"],
+        port=settings["port"],
+        user=settings["user"],
+        password=settings["password"],
+        database=settings["database"],
+    )
+    try:
+        conn.autocommit = True
+        yield conn
+    finally:
+        conn.close()
+
+
+def get_pool_stats():
+    with _registry_lock:
+        pools = dict(_pools)
+    return {token: tenant_pool.stats() for token, tenant_pool in pools.items()}
+
+
+def close_all_pools():
+    with _registry_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for tenant_pool in pools:
+        tenant_pool.pool.closeall()
@@ -1,110 +1,163 @@
+import json
 import logging
 import os
+import time
 import psycopg2
 import psycopg2.extras
 from dotenv import load_dotenv
-from llama_index.vector_stores import PGVectorStore
+from dbConfig.constants import successful_call_dispositions
+from dbConfig.migrations import ensure_call_count_rollups, ensure_migrated, ensure_weekly_summary_cache
+from dbConfig.pool_registry import get_active_environment_token, get_connection
+from dbConfig.vector_store_cache import get_vector_index, get_vector_store
 
 
 psycopg2.extras.register_uuid()
 
 load_dotenv()
 
-db_host = os.getenv("DB_HOST")
-db_port = os.getenv("DB_PORT")
-db_user = os.getenv("DB_USER") 
-db_password = os.getenv("DB_PASSWORD") 
-db_name = os.getenv("DB_NAME")
-
-if (db_host != None and db_port != None and db_user != None
-        and db_password != None and db_name != None):
-    conn = psycopg2.connect(host=db_host,
-                            database=db_name,
-                            user=db_user,
-                            password=db_password,
-                            port=db_port)
-    conn.autocommit = True
-else:
-    print("Provide valid DB configurations")
-
-
-def get_vector_store(table_name):
-    return PGVectorStore.from_params(
-        database=db_name,
-        host=db_host,
-        password=db_password,
-        port=db_port,
-        user=db_user,
-        table_name=table_name,
-        embed_dim=1536,
-    )
-
 
 def get_daily_summary_count_by_summary_date(week_start_date, week_end_date):
+    ensure_migrated("data_daily_summaries")
+    ensure_call_count_rollups()
+    cursor = None
     try:
-        cursor = conn.cursor()
-        query = f"""
-            select
-                sum(daily_total_calls_count) as weekly_total_calls_count,
-                sum(daily_successful_call_count) as weekly_successful_calls_count,
-                sum(daily_unsuccessful_call_count) as weekly_unsuccessful_calls_count,
-                count(row_count) as row_count
-            from
-                (
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            # Call totals come from the per-day rollup maintained at transcript
+            # ingest; row_count is still the number of daily summaries in the range
+            query = """
                 select
-                    sum((metadata_->>'total_calls_count')::numeric) as daily_total_calls_count,
-                    sum((metadata_->>'successful_call_count')::numeric) as daily_successful_call_count,
-                    sum((metadata_->>'unsuccessful_call_count')::numeric) as daily_unsuccessful_call_count,
-                    count(id)::numeric as "row_count",
-                    metadata_->>'summary_date' as summary_date
+                    coalesce(sum(call_count), 0) as weekly_total_calls_count,
+                    coalesce(sum(call_count) filter (where call_disposition = any(%(successful)s)), 0)
+                        as weekly_successful_calls_count,
+                    coalesce(sum(call_count) filter (where call_disposition <> '' and call_disposition <> all(%(successful)s)), 0)
+                        as weekly_unsuccessful_calls_count,
+                    (
+                        select count(distinct das.summary_date)
+                        from data_daily_summaries das
+                        where das.summary_date >= %(week_start_date)s::date
+                          and das.summary_date < %(week_end_date)s::date + 1
+                    ) as row_count
                 from
-                    data_daily_summaries das
+                    call_count_rollups
                 where
-                    TO_CHAR((metadata_->>'summary_date')::timestamp,
-                    'yyyy-mm-dd') between '{week_start_date}' and '{week_end_date}'
-                group by
-                    summary_date
-                ) as "result"
-        """
-        cursor.execute(query)
-
-        columns = list(cursor.description)
-        messages = cursor.fetchall()
-        cursor.close()
-
-        # make dict
-        results = {}
-        for row in messages:
-            for i, col in enumerate(columns):
-                results[col.name] = row[i]
-
-        return results
+                    environment_token = %(environment_token)s
+                    and summary_date >= %(week_start_date)s::date
+                    and summary_date < %(week_end_date)s::date + 1
+            """
+            cursor.execute(query, {
+                "week_start_date": week_start_date,
+                "week_end_date": week_end_date,
+                "successful": successful_call_dispositions,
+                "environment_token": get_active_environment_token(),
+            })
+
+            columns = list(cursor.description)
+            messages = cursor.fetchall()
+            cursor.close()
+
+            # make dict
+            results = {}
+            for row in messages:
+                for i, col in enumerate(columns):
+                    results[col.name] = row[i]
+
+            return results
     except (Exception, psycopg2.DatabaseError) as e:
         logging.error(e)
-        cursor.close()
+        if cursor is not None:
+            cursor.close()
         exit(1)
 
 
-def create_message_history_table():
-    try:
+def get_weekly_summary_cache(week_start_date, week_end_date):
+    """Return (cached, data_version) for the current tenant and range.
+
+    data_version identifies the daily summaries and call counts of the range as
+    they are now; cached is {"summary_details", "age_seconds"} when a summary
+    was stored for that same version, else None. Both are None while the cache is unavailable.
+    """
+    environment_token = get_active_environment_token()
+    if not ensure_weekly_summary_cache(environment_token):
+        return None, None
+    with get_connection(environment_token) as conn:
         cursor = conn.cursor()
-        table_creation = """
-            CREATE TABLE IF NOT EXISTS message_history (
-                id SERIAL PRIMARY KEY,
-                message TEXT NOT NULL,
-                message_role TEXT NOT NULL,
-                user_id numeric,
-                session_id uuid,
-                created_at numeric DEFAULT EXTRACT(EPOCH FROM CURRENT_TIMESTAMP),
-                week_start_date DATE,
-                week_end_date DATE
-            )
-        """
-        cursor.execute(table_creation)
+        cursor.execute(
+            """
+            SELECT
+                (
+                    SELECT coalesce(max(version), 0) FROM daily_summary_versions
+                    WHERE summary_date >= %(week_start_date)s::date AND summary_date < %(week_end_date)s::date + 1
+                ) AS data_version,
+                c.summary_details,
+                c.data_version,
+                c.created_at
+            FROM (SELECT 1) current_version
+            LEFT JOIN weekly_summary_cache c
+                ON c.environment_token = %(environment_token)s
+                AND c.week_start_date = %(week_start_date)s::date
+                AND c.week_end_date = %(week_end_date)s::date
+            """,
+            {
+                "environment_token": environment_token,
+                "week_start_date": week_start_date,
+                "week_end_date": week_end_date,
+            },
+        )
+        data_version, summary_details, cached_version, created_at = cursor.fetchone()
         cursor.close()
+    if summary_details is None or cached_version != data_version:
+        return None, data_version
+    return {
+        "summary_details": summary_details,
+        "age_seconds": round(max(time.time() - float(created_at), 0.0), 1),
+    }, data_version
+
+
+def save_weekly_summary_cache(week_start_date, week_end_date, summary_details, data_version):
+    """Store a generated summary for the range, tagged with the data_version it was generated from."""
+    environment_token = get_active_environment_token()
+    with get_connection(environment_token) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            INSERT INTO weekly_summary_cache(environment_token, week_start_date, week_end_date, summary_details, data_version)
+            VALUES(%s, %s::date, %s::date, %s::jsonb, %s)
+            ON CONFLICT (environment_token, week_start_date, week_end_date) DO UPDATE SET
+                summary_details = EXCLUDED.summary_details,
+                data_version = EXCLUDED.data_version,
+                created_at = EXTRACT(EPOCH FROM CURRENT_TIMESTAMP)
+            -- A slower run that started from older data must not replace a newer entry
+            WHERE weekly_summary_cache.data_version <= EXCLUDED.data_version
+            """,
+            (environment_token, week_start_date, week_end_date, json.dumps(summary_details), data_version),
+        )
+        cursor.close()
+
+
+def create_message_history_table():
+    cursor = None
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            table_creation = """
+                CREATE TABLE IF NOT EXISTS message_history (
+                    id SERIAL PRIMARY KEY,
+                    message TEXT NOT NULL,
+                    message_role TEXT NOT NULL,
+                    user_id numeric,
+                    session_id uuid,
+                    created_at numeric DEFAULT EXTRACT(EPOCH FROM CURRENT_TIMESTAMP),
+                    week_start_date DATE,
+                    week_end_date DATE
+                )
+            """
+            cursor.execute(table_creation)
+            cursor.close()
     except (Exception, psycopg2.DatabaseError) as e:
         logging.error(e)
-        cursor.close()
+        if cursor is not None:
+            cursor.close()
         exit(1)
 
 
@@ -114,47 +167,53 @@ def save_message_history(message,
                          session_id,
                          week_end_date=None,
                          week_start_date=None):
+    cursor = None
     try:
         create_message_history_table()
-        cursor = conn.cursor()
-
-        if week_start_date is None:
-            week_start_date = None
-        if week_end_date is None:
-            week_end_date = None
-
-        insert_query = f"""INSERT INTO message_history(message, message_role, user_id, session_id, week_end_date, week_start_date) VALUES(%s, %s, %s, %s, %s, %s);"""
-        cursor.execute(insert_query,
-                       (message, message_role, user_id, session_id,
-                        week_end_date, week_start_date))
-        cursor.close()
-        return "Message saved successfully!"
+        with get_connection() as conn:
+            cursor = conn.cursor()
+
+            if week_start_date is None:
+                week_start_date = None
+            if week_end_date is None:
+                week_end_date = None
+
+            insert_query = f"""INSERT INTO message_history(message, message_role, user_id, session_id, week_end_date, week_start_date) VALUES(%s, %s, %s, %s, %s, %s);"""
+            cursor.execute(insert_query,
+                           (message, message_role, user_id, session_id,
+                            week_end_date, week_start_date))
+            cursor.close()
+            return "Message saved successfully!"
     except (Exception, psycopg2.DatabaseError) as e:
         logging.error(e)
-        cursor.close()
+        if cursor is not None:
+            cursor.close()
         exit(1)
 
 
 def get_message_history(user_id):
+    cursor = None
     try:
         create_message_history_table()
-        cursor = conn.cursor()
-        messages_query = f"""SELECT message, message_role, created_at from message_history WHERE user_id = '{user_id}' order by created_at desc limit 4"""
-        cursor.execute(messages_query)
-
-        columns = list(cursor.description)
-        messages = cursor.fetchall()
-        cursor.close()
-
-        results = []
-        for row in messages:
-            row_dict = {}
-            for i, col in enumerate(columns):
-                row_dict[col.name] = row[i]
-            results.append(row_dict)
-
-        return results
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            messages_query = f"""SELECT message, message_role, created_at from message_history WHERE user_id = '{user_id}' order by created_at desc limit 4"""
+            cursor.execute(messages_query)
+
+            columns = list(cursor.description)
+            messages = cursor.fetchall()
+            cursor.close()
+
+            results = []
+            for row in messages:
+                row_dict = {}
+                for i, col in enumerate(columns):
+                    row_dict[col.name] = row[i]
+                results.append(row_dict)
+
+            return results
     except (Exception, psycopg2.DatabaseError) as e:
         logging.error(e)
-        cursor.close()
+        if cursor is not None:
+            cursor.close()
         exit(1)
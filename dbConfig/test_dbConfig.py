@@ -1,3 +1,73 @@
+import pytest
+
+from common.tenant_context import TenantContext, use_tenant
+from dbConfig import migrations, pool_registry
+
+
 # Example content of test_common.py
 def test_example():
     assert 1 == 1
+
+
+def test_registered_tenant_settings_are_returned():
+    settings = {"host": "h", "port": "5432", "user": "u", "password": "p", "database": "d"}
+    pool_registry.register_tenant_database("TENANT_A", settings)
+    assert pool_registry.get_tenant_database_settings("TENANT_A") == settings
+
+
+def test_unknown_tenant_settings_raise_key_error():
+    with pytest.raises(KeyError):
+        pool_registry.get_tenant_database_settings("UNKNOWN_TENANT")
+
+
+def test_active_environment_token_defaults_when_unset():
+    assert pool_registry.get_active_environment_token() == pool_registry.DEFAULT_TENANT
+
+
+def test_active_environment_token_follows_current_tenant():
+    tenant = TenantContext(environment_token="TENANT_B")
+    with use_tenant(tenant):
+        assert pool_registry.get_active_environment_token() == "TENANT_B"
+    assert pool_registry.get_active_environment_token() == pool_registry.DEFAULT_TENANT
+
+
+class _FakeConnection:
+    closed = 0
+
+
+class _FakePool:
+    def __init__(self, *args, **kwargs):
+        self.put = []
+        self.closed = False
+
+    def getconn(self):
+        return _FakeConnection()
+
+    def putconn(self, conn, close=False):
+        self.put.append(close)
+
+    def closeall(self):
+        self.closed = True
+
+
+def test_retired_pool_closes_connections_as_they_are_returned(monkeypatch):
+    monkeypatch.setattr(pool_registry.psycopg2.pool, "ThreadedConnectionPool", _FakePool)
+    settings = {"host": "h", "port": "5432", "user": "u", "password": "p", "database": "d"}
+    tenant_pool = pool_registry._TenantPool("TENANT_C", settings)
+    first, second = tenant_pool.checkout(), tenant_pool.checkout()
+
+    tenant_pool.retire()
+    assert not tenant_pool.pool.closed
+
+    tenant_pool.checkin(first)
+    assert tenant_pool.pool.put == [True]
+    assert not tenant_pool.pool.closed
+
+    tenant_pool.checkin(second)
+    assert tenant_pool.pool.closed
+
+
+def test_invalid_index_cleanup_only_targets_the_migrations_own_indexes():
+    for table_name, (_, _, indexes) in migrations.MIGRATIONS.items():
+        names = [migrations._index_name(statement) for statement in indexes]
+        assert all(name.startswith(f"{table_name}_") for name in names)
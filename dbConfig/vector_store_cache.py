@@ -0,0 +1,101 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from llama_index import ServiceContext, VectorStoreIndex
+from llama_index.vector_stores import PGVectorStore
+
+from dbConfig.pool_registry import get_active_environment_token, get_tenant_database_settings
+
+EMBED_DIM = 1536
+
+cache_max_entries = int(os.getenv("VECTOR_STORE_CACHE_SIZE", "32"))
+cache_ttl_seconds = float(os.getenv("VECTOR_STORE_CACHE_TTL", "3600"))
+
+# (environment_token, table_name) -> {"vector_store", "index", "settings", "created_at"}
+_entries = OrderedDict()
+_cache_lock = threading.RLock()
+
+
+def _dispose(entry):
+    # PGVectorStore keeps its SQLAlchemy engine private; dispose it so evicted
+    # entries don't keep their pooled connections open.
+    engine = getattr(entry["vector_store"], "_engine", None)
+    if engine is not None:
+        try:
+            engine.dispose()
+        except Exception as e:
+            logging.warning(f"Failed to dispose vector store engine: {e}")
+
+
+def _get_entry(table_name, environment_token):
+    environment_token = environment_token or get_active_environment_token()
+    settings = get_tenant_database_settings(environment_token)
+    key = (environment_token, table_name)
+
+    with _cache_lock:
+        entry = _entries.get(key)
+        if entry is not None:
+            expired = time.monotonic() - entry["created_at"] > cache_ttl_seconds
+            if not expired and entry["settings"] == settings:
+                _entries.move_to_end(key)
+                return entry
+            _dispose(_entries.pop(key))
+
+        logging.info(f"Creating vector store for table {table_name} ({environment_token})")
+        entry = {
+            "vector_store": PGVectorStore.from_params(
+                database=settings["database"],
+                host=settings["host"],
+                password=settings["password"],
+                port=settings["port"],
+                user=settings["user"],
+                table_name=table_name,
+                embed_dim=EMBED_DIM,
+            ),
+            "index": None,
+            "settings": settings,
+            "created_at": time.monotonic(),
+        }
+        _entries[key] = entry
+        while len(_entries) > cache_max_entries:
+            evicted_key, evicted = _entries.popitem(last=False)
+            logging.info(f"Evicting vector store {evicted_key[1]} ({evicted_key[0]})")
+            _dispose(evicted)
+        return entry
+
+
+def get_vector_store(table_name, environment_token=None):
+    """Return the cached PGVectorStore for the tenant's table, creating it on first use."""
+    return _get_entry(table_name, environment_token)["vector_store"]
+
+
+def get_vector_index(table_name, service_context=None, environment_token=None):
+    """Return a cached VectorStoreIndex over the tenant's table.
+
+    The index is shared, so callers should pass their own service_context to
+    as_query_engine()/retrievers rather than relying on the one it was built with.
+    """
+    entry = _get_entry(table_name, environment_token)
+    with _cache_lock:
+        if entry["index"] is None:
+            entry["index"] = VectorStoreIndex.from_vector_store(
+                entry["vector_store"],
+                service_context=service_context or ServiceContext.from_defaults(),
+            )
+        return entry["index"]
+
+
+def invalidate_vector_stores(environment_token=None, table_name=None):
+    """Drop cached handles matching the given tenant and/or table (all of them when both are None)."""
+    with _cache_lock:
+        keys = [
+            key for key in _entries
+            if (environment_token is None or key[0] == environment_token)
+            and (table_name is None or key[1] == table_name)
+        ]
+        for key in keys:
+            _dispose(_entries.pop(key))
+    return len(keys)
@@ -5,7 +5,7 @@ import uuid
 import random
 import datetime
 from flask import Flask, request, jsonify
-from common.answer_followup_questions import answer_followup_question
+from common.answer_followup_questions import answer_followup_question, warm_up_followup_agent
 from common.generate_summary_for_range import summary_for_date_range
 from flask_swagger_ui import get_swaggerui_blueprint
 from flask_cors import CORS
@@ -13,6 +13,7 @@ import pymssql
 import pika
 
 from self_jobs.config_loader import load_and_set_config, update_config_based_on_token
+from dbConfig.pool_registry import get_pool_stats
 
 # Load and set configurations
 load_and_set_config()
@@ -140,6 +141,9 @@ def healthcheck():
     except Exception as e:
         response['sqlserver'] = {'status': 'FAILURE', 'error': str(e)}
 
+    # Postgres pool usage per environment token
+    response['postgres_pools'] = {'status': 'SUCCESS', 'pools': get_pool_stats()}
+
     # Health check for RabbitMQ
     try:
         credentials = pika.PlainCredentials(rabbitmq_config['user'], rabbitmq_config['password'])
@@ -157,5 +161,13 @@ def healthcheck():
     status_code = 200 if all(service['status'] == 'SUCCESS' for service in response.values()) else 500
     return jsonify(response), status_code
 
+def warm_up_followup_agents():
+    # Comma separated environment tokens whose follow-up agents are prebuilt at startup
+    warmup_tokens = os.getenv('FOLLOWUP_AGENT_WARMUP_TOKENS', '')
+    for environment_token in filter(None, (token.strip().upper() for token in warmup_tokens.split(','))):
+        update_config_based_on_token(environment_token)
+        warm_up_followup_agent(environment_token)
+
 if __name__ == '__main__':
+    warm_up_followup_agents()
     app.run(host="0.0.0.0", port=5000, debug=True)
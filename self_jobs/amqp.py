@@ -2,14 +2,16 @@ import os
 import json
 import sys
 import openai
-import shutil
 import pika
 import logging
 import time
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from google.cloud import storage
 from datetime import datetime, timedelta
-from threading import Thread
+from threading import Lock, Thread
 from config_loader import load_and_set_config, update_config_based_on_token
 
 # Set up logging
@@ -32,10 +34,14 @@ heartbeat_interval = timedelta(seconds=30).total_seconds()
 project_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 sys.path.insert(0, project_dir)
 
-from generate_embeddings import generating_embeddings
+from generate_embeddings import ALREADY_INGESTED, generating_embeddings
 from generate_recordings_summary import generating_summary_of_each_recordings
 from endpoints import get_agent_summary, get_daily_summary
 from generate_call_notes import generate_and_save_call_notes
+from retry_queues import declare_retry_topology, defer_message, retry_or_dead_letter
+from async_consumer import run_consumers
+from summary_coalescing import SummaryDeferred, generate_summaries_coalesced
+from common.tenant_context import get_current_tenant
 
 current_dir = os.path.dirname(os.path.realpath(__file__))
 root_dir = os.path.dirname(current_dir)
@@ -45,6 +51,38 @@ load_dotenv(dotenv_path)
 UPLOAD_FOLDER = "uploads"
 ALLOWED_EXTENSIONS = {"mp3", "wav", "ogg", "txt"}
 
+# Each message_type runs in its own lane with its own worker limit, so short,
+# user-facing call notes never queue behind transcriptions or summary runs.
+LANE_WORKERS = {
+    "call_notes": int(os.getenv("CALL_NOTES_WORKERS", "2")),
+    "transcript": int(os.getenv("TRANSCRIPT_WORKERS", "1")),
+    "summary": int(os.getenv("SUMMARY_WORKERS", "1")),
+}
+# Unknown or unparsable messages are cheap to handle, so they share the fast lane
+DEFAULT_LANE = "call_notes"
+# Deliveries of RABBITMQ_QUEUE are only routed to their lane's queue, which is cheap,
+# so this prefetch just keeps routing pipelined
+CONSUMER_PREFETCH = int(os.getenv("CONSUMER_PREFETCH", str(4 * sum(LANE_WORKERS.values()))))
+# Each lane consumes its own queue on its own channel with this prefetch, so a
+# transcript or summary backlog waits in the broker, in order, and never takes
+# the prefetch slots of call notes.
+LANE_MAX_IN_FLIGHT = {
+    "call_notes": int(os.getenv("CALL_NOTES_MAX_IN_FLIGHT", str(4 * LANE_WORKERS["call_notes"]))),
+    "transcript": int(os.getenv("TRANSCRIPT_MAX_IN_FLIGHT", str(2 * LANE_WORKERS["transcript"]))),
+    "summary": int(os.getenv("SUMMARY_MAX_IN_FLIGHT", str(2 * LANE_WORKERS["summary"]))),
+}
+
+# "threads" runs one blocking connection per RabbitMQ host; "asyncio" multiplexes
+# every host on a single event loop, which keeps overhead flat as tenants grow
+CONSUMER_MODE = os.getenv("CONSUMER_MODE", "threads")
+
+lanes = {
+    lane: ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"lane-{lane}")
+    for lane, workers in LANE_WORKERS.items()
+}
+lane_depths = {lane: 0 for lane in LANE_WORKERS}
+lane_depths_lock = Lock()
+
 def connect_to_rabbitmq(host, port, user, password, vhost, heartbeat_interval):
     credentials = pika.PlainCredentials(username=user, password=password)
     connection = pika.BlockingConnection(
@@ -62,78 +100,221 @@ def connect_to_rabbitmq(host, port, user, password, vhost, heartbeat_interval):
     )
     return connection
 
-def process_data_and_store(ch, method, properties, body):
-    data = body.decode("utf-8")
-    parsed_data = None
-    try:
-        # Step 1: Parse JSON data
-        parsed_data = json.loads(data)
-        logger.info("Received message: %s", parsed_data)
-
-        # Step 2: Extract and validate environment token
-        environment_token = parsed_data.get("environment_token")
-        if environment_token:
-            environment_token = environment_token.upper()
-            logger.info(f"Environment Token sending for updation: {environment_token}")
-            update_config_based_on_token(environment_token)
-        if not environment_token:
-            logger.error("No environment_token found in the message")
-            return
-
-        # Step 3: Process the message based on message_type
-        message_type = parsed_data.get("message_type")
-        if message_type == "summary":
-            current_date_str = parsed_data.get("call_date")
-            current_date = datetime.strptime(current_date_str, "%m/%d/%Y %I:%M:%S %p")
-            formatted_date = current_date.strftime("%Y-%m-%d")
+def handle_message(parsed_data, received_at=None):
+    # Step 2: Extract and validate environment token
+    environment_token = parsed_data.get("environment_token")
+    if environment_token:
+        environment_token = environment_token.upper()
+        logger.info(f"Environment Token sending for updation: {environment_token}")
+        update_config_based_on_token(environment_token)
+    if not environment_token:
+        logger.error("No environment_token found in the message")
+        return False
+
+    # Step 3: Process the message based on message_type
+    message_type = parsed_data.get("message_type")
+    if message_type == "summary":
+        current_date_str = parsed_data.get("call_date")
+        current_date = datetime.strptime(current_date_str, "%m/%d/%Y %I:%M:%S %p")
+        formatted_date = current_date.strftime("%Y-%m-%d")
+
+        def generate():
             get_agent_summary(formatted_date)
             get_daily_summary(formatted_date)
             logger.info("Summaries generated for date: %s", formatted_date)
 
-        elif message_type == "call_notes":
-            generate_and_save_call_notes(parsed_data)
+        generate_summaries_coalesced(environment_token, formatted_date, received_at or time.time(), generate)
+
+    elif message_type == "call_notes":
+        generate_and_save_call_notes(parsed_data)
 
-        elif message_type == "transcript":
-            file_name = parsed_data.get("file_name")
-            destination_path = download_file_from_gcp(file_name)
+    elif message_type == "transcript":
+        file_name = parsed_data.get("file_name")
+        destination_path = download_file_from_gcp(file_name)
+        try:
             generate_recording_summary(file_name, destination_path, parsed_data)
             logger.info("Data processed and file downloaded: %s", file_name)
-            shutil.rmtree(UPLOAD_FOLDER)
-            logger.info("Uploads folder cleaned up")
+        finally:
+            # Only this message's file: other workers may still be using the uploads folder
+            if destination_path and os.path.exists(destination_path):
+                os.remove(destination_path)
+                logger.info("Downloaded file cleaned up: %s", destination_path)
 
-        else:
-            logger.warning("No action to be performed on this message type: %s", message_type)
+    else:
+        logger.warning("No action to be performed on this message type: %s", message_type)
+    return True
 
-        # Acknowledge the message only if processing succeeds
-        ch.basic_ack(delivery_tag=method.delivery_tag)
-        logger.info("Message acknowledged")
+
+def process_message(body, received_at=None):
+    """Run a delivery through its handler and return (outcome, reason).
+
+    outcome is "ack" on success, "retry" for failures worth another attempt
+    after a delay, "defer" for messages to offer again later without counting
+    an attempt, and "dead" for messages that can never succeed.
+    received_at is when the consumer got the delivery, before it waited in a lane.
+    """
+    data = body.decode("utf-8")
+    parsed_data = None
+    try:
+        # Step 1: Parse JSON data
+        parsed_data = json.loads(data)
+        logger.info("Received message: %s", parsed_data)
+        if not handle_message(parsed_data, received_at):
+            return "dead", "No environment_token found in the message"
+        return "ack", None
 
     except json.JSONDecodeError as e:
-        logger.error("Message not acknowledged due to JSON parsing error. Error parsing JSON: %s", e)
+        logger.error("Error parsing JSON: %s", e)
+        return "dead", f"JSON parsing error: {e}"
+
+    except SummaryDeferred as e:
+        logger.info("%s, deferring message", e)
+        return "defer", str(e)
 
     except KeyError as e:
-        logger.error("Message not acknowledged due to missing configuration. Configuration error: %s", e)
+        logger.error("Configuration error: %s", e)
+        return "retry", f"Missing configuration: {e}"
 
     except Exception as e:
         logger.error("Error processing message: %s", e, exc_info=True)
-        ch.basic_nack(delivery_tag=method.delivery_tag)
-        logger.info("Message not acknowledged due to error")
+        return "retry", f"{type(e).__name__}: {e}"
+
+
+def republish_message(ch, properties, body, outcome, reason):
+    """Publish a delivery that was not handled ("defer", "retry" or "dead") to the queue it moves to."""
+    if outcome == "defer":
+        defer_message(ch, os.getenv("RABBITMQ_QUEUE"), properties, body)
+    else:
+        retry_or_dead_letter(ch, os.getenv("RABBITMQ_QUEUE"), properties, body, reason,
+                             permanent=outcome == "dead")
+
+
+def settle_message(ch, delivery_tag, properties, body, outcome, reason):
+    # Must run on the connection's thread; pika channels are not thread-safe
+    if not ch.is_open:
+        logger.warning("Channel closed before message %s could be settled; it will be redelivered", delivery_tag)
+        return
+    if outcome != "ack":
+        try:
+            # The channel is in confirm mode, so this returns once the broker has the copy
+            republish_message(ch, properties, body, outcome, reason)
+        except pika.exceptions.AMQPError as e:
+            # Leave it unacknowledged; the broker redelivers it when the channel is recovered
+            logger.error("Could not republish message %s: %s", delivery_tag, e)
+            return
+    ch.basic_ack(delivery_tag=delivery_tag)
+    logger.info("Message acknowledged")
+
+
+def get_message_lane(body):
+    try:
+        message_type = json.loads(body.decode("utf-8")).get("message_type")
+    except (ValueError, AttributeError):
+        return DEFAULT_LANE
+    return message_type if message_type in lanes else DEFAULT_LANE
+
+
+def lane_queue_name(lane):
+    return f"{os.getenv('RABBITMQ_QUEUE')}.lane.{lane}"
+
+
+def get_lane_queues():
+    """Return {lane: (queue, prefetch)} for the lane queues a host consumer declares and consumes."""
+    return {lane: (lane_queue_name(lane), LANE_MAX_IN_FLIGHT[lane]) for lane in LANE_WORKERS}
+
+
+def route_message(ch, properties, body):
+    """Publish a delivery of RABBITMQ_QUEUE unchanged to its lane's queue; the caller acks it once confirmed."""
+    lane = get_message_lane(body)
+    ch.basic_publish(exchange="", routing_key=lane_queue_name(lane), body=body, properties=properties)
+    logger.info("Routed message to the %s lane", lane)
+
+
+def get_lane_stats():
+    with lane_depths_lock:
+        return {
+            lane: {
+                "workers": LANE_WORKERS[lane],
+                "max_in_flight": LANE_MAX_IN_FLIGHT[lane],
+                "in_progress_or_waiting": depth,
+            }
+            for lane, depth in lane_depths.items()
+        }
+
+
+def submit_to_lane(body, lane):
+    """Queue a delivery of a lane queue on that lane's workers; the Future resolves to process_message's (outcome, reason)."""
+    received_at = time.time()
+
+    def work():
+        try:
+            # A fresh context per message, so the tenant it activates doesn't
+            # leak into the next message this worker thread picks up
+            return contextvars.copy_context().run(process_message, body, received_at)
+        finally:
+            with lane_depths_lock:
+                lane_depths[lane] -= 1
+
+    with lane_depths_lock:
+        lane_depths[lane] += 1
+        logger.info("Dispatching message to %s lane (%s queued or running)", lane, lane_depths[lane])
+    return lanes[lane].submit(work)
+
+
+def route_to_lane(ch, method, properties, body):
+    # Runs on the connection thread; the channel is in confirm mode, so this
+    # acks the delivery only once its copy is safely on the lane queue
+    try:
+        route_message(ch, properties, body)
+    except pika.exceptions.AMQPError as e:
+        logger.error("Could not route message %s: %s", method.delivery_tag, e)
+        # Otherwise it is left unacknowledged and redelivered once the channel is recovered
+        if ch.is_open:
+            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+        return
+    ch.basic_ack(delivery_tag=method.delivery_tag)
+
+
+def make_concurrent_consumer(connection, lane):
+    """Return an on_message callback for a lane queue that hands deliveries to the lane's workers.
+
+    The connection thread keeps running the I/O loop (and heartbeats) while
+    workers run; each result is handed back to it with add_callback_threadsafe.
+    """
+    def on_message(ch, method, properties, body):
+        delivery_tag = method.delivery_tag
+
+        def on_done(future):
+            outcome, reason = future.result()
+            try:
+                connection.add_callback_threadsafe(
+                    functools.partial(settle_message, ch, delivery_tag, properties, body, outcome, reason)
+                )
+            except pika.exceptions.ConnectionWrongStateError:
+                logger.warning("Connection closed before message %s could be settled; it will be redelivered", delivery_tag)
+
+        submit_to_lane(body, lane).add_done_callback(on_done)
+
+    return on_message
 
 def allowed_file(filename):
     return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
 def download_file_from_gcp(file_name):
-    client = storage.Client(project=os.getenv("GCP_PROJECT_ID"))
-    bucket = client.get_bucket(os.getenv("GCP_BUCKET_NAME"))
+    tenant = get_current_tenant()
+    gcp = tenant.gcp if tenant is not None else {
+        "project_id": os.getenv("GCP_PROJECT_ID"),
+        "bucket_name": os.getenv("GCP_BUCKET_NAME"),
+    }
+    client = storage.Client(project=gcp["project_id"])
+    bucket = client.get_bucket(gcp["bucket_name"])
     if allowed_file(file_name):
         blob = bucket.blob(file_name)
         destination_path = os.path.join(UPLOAD_FOLDER, file_name)
 
         # Create the uploads folder if it doesn't exist
-        if not os.path.exists(UPLOAD_FOLDER):
-            os.makedirs(UPLOAD_FOLDER)
-            logger.info("Uploads folder created")
+        os.makedirs(os.path.dirname(destination_path), exist_ok=True)
 
         blob.download_to_filename(destination_path)
         logger.info("File downloaded to: %s", destination_path)
@@ -142,21 +323,21 @@ def download_file_from_gcp(file_name):
 def generate_recording_summary(file_name, destination_path, metadata):
     fileDate = os.path.basename(file_name)
     filenameWithDate = fileDate[:10]
-    documents = generating_embeddings(destination_path, metadata)
-    summary = generating_summary_of_each_recordings(documents, filenameWithDate)
-    logger.info("Call transcripts & embeddings generated and saved to database: %s", summary)
-    # Delete the uploads folder and its contents after processing
-    shutil.rmtree(UPLOAD_FOLDER)
-    logger.info("Uploads folder cleaned up after processing")
+    # Errors propagate, so process_message retries the recording
+    documents = generating_embeddings(
+        destination_path, metadata,
+        summarize_recording=lambda documents: generating_summary_of_each_recordings(documents, filenameWithDate),
+    )
+    if documents is ALREADY_INGESTED:
+        logger.info("Transcript and call summary of %s are already stored, skipping", file_name)
+    elif documents is None:
+        logger.info("Nothing to ingest for %s", file_name)
+    else:
+        logger.info("Call transcripts & embeddings generated and saved to database: %s", file_name)
 
 def start_consuming_for_host(host, port, user, password, vhost):
     while True:
         try:
-            os.environ["RABBITMQ_HOST"] = host
-            os.environ["RABBITMQ_PORT"] = port
-            os.environ["RABBITMQ_USERNAME"] = user
-            os.environ["RABBITMQ_PASSWORD"] = password
-            os.environ["RABBITMQ_VHOST"] = vhost
             connection = connect_to_rabbitmq(
                 host, 
                 port, 
@@ -166,6 +347,8 @@ def start_consuming_for_host(host, port, user, password, vhost):
                 heartbeat_interval
             )
             channel = connection.channel()
+            # Deliveries are routed or republished before they are acked; wait for the broker to confirm them
+            channel.confirm_delivery()
             channel.exchange_declare(exchange=os.getenv("RABBITMQ_EXCHANGE"), durable=True)
             channel.queue_declare(queue=os.getenv("RABBITMQ_QUEUE"), durable=True)
             channel.queue_bind(
@@ -173,15 +356,43 @@ def start_consuming_for_host(host, port, user, password, vhost):
                 queue=os.getenv("RABBITMQ_QUEUE"), 
                 routing_key=os.getenv("RABBITMQ_ROUTING_KEY")
             )
+            declare_retry_topology(channel, os.getenv("RABBITMQ_QUEUE"))
+            for lane_queue, _ in get_lane_queues().values():
+                channel.queue_declare(queue=lane_queue, durable=True)
             logger.info("RabbitMQ setup completed with exchange %s, queue %s for host %s", os.getenv("RABBITMQ_EXCHANGE"), os.getenv("RABBITMQ_QUEUE"), host)
 
-            # Setup RabbitMQ consumer
+            # Each lane consumes its own queue on its own channel, at most its
+            # LANE_MAX_IN_FLIGHT unacknowledged deliveries at a time
+            channels = [channel]
+            for lane, (lane_queue, lane_prefetch) in get_lane_queues().items():
+                lane_channel = connection.channel()
+                channels.append(lane_channel)
+                lane_channel.confirm_delivery()
+                lane_channel.basic_qos(prefetch_count=lane_prefetch)
+                lane_channel.basic_consume(
+                    queue=lane_queue,
+                    on_message_callback=make_concurrent_consumer(connection, lane),
+                    auto_ack=False,
+                )
+
+            # New deliveries are routed once to their lane queue
+            channel.basic_qos(prefetch_count=CONSUMER_PREFETCH)
             channel.basic_consume(
-                queue=os.getenv("RABBITMQ_QUEUE"), on_message_callback=process_data_and_store, auto_ack=False
+                queue=os.getenv("RABBITMQ_QUEUE"),
+                on_message_callback=route_to_lane,
+                auto_ack=False,
             )
 
             logger.info("Waiting for messages on host %s. To exit press CTRL+C", host)
-            channel.start_consuming()
+            # Dispatches the callbacks of every channel on this connection; unsettled
+            # deliveries are redelivered by the broker if the connection drops
+            while all(ch.is_open for ch in channels):
+                connection.process_data_events(time_limit=1)
+            # A lane whose channel the broker closed would silently stop consuming
+            logger.error("A channel closed for host %s, reconnecting in 5 seconds", host)
+            if connection.is_open:
+                connection.close()
+            time.sleep(5)
 
         except pika.exceptions.AMQPConnectionError as e:
             logger.error("AMQP Connection error for host %s: %s", host, e)
@@ -203,6 +414,11 @@ def start_consuming_for_host(host, port, user, password, vhost):
 def start_consuming():
     rabbitmq_hosts = json.loads(os.getenv("RABBITMQ_HOSTS"))
     print("RabbitMQ HOSTS:::::::::::::::::::", rabbitmq_hosts)
+    if CONSUMER_MODE == "asyncio":
+        run_consumers(rabbitmq_hosts, route_message, submit_to_lane, republish_message,
+                      get_lane_queues(), CONSUMER_PREFETCH, heartbeat_interval)
+        return
+
     threads = []
     for host_config in rabbitmq_hosts:
         host = host_config["host"]
@@ -0,0 +1,251 @@
+import asyncio
+import functools
+import logging
+import os
+import random
+import signal
+
+import pika
+from pika.adapters.asyncio_connection import AsyncioConnection
+
+from retry_queues import declare_retry_topology
+
+logger = logging.getLogger(__name__)
+
+RECONNECT_BASE_DELAY_SECONDS = float(os.getenv("RECONNECT_BASE_DELAY_SECONDS", "1"))
+RECONNECT_MAX_DELAY_SECONDS = float(os.getenv("RECONNECT_MAX_DELAY_SECONDS", "60"))
+
+
+def reconnect_delay_seconds(failures):
+    """Exponential backoff with full jitter, so hosts that dropped together don't reconnect together."""
+    ceiling = min(RECONNECT_BASE_DELAY_SECONDS * 2 ** max(failures - 1, 0), RECONNECT_MAX_DELAY_SECONDS)
+    return random.uniform(0, ceiling)
+
+
+class ConsumerChannel:
+    """One channel of a HostConsumer, consuming one queue in confirm mode.
+
+    A delivery that is answered with a publish (routed to its lane queue, or
+    republished for a retry) is acked only once the broker confirms that copy.
+    """
+
+    def __init__(self, consumer, queue, prefetch, handle):
+        self.consumer = consumer
+        self.queue = queue
+        self.prefetch = prefetch
+        # handle(consumer_channel, channel, delivery_tag, properties, body)
+        self.handle = handle
+        self.channel = None
+        # publish sequence number -> delivery tag of the original, awaiting the broker's confirm
+        self.publish_sequence = 0
+        self.pending_confirms = {}
+
+    def open(self, connection):
+        self.channel = None
+        connection.channel(on_open_callback=self.on_channel_open)
+
+    def on_channel_open(self, channel):
+        self.channel = channel
+        self.publish_sequence = 0
+        self.pending_confirms = {}
+        channel.add_on_close_callback(self.consumer.on_channel_closed)
+        channel.confirm_delivery(self.on_delivery_confirmation)
+        # Channel RPCs are serialised by pika, so these run in order without nesting callbacks
+        self.consumer.declare_topology(channel)
+        channel.basic_qos(prefetch_count=self.prefetch)
+        channel.basic_consume(queue=self.queue, on_message_callback=self.on_message, auto_ack=False,
+                              callback=self.consumer.on_consume_ok)
+
+    def on_message(self, channel, method, properties, body):
+        self.handle(self, channel, method.delivery_tag, properties, body)
+
+    def is_current(self, channel):
+        # Unsettled deliveries on a channel that has since closed are redelivered by the broker
+        return channel is self.channel and channel.is_open
+
+    def publish_then_ack(self, delivery_tag, publish):
+        try:
+            publish(self.channel)
+        except pika.exceptions.AMQPError as e:
+            logger.error("Could not republish message %s: %s", delivery_tag, e)
+            return
+        self.publish_sequence += 1
+        self.pending_confirms[self.publish_sequence] = delivery_tag
+
+    def on_delivery_confirmation(self, frame):
+        method = frame.method
+        if method.multiple:
+            sequences = [sequence for sequence in self.pending_confirms if sequence <= method.delivery_tag]
+        else:
+            sequences = [method.delivery_tag]
+        acked = isinstance(method, pika.spec.Basic.Ack)
+        for sequence in sequences:
+            delivery_tag = self.pending_confirms.pop(sequence, None)
+            if delivery_tag is None:
+                continue
+            if acked:
+                self.channel.basic_ack(delivery_tag=delivery_tag)
+                logger.info("Message acknowledged")
+            else:
+                # The broker lost the published copy; hand the original back instead
+                logger.error("Republished copy of message %s was not confirmed, requeueing it", delivery_tag)
+                self.channel.basic_nack(delivery_tag=delivery_tag, requeue=True)
+
+
+class HostConsumer:
+    """Consumes RABBITMQ_QUEUE and its lane queues on one host through a callback-driven connection on the shared event loop.
+
+    Deliveries of RABBITMQ_QUEUE are only passed to route(channel, properties, body),
+    which publishes them to their lane's queue. lane_queues maps each lane to
+    (queue, prefetch); every lane queue is consumed on its own channel, so a
+    busy lane never takes the prefetch slots of another. Its deliveries are
+    handed to submit(body, lane), which returns a concurrent.futures.Future
+    with the (outcome, reason) of processing. Completion is handled on the loop,
+    so channels are only ever touched from the loop: handled deliveries are
+    acked, others go through republish(channel, properties, body, outcome, reason)
+    and are acked only once the broker confirms the republished copy.
+    """
+
+    def __init__(self, loop, host_config, route, submit, republish, lane_queues, prefetch, heartbeat_interval):
+        self.loop = loop
+        self.host = host_config["host"]
+        self.parameters = pika.ConnectionParameters(
+            host=host_config["host"],
+            port=host_config["port"],
+            credentials=pika.PlainCredentials(username=host_config["name"], password=host_config["password"]),
+            virtual_host=host_config["vhost"],
+            heartbeat=int(heartbeat_interval),
+            blocked_connection_timeout=300,
+            socket_timeout=5,
+        )
+        self.route = route
+        self.submit = submit
+        self.republish = republish
+        self.lane_queues = lane_queues
+        self.channels = [ConsumerChannel(self, os.getenv("RABBITMQ_QUEUE"), prefetch, self.on_route_message)] + [
+            ConsumerChannel(self, lane_queue, lane_prefetch, functools.partial(self.on_lane_message, lane))
+            for lane, (lane_queue, lane_prefetch) in lane_queues.items()
+        ]
+        self.connection = None
+        self.failures = 0
+        self.stopping = False
+        self.closed = asyncio.Event()
+
+    def start(self):
+        if self.stopping:
+            return
+        self.closed.clear()
+        self.connection = AsyncioConnection(
+            self.parameters,
+            on_open_callback=self.on_connection_open,
+            on_open_error_callback=self.on_connection_open_error,
+            on_close_callback=self.on_connection_closed,
+            custom_ioloop=self.loop,
+        )
+
+    def stop(self):
+        self.stopping = True
+        if self.connection is not None and not (self.connection.is_closing or self.connection.is_closed):
+            self.connection.close()
+        else:
+            self.closed.set()
+
+    def schedule_reconnect(self):
+        if self.stopping:
+            self.closed.set()
+            return
+        self.failures += 1
+        delay = reconnect_delay_seconds(self.failures)
+        logger.info("Attempting to reconnect in %.1f seconds for host %s...", delay, self.host)
+        self.loop.call_later(delay, self.start)
+
+    def on_connection_open(self, connection):
+        for consumer_channel in self.channels:
+            consumer_channel.open(connection)
+
+    def on_connection_open_error(self, connection, error):
+        logger.error("AMQP Connection error for host %s: %s", self.host, error)
+        self.schedule_reconnect()
+
+    def on_connection_closed(self, connection, reason):
+        for consumer_channel in self.channels:
+            consumer_channel.channel = None
+        if not self.stopping:
+            logger.error("Connection closed for host %s: %s", self.host, reason)
+        self.schedule_reconnect()
+
+    def declare_topology(self, channel):
+        # Every channel declares all of it: the router must never publish to a
+        # lane queue that does not exist yet, and declarations are idempotent
+        queue = os.getenv("RABBITMQ_QUEUE")
+        channel.exchange_declare(exchange=os.getenv("RABBITMQ_EXCHANGE"), durable=True)
+        channel.queue_declare(queue=queue, durable=True)
+        channel.queue_bind(queue=queue, exchange=os.getenv("RABBITMQ_EXCHANGE"),
+                           routing_key=os.getenv("RABBITMQ_ROUTING_KEY"))
+        declare_retry_topology(channel, queue)
+        for lane_queue, _ in self.lane_queues.values():
+            channel.queue_declare(queue=lane_queue, durable=True)
+
+    def on_consume_ok(self, frame):
+        self.failures = 0
+        logger.info("Waiting for messages on host %s", self.host)
+
+    def on_channel_closed(self, channel, reason):
+        logger.warning("Channel closed for host %s: %s", self.host, reason)
+        # Reopen everything together rather than leave a lane without a consumer
+        if self.connection is not None and not (self.connection.is_closing or self.connection.is_closed):
+            self.connection.close()
+
+    def on_route_message(self, consumer_channel, channel, delivery_tag, properties, body):
+        consumer_channel.publish_then_ack(delivery_tag, lambda ch: self.route(ch, properties, body))
+
+    def on_lane_message(self, lane, consumer_channel, channel, delivery_tag, properties, body):
+        future = asyncio.wrap_future(self.submit(body, lane), loop=self.loop)
+        future.add_done_callback(
+            functools.partial(self.on_processed, consumer_channel, channel, delivery_tag, properties, body)
+        )
+
+    def on_processed(self, consumer_channel, channel, delivery_tag, properties, body, future):
+        if future.cancelled():
+            outcome, reason = "retry", "Processing was cancelled"
+        elif future.exception() is not None:
+            error = future.exception()
+            outcome, reason = "retry", f"{type(error).__name__}: {error}"
+        else:
+            outcome, reason = future.result()
+        if not consumer_channel.is_current(channel):
+            logger.warning("Channel closed before message %s could be settled; it will be redelivered", delivery_tag)
+            return
+        if outcome == "ack":
+            channel.basic_ack(delivery_tag=delivery_tag)
+            logger.info("Message acknowledged")
+            return
+        consumer_channel.publish_then_ack(
+            delivery_tag, lambda ch: self.republish(ch, properties, body, outcome, reason)
+        )
+
+
+async def consume_all(host_configs, route, submit, republish, lane_queues, prefetch, heartbeat_interval):
+    loop = asyncio.get_running_loop()
+    consumers = [
+        HostConsumer(loop, host_config, route, submit, republish, lane_queues, prefetch, heartbeat_interval)
+        for host_config in host_configs
+    ]
+    stop_requested = asyncio.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop_requested.set)
+
+    for consumer in consumers:
+        consumer.start()
+    logger.info("Consuming from %s RabbitMQ host(s) on one event loop", len(consumers))
+
+    await stop_requested.wait()
+    logger.info("Stopping RabbitMQ consumers")
+    for consumer in consumers:
+        consumer.stop()
+    await asyncio.gather(*(consumer.closed.wait() for consumer in consumers))
+
+
+def run_consumers(host_configs, route, submit, republish, lane_queues, prefetch, heartbeat_interval):
+    """Consume from every host in host_configs on a single event loop until SIGINT/SIGTERM."""
+    asyncio.run(consume_all(host_configs, route, submit, republish, lane_queues, prefetch, heartbeat_interval))
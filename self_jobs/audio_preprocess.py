@@ -0,0 +1,69 @@
+import logging
+import os
+import threading
+
+import ffmpeg
+from audio_segments import SILENCE_NOISE_DB, probe_duration
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+logger = logging.getLogger(__name__)
+
+PREPROCESS_AUDIO = os.getenv("PREPROCESS_AUDIO", "true").lower() == "true"
+# Silences (holds, ringing gaps, dead air) at least this long are shortened to KEEP_SILENCE_SECONDS
+LONG_SILENCE_SECONDS = float(os.getenv("LONG_SILENCE_SECONDS", "3"))
+KEEP_SILENCE_SECONDS = float(os.getenv("KEEP_SILENCE_SECONDS", "0.75"))
+
+_stats_lock = threading.Lock()
+_totals = {"files": 0, "input_seconds": 0.0, "output_seconds": 0.0}
+
+
+def preprocess_audio(filename):
+    """Write a 16 kHz mono copy of the recording with leading/trailing and long silences removed.
+
+    Returns the path of the processed file and how many seconds of audio were removed.
+    """
+    base_name = os.path.splitext(str(filename))[0]
+    output_path = f"{base_name}.preprocessed.wav"
+    input_seconds = probe_duration(filename)
+    threshold = f"{SILENCE_NOISE_DB}dB"
+    (
+        ffmpeg.input(str(filename))
+        .filter(
+            "silenceremove",
+            start_periods=1,
+            start_threshold=threshold,
+            start_silence=KEEP_SILENCE_SECONDS,
+            stop_periods=-1,
+            stop_threshold=threshold,
+            stop_duration=LONG_SILENCE_SECONDS,
+            stop_silence=KEEP_SILENCE_SECONDS,
+        )
+        .output(output_path, ac=1, ar=16000, acodec="pcm_s16le")
+        .overwrite_output()
+        .run(quiet=True)
+    )
+    output_seconds = probe_duration(output_path)
+
+    stats = {
+        "input_seconds": round(input_seconds, 2),
+        "output_seconds": round(output_seconds, 2),
+        "removed_seconds": round(max(0.0, input_seconds - output_seconds), 2),
+        "removed_ratio": round(max(0.0, input_seconds - output_seconds) / input_seconds, 3) if input_seconds else 0.0,
+    }
+    with _stats_lock:
+        _totals["files"] += 1
+        _totals["input_seconds"] += input_seconds
+        _totals["output_seconds"] += output_seconds
+    logger.info(
+        f"Preprocessed {filename}: {stats['input_seconds']}s -> {stats['output_seconds']}s "
+        f"({stats['removed_seconds']}s removed)"
+    )
+    return output_path, stats
+
+
+def get_preprocess_stats():
+    with _stats_lock:
+        totals = dict(_totals)
+    totals["removed_seconds"] = round(max(0.0, totals["input_seconds"] - totals["output_seconds"]), 2)
+    return totals
@@ -0,0 +1,111 @@
+import logging
+import os
+import re
+
+import ffmpeg
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+logger = logging.getLogger(__name__)
+
+SILENCE_NOISE_DB = int(os.getenv("SILENCE_NOISE_DB", "-30"))
+SILENCE_MIN_SECONDS = float(os.getenv("SILENCE_MIN_SECONDS", "0.5"))
+
+_silence_start_pattern = re.compile(r"silence_start: (-?\d+(?:\.\d+)?)")
+_silence_end_pattern = re.compile(r"silence_end: (-?\d+(?:\.\d+)?)")
+
+
+def probe_duration(filename):
+    return float(ffmpeg.probe(str(filename))["format"]["duration"])
+
+
+def parse_silencedetect_output(output, duration=None):
+    """Turn ffmpeg silencedetect log lines into a list of (start, end) seconds."""
+    silences = []
+    silence_start = None
+    for line in output.splitlines():
+        start_match = _silence_start_pattern.search(line)
+        if start_match:
+            silence_start = max(0.0, float(start_match.group(1)))
+            continue
+        end_match = _silence_end_pattern.search(line)
+        if end_match and silence_start is not None:
+            silences.append((silence_start, float(end_match.group(1))))
+            silence_start = None
+    # A recording that ends in silence has a silence_start without a silence_end
+    if silence_start is not None and duration is not None:
+        silences.append((silence_start, duration))
+    return silences
+
+
+def detect_silences(filename, noise_db=SILENCE_NOISE_DB, min_silence_seconds=SILENCE_MIN_SECONDS, duration=None):
+    _, stderr = (
+        ffmpeg.input(str(filename))
+        .filter("silencedetect", noise=f"{noise_db}dB", d=min_silence_seconds)
+        .output("-", format="null")
+        .run(capture_stdout=True, capture_stderr=True)
+    )
+    return parse_silencedetect_output(stderr.decode("utf-8", errors="ignore"), duration)
+
+
+def plan_segments(duration, silences, target_seconds, overlap_seconds):
+    """Split [0, duration] into segments of about target_seconds, cutting inside silences.
+
+    Each segment is a dict with the audio span to transcribe ("start"/"end",
+    widened by overlap_seconds on both sides) and the span it owns in the
+    stitched transcript ("cut_start"/"cut_end").
+    """
+    if duration <= target_seconds:
+        return [{"start": 0.0, "end": duration, "cut_start": 0.0, "cut_end": duration}]
+
+    silence_midpoints = [(start + end) / 2 for start, end in silences]
+    search_window = target_seconds / 4
+    cut_points = [0.0]
+    while duration - cut_points[-1] > target_seconds + search_window:
+        target = cut_points[-1] + target_seconds
+        candidates = [
+            midpoint for midpoint in silence_midpoints
+            if abs(midpoint - target) <= search_window and midpoint > cut_points[-1]
+        ]
+        cut_points.append(min(candidates, key=lambda midpoint: abs(midpoint - target)) if candidates else target)
+    cut_points.append(duration)
+
+    return [
+        {
+            "start": max(0.0, cut_start - overlap_seconds),
+            "end": min(duration, cut_end + overlap_seconds),
+            "cut_start": cut_start,
+            "cut_end": cut_end,
+        }
+        for cut_start, cut_end in zip(cut_points, cut_points[1:])
+    ]
+
+
+def extract_segment(filename, start, end, output_path):
+    (
+        ffmpeg.input(str(filename), ss=start, t=end - start)
+        .output(str(output_path), ac=1, ar=16000)
+        .overwrite_output()
+        .run(quiet=True)
+    )
+    return output_path
+
+
+def stitch_transcripts(segment_results):
+    """Merge per-segment whisper results into one ordered transcript.
+
+    segment_results is a list of (segment, result) pairs where result holds the
+    whisper "segments" relative to segment["start"]. Whisper segments are
+    shifted to absolute offsets and only kept by the segment that owns their
+    midpoint, which drops the text duplicated in the overlaps.
+    """
+    stitched_segments = []
+    for segment, result in sorted(segment_results, key=lambda item: item[0]["cut_start"]):
+        for whisper_segment in result["segments"]:
+            start = whisper_segment["start"] + segment["start"]
+            end = whisper_segment["end"] + segment["start"]
+            midpoint = (start + end) / 2
+            if segment["cut_start"] <= midpoint < segment["cut_end"]:
+                stitched_segments.append({"start": start, "end": end, "text": whisper_segment["text"]})
+    text = " ".join(segment["text"].strip() for segment in stitched_segments if segment["text"].strip())
+    return {"text": text, "segments": stitched_segments}
@@ -1,7 +1,223 @@
-from llama_hub.file.audio import AudioTranscriber
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
 
+import whisper
+from llama_index import Document
+from audio_segments import detect_silences, extract_segment, plan_segments, probe_duration, stitch_transcripts
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def available_cpus():
+    """CPUs this process may use: the cgroup quota of the container if it has one, else the CPU affinity."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    try:
+        # cgroup v2: "<quota> <period>" or "max <period>"
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()[:2]
+        if quota != "max":
+            cpus = min(cpus, max(1, int(int(quota) / int(period))))
+    except (OSError, ValueError):
+        try:
+            # cgroup v1
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+                quota = int(f.read())
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+                period = int(f.read())
+            if quota > 0:
+                cpus = min(cpus, max(1, quota // period))
+        except (OSError, ValueError):
+            pass
+    return cpus
+
+
+WHISPER_MODEL = os.getenv("WHISPER_MODEL", "base")
+# Whisper workers are memory and CPU heavy, so the default stays small and
+# never exceeds the container's CPU quota; an empty value counts as unset.
+TRANSCRIPTION_WORKERS = int(os.getenv("TRANSCRIPTION_WORKERS") or min(available_cpus(), 2))
+SEGMENTED_TRANSCRIPTION = os.getenv("SEGMENTED_TRANSCRIPTION", "true").lower() == "true"
+SEGMENT_SECONDS = float(os.getenv("TRANSCRIPTION_SEGMENT_SECONDS", "300"))
+SEGMENT_OVERLAP_SECONDS = float(os.getenv("TRANSCRIPTION_SEGMENT_OVERLAP_SECONDS", "2"))
+
+# Loaded once in the consumer process; forked workers share the weights copy-on-write.
+_model = None
+_executor = None
+_engine_lock = threading.Lock()
+
+_stats_lock = threading.Lock()
+_queue_depth = 0
+_completed = 0
+_recent_timings = deque(maxlen=100)
+
+
+def get_model_version():
+    if SEGMENTED_TRANSCRIPTION:
+        return f"whisper-{WHISPER_MODEL}-segmented-{int(SEGMENT_SECONDS)}"
+    return f"whisper-{WHISPER_MODEL}"
+
+
+def _load_model():
+    global _model
+    if _model is None:
+        start_time = time.monotonic()
+        _model = whisper.load_model(WHISPER_MODEL)
+        logger.info(f"Loaded whisper model {WHISPER_MODEL} in {time.monotonic() - start_time:.2f} seconds")
+    return _model
+
+
+def _init_worker(threads_per_worker, load_model):
+    import torch
+    torch.set_num_threads(threads_per_worker)
+    if load_model:
+        _load_model()
+
+
+def _transcribe_in_worker(filename):
+    start_time = time.monotonic()
+    result = _model.transcribe(str(filename))
+    return {
+        "text": result["text"],
+        "segments": [
+            {"start": segment["start"], "end": segment["end"], "text": segment["text"]}
+            for segment in result.get("segments", [])
+        ],
+        "seconds": time.monotonic() - start_time,
+    }
+
+
+def _get_executor():
+    global _executor
+    with _engine_lock:
+        if _executor is None:
+            threads_per_worker = max(1, available_cpus() // TRANSCRIPTION_WORKERS)
+            if "fork" in multiprocessing.get_all_start_methods():
+                _load_model()
+                context = multiprocessing.get_context("fork")
+                load_in_worker = False
+            else:
+                context = multiprocessing.get_context("spawn")
+                load_in_worker = True
+            _executor = ProcessPoolExecutor(
+                max_workers=TRANSCRIPTION_WORKERS,
+                mp_context=context,
+                initializer=_init_worker,
+                initargs=(threads_per_worker, load_in_worker),
+            )
+            logger.info(
+                f"Started {TRANSCRIPTION_WORKERS} transcription workers "
+                f"({context.get_start_method()}, {threads_per_worker} threads each)"
+            )
+        return _executor
+
+
+def _reset_executor(expected):
+    """Shut down the pool expected, unless it was already replaced by a fresh one."""
+    global _executor
+    with _engine_lock:
+        if _executor is expected:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+
+def _on_transcription_done(filename, executor, future):
+    global _queue_depth, _completed
+    error = None if future.cancelled() else future.exception()
+    with _stats_lock:
+        _queue_depth -= 1
+        if not future.cancelled() and error is None:
+            _completed += 1
+            _recent_timings.append(future.result()["seconds"])
+    if isinstance(error, BrokenProcessPool):
+        logger.error("Transcription worker pool is broken, it will be restarted")
+        # Every pending future of the broken pool lands here; only the first resets it
+        _reset_executor(executor)
+    elif not future.cancelled() and error is None:
+        logger.info(f"Transcribed {filename} in {future.result()['seconds']:.2f} seconds")
+
+
+def submit_transcription(filename):
+    """Queue a file on the transcription pool and return a Future of its whisper result."""
+    global _queue_depth
+    with _stats_lock:
+        _queue_depth += 1
+    executor = None
+    try:
+        executor = _get_executor()
+        future = executor.submit(_transcribe_in_worker, str(filename))
+    except Exception:
+        with _stats_lock:
+            _queue_depth -= 1
+        if executor is not None:
+            _reset_executor(executor)
+        raise
+    future.add_done_callback(lambda done: _on_transcription_done(filename, executor, done))
+    return future
+
+
+def get_transcription_stats():
+    with _stats_lock:
+        timings = list(_recent_timings)
+        return {
+            "model": WHISPER_MODEL,
+            "workers": TRANSCRIPTION_WORKERS,
+            "queue_depth": _queue_depth,
+            "completed": _completed,
+            "avg_seconds": round(sum(timings) / len(timings), 2) if timings else 0.0,
+            "max_seconds": round(max(timings), 2) if timings else 0.0,
+        }
+
+
+def transcribe_segmented(filename):
+    """Transcribe a long recording as silence-aligned overlapping segments in parallel."""
+    start_time = time.monotonic()
+    duration = probe_duration(filename)
+    if duration <= SEGMENT_SECONDS:
+        return submit_transcription(filename).result()
+
+    silences = detect_silences(filename, duration=duration)
+    segments = plan_segments(duration, silences, SEGMENT_SECONDS, SEGMENT_OVERLAP_SECONDS)
+    work_dir = tempfile.mkdtemp(prefix="segments_")
+    futures = []
+    try:
+        for index, segment in enumerate(segments):
+            segment_path = os.path.join(work_dir, f"{index:04d}.wav")
+            extract_segment(filename, segment["start"], segment["end"], segment_path)
+            futures.append((segment, submit_transcription(segment_path)))
+        results = [(segment, future.result()) for segment, future in futures]
+    finally:
+        for _, future in futures:
+            future.cancel()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    stitched = stitch_transcripts(results)
+    stitched["seconds"] = time.monotonic() - start_time
+    logger.info(
+        f"Transcribed {filename} ({duration:.0f}s of audio) as {len(segments)} segments "
+        f"in {stitched['seconds']:.2f} seconds"
+    )
+    return stitched
+
+
+def transcribe_audio(filename):
+    if SEGMENTED_TRANSCRIPTION:
+        return transcribe_segmented(filename)
+    return submit_transcription(filename).result()
+
+
 def audio_Transcriptions(filename):
-    loader = AudioTranscriber()
-    result = loader.load_data(file=Path(filename))
-    return result
\ No newline at end of file
+    result = transcribe_audio(Path(filename))
+    return [Document(text=result["text"])]
@@ -3,8 +3,11 @@ import json
 import re
 import sys
 import logging
+import threading
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from common.get_google_creds import access_secret_file
+from common.tenant_context import TenantContext, set_current_tenant
+from dbConfig.pool_registry import register_tenant_database
 from dotenv import load_dotenv
 
 # Set up logging
@@ -73,43 +76,75 @@ def load_and_set_config():
                 })
             val = env
     os.environ["RABBITMQ_HOSTS"] = json.dumps(rabbitmq_hosts)
-    update_config_based_on_token(val)
+    export_tenant_to_environ(update_config_based_on_token(val))
 
 
-def update_config_based_on_token(environment_token):
-    logger.info(f"Updating the config with the environment token: {environment_token}")
-    secrets = json.loads(secrets_data)
-    
-    def set_env_var(key, value):
+# Per-tenant secret "<NAME>_<ENVIRONMENT_TOKEN>" -> (TenantContext attribute, key)
+TENANT_SETTINGS = {
+    "DB_HOST": ("db", "host"),
+    "DB_PORT": ("db", "port"),
+    "DB_USER": ("db", "user"),
+    "DB_PASSWORD": ("db", "password"),
+    "DB_NAME": ("db", "database"),
+    "SQL_DB_HOST": ("mssql", "server"),
+    "SQL_DB_USER": ("mssql", "user"),
+    "SQL_DB_PASSWORD": ("mssql", "password"),
+    "SQL_DB_NAME": ("mssql", "database"),
+    "RABBITMQ_HOST": ("rabbitmq", "host"),
+    "RABBITMQ_PORT": ("rabbitmq", "port"),
+    "RABBITMQ_USERNAME": ("rabbitmq", "user"),
+    "RABBITMQ_PASSWORD": ("rabbitmq", "password"),
+    "RABBITMQ_VHOST": ("rabbitmq", "vhost"),
+    "GCP_PROJECT_ID": ("gcp", "project_id"),
+    "GCP_BUCKET_NAME": ("gcp", "bucket_name"),
+}
+
+_tenant_contexts = {}
+_tenant_contexts_lock = threading.Lock()
+
+
+def resolve_tenant_context(environment_token):
+    """Build (once per process) the TenantContext for an environment token from the secrets."""
+    with _tenant_contexts_lock:
+        tenant = _tenant_contexts.get(environment_token)
+        if tenant is not None:
+            return tenant
+
+        secrets = json.loads(secrets_data)
+        settings = {"db": {}, "mssql": {}, "rabbitmq": {}, "gcp": {}}
+        for name, (group, key) in TENANT_SETTINGS.items():
+            value = secrets.get(f"{name}_{environment_token}")
+            if value is None:
+                logger.error(f"Missing value for {name} with environment_token {environment_token}")
+            settings[group][key] = value
+
+        tenant = TenantContext(environment_token=environment_token, **settings)
+        _tenant_contexts[environment_token] = tenant
+
+    if None not in tenant.db.values():
+        register_tenant_database(environment_token, tenant.db)
+    return tenant
+
+
+def export_tenant_to_environ(tenant):
+    # Startup only: code that reads connection settings from os.environ
+    # (e.g. the /healthcheck configs in main.py) sees the default tenant.
+    for name, (group, key) in TENANT_SETTINGS.items():
+        value = getattr(tenant, group)[key]
         if value is not None:
-            os.environ[key] = value
-        else:
-            logger.error(f"Missing value for {key} with environment_token {environment_token}")
-            return
+            os.environ[name] = value
+
 
+def update_config_based_on_token(environment_token):
+    """Make environment_token the tenant of the current thread/context and return its TenantContext."""
+    logger.info(f"Updating the config with the environment token: {environment_token}")
     try:
-        set_env_var("DB_HOST", secrets.get(f"DB_HOST_{environment_token}"))
-        set_env_var("DB_PORT", secrets.get(f"DB_PORT_{environment_token}"))
-        set_env_var("DB_USER", secrets.get(f"DB_USER_{environment_token}"))
-        set_env_var("DB_PASSWORD", secrets.get(f"DB_PASSWORD_{environment_token}"))
-        set_env_var("DB_NAME", secrets.get(f"DB_NAME_{environment_token}"))
-
-        set_env_var("SQL_DB_HOST", secrets.get(f"SQL_DB_HOST_{environment_token}"))
-        set_env_var("SQL_DB_USER", secrets.get(f"SQL_DB_USER_{environment_token}"))
-        set_env_var("SQL_DB_PASSWORD", secrets.get(f"SQL_DB_PASSWORD_{environment_token}"))
-        set_env_var("SQL_DB_NAME", secrets.get(f"SQL_DB_NAME_{environment_token}"))
-
-        set_env_var("RABBITMQ_HOST", secrets.get(f"RABBITMQ_HOST_{environment_token}"))
-        set_env_var("RABBITMQ_PORT", secrets.get(f"RABBITMQ_PORT_{environment_token}"))
-        set_env_var("RABBITMQ_USERNAME", secrets.get(f"RABBITMQ_USERNAME_{environment_token}"))
-        set_env_var("RABBITMQ_PASSWORD", secrets.get(f"RABBITMQ_PASSWORD_{environment_token}"))
-        set_env_var("RABBITMQ_VHOST", secrets.get(f"RABBITMQ_VHOST_{environment_token}"))
-
-        set_env_var("GCP_PROJECT_ID", secrets.get(f"GCP_PROJECT_ID_{environment_token}"))
-        set_env_var("GCP_BUCKET_NAME", secrets.get(f"GCP_BUCKET_NAME_{environment_token}"))
+        tenant = resolve_tenant_context(environment_token)
     except ValueError as e:
-        logger.error("Error setting environment variables: %s", e)
+        logger.error("Error reading tenant configuration: %s", e)
         raise
     except KeyError as e:
         logger.error("Missing configuration for environment_token %s: %s", environment_token, e)
-        raise
\ No newline at end of file
+        raise
+    set_current_tenant(tenant)
+    return tenant
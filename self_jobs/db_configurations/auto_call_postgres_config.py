@@ -2,14 +2,18 @@ import json
 import logging
 import os
 import sys
+from contextlib import contextmanager
 from dotenv import load_dotenv
 import psycopg2
-from llama_index.vector_stores import PGVectorStore
 import psycopg2.extras
 
 # Add parent directory of self_jobs to sys.path
 project_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
 sys.path.insert(0, project_dir)
+from dbConfig.constants import successful_call_dispositions
+from dbConfig.migrations import ensure_call_count_rollups, ensure_migrated
+from dbConfig.pool_registry import get_active_environment_token, get_connection, get_dedicated_connection
+from dbConfig.vector_store_cache import get_vector_index, get_vector_store
 
 # call it in any place of your program
 # before working with UUID objects in PostgreSQL
@@ -18,179 +22,572 @@ psycopg2.extras.register_uuid()
 load_dotenv()
 
 
-db_host = os.getenv("DB_HOST")
-db_port = os.getenv("DB_PORT")
-db_user = os.getenv("DB_USER") 
-db_password = os.getenv("DB_PASSWORD")
-db_name = os.getenv("DB_NAME")
-
-if (
-    db_host != None
-    and db_port != None
-    and db_user != None
-    and db_password != None
-    and db_name != None
-):
-    conn = psycopg2.connect(
-        host=db_host, database=db_name, user=db_user, password=db_password, port=db_port
-    )
-    conn.autocommit = True
-else:
-    print("Provide valid DB configurations")
-
-
-def get_vector_store(table_name):
-    return PGVectorStore.from_params(
-        database=db_name,
-        host=db_host,
-        password=db_password,
-        port=db_port,
-        user=db_user,
-        table_name=table_name,
-        embed_dim=1536,
-    )
-
-
 def get_representative_details(call_date):
+    ensure_call_count_rollups()
+    cursor = None
     try:
-        cursor = conn.cursor()
-        successful_call_criteria = (
-            str(["Meeting Scheduled"])
-            .replace("[", "")
-            .replace("]", "")
-            .replace('"', "'")
-        )
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            # Served from the rollup maintained at transcript ingest instead of
+            # aggregating data_call_transcripts
+            query = """
+                select
+                    sum(call_count) as "call_count",
+                    sum(row_count) as row_count,
+                    coalesce(sum(call_count) filter (where call_disposition = any(%(successful)s)), 0)
+                        as "successful_calls_count",
+                    coalesce(sum(call_count) filter (where call_disposition <> '' and call_disposition <> all(%(successful)s)), 0)
+                        as "unsuccessful_calls_count",
+                    nullif(representative_name, '') as "representative_name",
+                    summary_date::text as "summary_date"
+                from
+                    call_count_rollups
+                where
+                    environment_token = %(environment_token)s
+                    and summary_date >= %(call_date)s::date
+                    and summary_date < %(call_date)s::date + 1
+                group by representative_name, summary_date
+                having sum(call_count) > 0
+            """
+            cursor.execute(query, {
+                "call_date": call_date,
+                "successful": successful_call_dispositions,
+                "environment_token": get_active_environment_token(),
+            })
 
-        query = f"""
-            select
-                count(total_calls) as "call_count",
-                sum(total_calls) as row_count,
-                sum(case
-                    when successful_calls >= 1 then 1
-                    else 0
-                end) as "successful_calls_count",
-                sum(case
-                    when unsuccessful_calls >= 1 then 1
-                    else 0
-                end) as "unsuccessful_calls_count",
-                "user_name" as "representative_name",
-                "date" as "summary_date"
-            from
-                (
-                    select
-                        count(id) as total_calls,
-                        sum(case
-                            when metadata_->>'call_disposition' in ({successful_call_criteria}) then 1
-                            else 0
-                        end) as "successful_calls",
-                        sum(case
-                            when metadata_->>'call_disposition' not in ({successful_call_criteria}) then 1
-                            else 0
-                        end) as "unsuccessful_calls",
-                        metadata_->>'user_name' as "user_name",
-                        metadata_->>'call_date' as "call_date",
-                        metadata_->>'date' as "date"
-                    from
-                        data_call_transcripts
-                    where
-                        TO_CHAR((metadata_->>'date')::timestamp, 'yyyy-mm-dd') = '{call_date}'
-                    group by
-                        metadata_->>'call_date',
-                        metadata_->>'user_name',
-                        metadata_->>'date'
-                ) as "result"
-            group by user_name, "date"
-        """
-        cursor.execute(query)
+            columns = list(cursor.description)
+            messages = cursor.fetchall()
+            cursor.close()
+            results = []
+            for row in messages:
+                row_dict = {}
+                for i, col in enumerate(columns):
+                    row_dict[col.name] = row[i]
+                results.append(row_dict)
 
-        columns = list(cursor.description)
-        messages = cursor.fetchall()
-        cursor.close()
-        results = []
-        for row in messages:
-            row_dict = {}
-            for i, col in enumerate(columns):
-                row_dict[col.name] = row[i]
-            results.append(row_dict)
-
-        return results
+            return results
     except (Exception, psycopg2.DatabaseError) as e:
         logging.error(e)
-        cursor.close()
+        if cursor is not None:
+            cursor.close()
         exit(1)
 
 
 def get_agent_summary_count_by_summary_date(summary_date):
+    ensure_migrated("data_agent_summaries")
+    cursor = None
     try:
-        cursor = conn.cursor()
-        query = f"""
-            select
-                sum((metadata_->>'total_calls_count')::numeric) as daily_total_calls_count,
-                sum((metadata_->>'successful_call_count')::numeric) as daily_successful_call_count,
-                sum((metadata_->>'unsuccessful_call_count')::numeric) as daily_unsuccessful_call_count,
-                count(id)::numeric as "row_count",
-                metadata_->>'summary_date' as summary_date
-            from
-                data_agent_summaries das
-            where
-                TO_CHAR((metadata_->>'summary_date')::timestamp, 'yyyy-mm-dd') = '{summary_date}'
-            group by summary_date
-        """
-        cursor.execute(query)
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            query = """
+                select
+                    sum((metadata_->>'total_calls_count')::numeric) as daily_total_calls_count,
+                    sum((metadata_->>'successful_call_count')::numeric) as daily_successful_call_count,
+                    sum((metadata_->>'unsuccessful_call_count')::numeric) as daily_unsuccessful_call_count,
+                    count(id)::numeric as "row_count",
+                    metadata_->>'summary_date' as summary_date
+                from
+                    data_agent_summaries das
+                where
+                    das.summary_date >= %(summary_date)s::date
+                    and das.summary_date < %(summary_date)s::date + 1
+                group by metadata_->>'summary_date'
+            """
+            cursor.execute(query, {"summary_date": summary_date})
 
-        columns = list(cursor.description)
-        messages = cursor.fetchall()
-        cursor.close()
+            columns = list(cursor.description)
+            messages = cursor.fetchall()
+            cursor.close()
 
-        # make dict
-        results = {}
-        for row in messages:
-            for i, col in enumerate(columns):
-                results[col.name] = row[i]
+            # make dict
+            results = {}
+            for row in messages:
+                for i, col in enumerate(columns):
+                    results[col.name] = row[i]
 
-        return results
+            return results
     except (Exception, psycopg2.DatabaseError) as e:
         logging.error(e)
-        cursor.close()
+        if cursor is not None:
+            cursor.close()
         exit(1)
 
 
+# Tenants whose call_summaries table is known to be up to date in this process;
+# the ALTER and the index build take table locks, so they run only once.
+_call_summaries_ready = set()
+
+
 def create_call_summaries_table():
+    environment_token = get_active_environment_token()
+    if environment_token in _call_summaries_ready:
+        return
+    cursor = None
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            table_creation = """
+                    CREATE TABLE IF NOT EXISTS call_summaries (
+                    id SERIAL PRIMARY KEY,
+                    call_summary TEXT,
+                    file_name TEXT,
+                    created_at numeric DEFAULT EXTRACT(EPOCH FROM CURRENT_TIMESTAMP)
+                )
+            """
+            cursor.execute(table_creation)
+            # The recording content a summary was made from, so a redelivery can tell it is done
+            cursor.execute("ALTER TABLE call_summaries ADD COLUMN IF NOT EXISTS content_hash TEXT")
+            cursor.execute(
+                "CREATE INDEX CONCURRENTLY IF NOT EXISTS call_summaries_file_name_idx ON call_summaries (file_name)"
+            )
+            cursor.close()
+        _call_summaries_ready.add(environment_token)
+    except (Exception, psycopg2.DatabaseError) as e:
+        logging.error(e)
+        if cursor is not None:
+            cursor.close()
+        exit(1)
+
+
+def save_call_summary(call_summary, file_name, content_hash=None):
+    cursor = None
+    try:
+        create_call_summaries_table()
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            insert_query = (
+                f"""INSERT INTO call_summaries(call_summary, file_name, content_hash) VALUES(%s, %s, %s);"""
+            )
+            cursor.execute(
+                insert_query,
+                (
+                    call_summary,
+                    file_name,
+                    content_hash,
+                ),
+            )
+            cursor.close()
+            return "Call Summary saved successfully!"
+    except (Exception, psycopg2.DatabaseError) as e:
+        logging.error(e)
+        if cursor is not None:
+            cursor.close()
+        # Raised rather than exiting, so the consumer retries the recording
+        raise
+
+
+def has_call_summary(file_name, content_hash):
+    """Whether a call summary was stored for this content of the recording."""
+    create_call_summaries_table()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                "SELECT 1 FROM call_summaries WHERE file_name = %s AND content_hash = %s LIMIT 1",
+                (file_name, content_hash),
+            )
+            return cursor.fetchone() is not None
+        finally:
+            cursor.close()
+
+
+def create_transcript_cache_table():
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            table_creation = """
+                CREATE TABLE IF NOT EXISTS transcript_cache (
+                    content_hash TEXT NOT NULL,
+                    model_version TEXT NOT NULL,
+                    transcript TEXT NOT NULL,
+                    created_at numeric DEFAULT EXTRACT(EPOCH FROM CURRENT_TIMESTAMP),
+                    PRIMARY KEY (content_hash, model_version)
+                )
+            """
+            cursor.execute(table_creation)
+            cursor.close()
+    except (Exception, psycopg2.DatabaseError) as e:
+        logging.error(e)
+
+
+# The transcript cache is an optimisation, so its errors are logged and
+# treated as a miss instead of stopping the consumer.
+def get_cached_transcript(content_hash, model_version):
+    try:
+        create_transcript_cache_table()
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT transcript FROM transcript_cache WHERE content_hash = %s AND model_version = %s",
+                (content_hash, model_version),
+            )
+            row = cursor.fetchone()
+            cursor.close()
+            return row[0] if row else None
+    except (Exception, psycopg2.DatabaseError) as e:
+        logging.error(e)
+        return None
+
+
+def save_cached_transcript(content_hash, model_version, transcript):
     try:
+        create_transcript_cache_table()
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            insert_query = """
+                INSERT INTO transcript_cache(content_hash, model_version, transcript) VALUES(%s, %s, %s)
+                ON CONFLICT (content_hash, model_version) DO NOTHING;
+            """
+            cursor.execute(insert_query, (content_hash, model_version, transcript))
+            cursor.close()
+    except (Exception, psycopg2.DatabaseError) as e:
+        logging.error(e)
+
+
+def create_summary_leases_table():
+    with get_connection() as conn:
         cursor = conn.cursor()
         table_creation = """
-                CREATE TABLE IF NOT EXISTS call_summaries (
-                id SERIAL PRIMARY KEY,
-                call_summary TEXT,
-                file_name TEXT,
-                created_at numeric DEFAULT EXTRACT(EPOCH FROM CURRENT_TIMESTAMP)
+            CREATE TABLE IF NOT EXISTS summary_generation_leases (
+                summary_date TEXT PRIMARY KEY,
+                lease_owner TEXT,
+                lease_expires_at numeric NOT NULL,
+                last_started_at numeric NOT NULL,
+                rerun_requested BOOLEAN NOT NULL DEFAULT FALSE
             )
         """
         cursor.execute(table_creation)
         cursor.close()
-    except (Exception, psycopg2.DatabaseError) as e:
-        logging.error(e)
+
+
+# Summary leases decide which consumer (across replicas) regenerates a date's
+# summaries. Errors propagate so the message is retried rather than dropped.
+def claim_summary_lease(summary_date, lease_owner, requested_at, now, lease_seconds):
+    """Try to take the lease for summary_date.
+
+    Returns "acquired" when the caller should generate, "covered" when a
+    generation started after requested_at already includes this request, and
+    "rerun_requested" when the current holder has been asked to run again.
+    """
+    create_summary_leases_table()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        while True:
+            cursor.execute(
+                """
+                INSERT INTO summary_generation_leases(summary_date, lease_owner, lease_expires_at, last_started_at)
+                VALUES(%s, %s, %s, %s)
+                ON CONFLICT (summary_date) DO UPDATE SET
+                    lease_owner = EXCLUDED.lease_owner,
+                    lease_expires_at = EXCLUDED.lease_expires_at,
+                    last_started_at = EXCLUDED.last_started_at,
+                    rerun_requested = FALSE
+                WHERE summary_generation_leases.lease_expires_at <= %s
+                  AND summary_generation_leases.last_started_at < %s
+                RETURNING summary_date;
+                """,
+                (summary_date, lease_owner, now + lease_seconds, now, now, requested_at),
+            )
+            if cursor.fetchone():
+                cursor.close()
+                return "acquired"
+
+            cursor.execute(
+                """
+                UPDATE summary_generation_leases SET rerun_requested = TRUE
+                WHERE summary_date = %s AND lease_expires_at > %s AND last_started_at < %s
+                RETURNING summary_date;
+                """,
+                (summary_date, now, requested_at),
+            )
+            if cursor.fetchone():
+                cursor.close()
+                return "rerun_requested"
+
+            cursor.execute(
+                "SELECT last_started_at FROM summary_generation_leases WHERE summary_date = %s",
+                (summary_date,),
+            )
+            row = cursor.fetchone()
+            if row and row[0] >= requested_at:
+                cursor.close()
+                return "covered"
+            # The lease was released between the statements above; try again
+
+
+def finish_summary_lease(summary_date, lease_owner, now, lease_seconds):
+    """Release the lease, or keep it and return True if a rerun was requested while generating."""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            UPDATE summary_generation_leases SET
+                last_started_at = CASE WHEN rerun_requested THEN %s ELSE last_started_at END,
+                lease_expires_at = CASE WHEN rerun_requested THEN %s ELSE %s END,
+                rerun_requested = FALSE
+            WHERE summary_date = %s AND lease_owner = %s
+            RETURNING lease_expires_at > %s;
+            """,
+            (now, now + lease_seconds, now, summary_date, lease_owner, now),
+        )
+        row = cursor.fetchone()
         cursor.close()
-        exit(1)
+        return bool(row and row[0])
 
 
-def save_call_summary(call_summary, file_name):
-    try:
-        create_call_summaries_table()
+def renew_summary_lease(summary_date, lease_owner, now, lease_seconds):
+    """Extend a lease the caller still holds; returns False if it was lost (expired and taken over)."""
+    with get_connection() as conn:
         cursor = conn.cursor()
-        insert_query = (
-            f"""INSERT INTO call_summaries(call_summary, file_name) VALUES(%s, %s);"""
+        cursor.execute(
+            """
+            UPDATE summary_generation_leases SET lease_expires_at = %s
+            WHERE summary_date = %s AND lease_owner = %s
+            RETURNING summary_date;
+            """,
+            (now + lease_seconds, summary_date, lease_owner),
         )
+        row = cursor.fetchone()
+        cursor.close()
+        return row is not None
+
+
+def release_summary_lease(summary_date, lease_owner, now):
+    with get_connection() as conn:
+        cursor = conn.cursor()
         cursor.execute(
-            insert_query,
-            (
-                call_summary,
-                file_name,
-            ),
+            "UPDATE summary_generation_leases SET lease_expires_at = %s WHERE summary_date = %s AND lease_owner = %s",
+            (now, summary_date, lease_owner),
         )
         cursor.close()
-        return "Call Summary saved successfully!"
+
+
+def get_latest_representative_summaries(summary_date):
+    """Most recent summary row of every representative for the date, oldest representative first."""
+    ensure_migrated("data_sales_representative_summaries")
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            cursor.execute(
+                """
+                SELECT * FROM (
+                    SELECT DISTINCT ON (metadata_->>'representative_name')
+                        id,
+                        metadata_->>'representative_name' AS representative_name,
+                        text,
+                        (metadata_->>'total_calls_count')::numeric AS total_calls_count,
+                        (metadata_->>'successful_call_count')::numeric AS successful_call_count,
+                        (metadata_->>'unsuccessful_call_count')::numeric AS unsuccessful_call_count
+                    FROM data_sales_representative_summaries
+                    WHERE summary_date >= %s::date AND summary_date < %s::date + 1
+                    ORDER BY metadata_->>'representative_name', id DESC
+                ) latest
+                ORDER BY id
+                """,
+                (summary_date, summary_date),
+            )
+            rows = cursor.fetchall()
+            cursor.close()
+            return rows
     except (Exception, psycopg2.DatabaseError) as e:
         logging.error(e)
+        raise
+
+
+def create_daily_summary_state_table():
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        table_creation = """
+            CREATE TABLE IF NOT EXISTS daily_summary_state (
+                summary_date TEXT PRIMARY KEY,
+                summary TEXT NOT NULL,
+                covered JSONB NOT NULL,
+                updated_at numeric DEFAULT EXTRACT(EPOCH FROM CURRENT_TIMESTAMP)
+            )
+        """
+        cursor.execute(table_creation)
+        cursor.close()
+
+
+def get_daily_summary_state(summary_date):
+    """Return (summary, covered) for the date, covered mapping representative name to summary hash."""
+    create_daily_summary_state_table()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT summary, covered FROM daily_summary_state WHERE summary_date = %s",
+            (summary_date,),
+        )
+        row = cursor.fetchone()
+        cursor.close()
+        return (row[0], row[1]) if row else (None, {})
+
+
+def save_daily_summary_state(summary_date, summary, covered):
+    create_daily_summary_state_table()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            INSERT INTO daily_summary_state(summary_date, summary, covered) VALUES(%s, %s, %s)
+            ON CONFLICT (summary_date) DO UPDATE SET
+                summary = EXCLUDED.summary,
+                covered = EXCLUDED.covered,
+                updated_at = EXTRACT(EPOCH FROM CURRENT_TIMESTAMP);
+            """,
+            (summary_date, summary, json.dumps(covered)),
+        )
+        cursor.close()
+
+
+def get_daily_summary_row_ids(summary_date):
+    """Ids of the stored day summary rows, to delete once a refreshed summary has been stored."""
+    ensure_migrated("data_daily_summaries")
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT id FROM data_daily_summaries WHERE summary_date = %s::date", (summary_date,))
+            return [row[0] for row in cursor.fetchall()]
+        except psycopg2.errors.UndefinedTable:
+            # Nothing stored yet; the vector store creates the table on first insert
+            return []
+        finally:
+            cursor.close()
+
+
+def delete_daily_summaries(row_ids):
+    """Remove replaced day summary rows, so a refreshed summary replaces rather than joins them."""
+    if not row_ids:
+        return 0
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("DELETE FROM data_daily_summaries WHERE id = ANY(%s)", (list(row_ids),))
+            return cursor.rowcount
+        finally:
+            cursor.close()
+
+
+@contextmanager
+def transcript_ingest_lock(file_name):
+    """Serialise ingestion of one file across consumers and replicas with a Postgres advisory lock.
+
+    The lock's session is held for the whole transcription and ingest, which
+    checks out pooled connections itself, so it lives on a dedicated connection.
+    """
+    with get_dedicated_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT pg_advisory_lock(hashtext(%s))", (f"call_transcripts:{file_name}",))
+        try:
+            yield
+        finally:
+            cursor.execute("SELECT pg_advisory_unlock(hashtext(%s))", (f"call_transcripts:{file_name}",))
+            cursor.close()
+
+
+def get_ingested_transcript_hashes(file_name):
+    """Content hashes stored for a file's transcript rows (None for rows ingested before hashing)."""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                "SELECT DISTINCT metadata_->>'content_hash' FROM data_call_transcripts WHERE metadata_->>'file_name' = %s",
+                (file_name,),
+            )
+            return {row[0] for row in cursor.fetchall()}
+        except psycopg2.errors.UndefinedTable:
+            return set()
+        finally:
+            cursor.close()
+
+
+def delete_transcript_rows(file_name):
+    """Delete a file's transcript rows and take them out of the call count rollup in the same statement.
+
+    The call is only subtracted if the rollup counted it, as recorded in call_count_rollup_calls.
+    """
+    ensure_call_count_rollups()
+    environment_token = get_active_environment_token()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            WITH deleted AS (
+                DELETE FROM data_call_transcripts WHERE metadata_->>'file_name' = %(file_name)s
+                RETURNING call_date, representative_name, call_disposition, metadata_->>'call_talk_time' AS call_talk_time
+            ), uncounted AS (
+                DELETE FROM call_count_rollup_calls
+                WHERE environment_token = %(environment_token)s AND file_name = %(file_name)s
+                RETURNING file_name
+            ), calls AS (
+                SELECT
+                    call_date,
+                    COALESCE(representative_name, '') AS representative_name,
+                    COALESCE(call_disposition, '') AS call_disposition,
+                    count(*) AS row_count,
+                    COALESCE(max(substring(call_talk_time from '^[0-9]+(?:[.][0-9]+)?')::numeric), 0) AS talk_time_seconds
+                FROM deleted
+                WHERE call_date IS NOT NULL
+                GROUP BY 1, 2, 3
+            ), rolled_back AS (
+                UPDATE call_count_rollups r SET
+                    call_count = r.call_count - 1,
+                    row_count = r.row_count - calls.row_count,
+                    talk_time_seconds = r.talk_time_seconds - calls.talk_time_seconds
+                FROM calls
+                WHERE r.environment_token = %(environment_token)s
+                  AND r.summary_date = calls.call_date
+                  AND r.representative_name = calls.representative_name
+                  AND r.call_disposition = calls.call_disposition
+                  AND EXISTS (SELECT 1 FROM uncounted)
+            )
+            SELECT count(*) FROM deleted
+            """,
+            {"file_name": file_name, "environment_token": environment_token},
+        )
+        deleted = cursor.fetchone()[0]
+        cursor.close()
+        return deleted
+
+
+def add_call_to_rollup(file_name, content_hash, call_date, representative_name, call_disposition, talk_time_seconds):
+    """Count a stored call (file_name) in the rollup, at most once.
+
+    The call is recorded in call_count_rollup_calls by the same statement that
+    increments the rollup, so calling it again after a crash or on redelivery
+    is safe. row_count is the number of transcript rows stored for the file.
+    """
+    ensure_call_count_rollups()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            WITH counted AS (
+                INSERT INTO call_count_rollup_calls (environment_token, file_name, content_hash)
+                VALUES (%(environment_token)s, %(file_name)s, %(content_hash)s)
+                ON CONFLICT (environment_token, file_name) DO NOTHING
+                RETURNING file_name
+            )
+            INSERT INTO call_count_rollups
+                (environment_token, summary_date, representative_name, call_disposition, call_count, row_count, talk_time_seconds)
+            SELECT
+                %(environment_token)s, %(call_date)s::date, %(representative_name)s, %(call_disposition)s, 1,
+                (SELECT count(*) FROM data_call_transcripts WHERE metadata_->>'file_name' = counted.file_name),
+                %(talk_time_seconds)s::numeric
+            FROM counted
+            ON CONFLICT (environment_token, summary_date, representative_name, call_disposition) DO UPDATE SET
+                call_count = call_count_rollups.call_count + 1,
+                row_count = call_count_rollups.row_count + EXCLUDED.row_count,
+                talk_time_seconds = call_count_rollups.talk_time_seconds + EXCLUDED.talk_time_seconds;
+            """,
+            {
+                "environment_token": get_active_environment_token(),
+                "file_name": file_name,
+                "content_hash": content_hash,
+                "call_date": call_date,
+                "representative_name": representative_name or "",
+                "call_disposition": call_disposition or "",
+                "talk_time_seconds": talk_time_seconds,
+            },
+        )
         cursor.close()
-        exit(1)
@@ -0,0 +1,125 @@
+import logging
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+import pymssql
+
+from common.tenant_context import get_current_tenant
+
+pool_max_connections = int(os.getenv("SQL_DB_POOL_MAX_CONNECTIONS", "5"))
+pool_checkout_timeout = float(os.getenv("SQL_DB_POOL_CHECKOUT_TIMEOUT", "30"))
+# Idle connections older than this are reopened rather than trusted to still be alive
+pool_recycle_seconds = float(os.getenv("SQL_DB_POOL_RECYCLE_SECONDS", "300"))
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class _MssqlPool:
+    def __init__(self, settings):
+        self.settings = settings
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(pool_max_connections)
+        self.lock = threading.Lock()
+        # Set once the settings changed; connections are closed as they come back
+        self.retired = False
+
+    def _connect(self):
+        conn = pymssql.connect(
+            self.settings["server"],
+            self.settings["user"],
+            self.settings["password"],
+            self.settings["database"],
+            autocommit=True,
+        )
+        logging.info(f"Opened pooled SQL Server connection for: {self.settings['server']} {self.settings['database']}")
+        return conn
+
+    def checkout(self):
+        if not self.slots.acquire(timeout=pool_checkout_timeout):
+            raise TimeoutError(
+                f"Timed out waiting for a SQL Server connection for {self.settings['server']} {self.settings['database']}"
+            )
+        try:
+            while True:
+                try:
+                    conn, last_used = self.idle.get_nowait()
+                except queue.Empty:
+                    return self._connect()
+                if time.monotonic() - last_used < pool_recycle_seconds:
+                    return conn
+                _close_quietly(conn)
+        except Exception:
+            self.slots.release()
+            raise
+
+    def checkin(self, conn, broken=False):
+        try:
+            with self.lock:
+                keep = not broken and not self.retired
+                if keep:
+                    self.idle.put((conn, time.monotonic()))
+            if not keep:
+                _close_quietly(conn)
+        finally:
+            self.slots.release()
+
+    def retire(self):
+        """Close the idle connections now and the checked-out ones as they are returned."""
+        with self.lock:
+            self.retired = True
+        while True:
+            try:
+                conn, _ = self.idle.get_nowait()
+            except queue.Empty:
+                return
+            _close_quietly(conn)
+
+
+def _close_quietly(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+def get_mssql_settings():
+    tenant = get_current_tenant()
+    if tenant is not None:
+        return tenant.mssql
+    return {
+        "server": os.getenv('SQL_DB_HOST'),
+        "user": os.getenv('SQL_DB_USER'),
+        "password": os.getenv('SQL_DB_PASSWORD'),
+        "database": os.getenv('SQL_DB_NAME'),
+    }
+
+
+@contextmanager
+def get_mssql_connection(settings=None):
+    """Check out a warm autocommit SQL Server connection for the current tenant's settings."""
+    settings = settings or get_mssql_settings()
+    key = (settings["server"], settings["user"], settings["database"])
+    stale_pool = None
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None or pool.settings != settings:
+            stale_pool = pool
+            pool = _pools[key] = _MssqlPool(settings)
+    if stale_pool is not None:
+        logging.info(f"SQL Server settings changed for: {settings['server']} {settings['database']}, retiring old pool")
+        stale_pool.retire()
+
+    conn = pool.checkout()
+    broken = False
+    try:
+        yield conn
+    except Exception:
+        # The connection may be mid-transaction or dead; don't hand it to the next message
+        broken = True
+        raise
+    finally:
+        pool.checkin(conn, broken=broken)
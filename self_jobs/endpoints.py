@@ -4,7 +4,9 @@ import nest_asyncio
 import sys
 import time
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
+import tiktoken
 from flask import Flask
 from dotenv import load_dotenv
 
@@ -14,6 +16,8 @@ sys.path.insert(0, project_dir)
 from generate_daily_summary import summary_of_day  # Assuming this module exists
 from db_configurations.auto_call_postgres_config import get_representative_details  # Assuming this module exists
 from generate_agent_summary import summary_of_agent  # Assuming this module exists
+from rate_limiter import RateLimitedTokenCounter, call_with_rate_limit_retries, llm_limiter
+from common.tenant_context import submit_with_context
 
 load_dotenv()
 
@@ -23,13 +27,29 @@ nest_asyncio.apply()
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
 logger = logging.getLogger(__name__)
 
+# Representative summaries run concurrently; how fast they actually go is
+# decided by the shared RPM/TPM limiter in rate_limiter.py
+AGENT_SUMMARY_CONCURRENCY = int(os.getenv("AGENT_SUMMARY_CONCURRENCY", "4"))
+agent_summary_executor = ThreadPoolExecutor(max_workers=max(1, AGENT_SUMMARY_CONCURRENCY),
+                                            thread_name_prefix="agent-summary")
+
+def summarize_representative(options):
+    token_counter = RateLimitedTokenCounter(
+        llm_limiter, tokenizer=tiktoken.encoding_for_model("gpt-4-1106-preview").encode
+    )
+    call_with_rate_limit_retries(llm_limiter, summary_of_agent, options, token_counter=token_counter)
+    return token_counter.total_llm_token_count
+
+
 def get_agent_summary(summary_date):
     logger.info(f"Fetching representative details for {summary_date}")
     representatives = get_representative_details(summary_date)
 
     if representatives:
         logger.info(f"Found {len(representatives)} representatives for {summary_date}")
-        for idx, representative in enumerate(representatives):
+        start_time = time.time()
+        futures = {}
+        for representative in representatives:
             options = {
                 'representative_name': representative["representative_name"],
                 'call_count': representative["call_count"],
@@ -39,8 +59,23 @@ def get_agent_summary(summary_date):
                 'summary_date': summary_date,
             }
             logger.info(f"Generating summary for representative {representative['representative_name']}")
-            summary_of_agent(options)
-            time.sleep(60)
+            futures[representative["representative_name"]] = submit_with_context(
+                agent_summary_executor, summarize_representative, options
+            )
+
+        # Wait for every representative before reporting, so one failure doesn't leave others running unobserved
+        total_tokens = 0
+        first_error = None
+        for representative_name, future in futures.items():
+            try:
+                total_tokens += future.result()
+            except Exception as e:
+                logger.error(f"Summary for representative {representative_name} failed: {e}")
+                first_error = first_error or e
+        logger.info(f"Generated {len(futures)} representative summaries in {time.time() - start_time:.1f}s "
+                    f"using {total_tokens} LLM tokens; limiter: {llm_limiter.stats()}")
+        if first_error is not None:
+            raise first_error
         logger.info("Successfully generated sales representatives summaries")
     else:
         logger.warning(f"No representatives found for {summary_date}")
@@ -1,9 +1,6 @@
 from llama_index import (
     Prompt,
-    VectorStoreIndex,
     ServiceContext,
-    StorageContext,
-    set_global_service_context,
 )
 from llama_index.llms import OpenAI
 import os
@@ -11,17 +8,21 @@ from dotenv import load_dotenv
 from llama_index.vector_stores.types import MetadataFilters, ExactMatchFilter
 from llama_index.llms import ChatMessage, MessageRole
 from llama_index.prompts.base import ChatPromptTemplate
-from llama_index.callbacks import CallbackManager, TokenCountingHandler
+from llama_index.callbacks import CallbackManager
+import logging
 import tiktoken
 from generate_embeddings import generating_summaries_embeddings
-from db_configurations.auto_call_postgres_config import get_vector_store
+from db_configurations.auto_call_postgres_config import get_vector_index
+from common.tree_summarizer import TreeSummarizer
+from dbConfig.node_fetch import SUMMARY_RETRIEVAL_MODE, iter_call_transcript_pages
+from rate_limiter import RateLimitedTokenCounter, llm_limiter
 
 load_dotenv()
 
 environment = os.environ.get("ENVIRONMENT")
 
 
-def summary_of_agent(options):
+def summary_of_agent(options, token_counter=None):
     representative_name = options["representative_name"]
     call_recording_count = options["call_count"]
     row_count = options["row_count"]
@@ -29,8 +30,9 @@ def summary_of_agent(options):
     unsuccessful_calls_count = options["unsuccessful_calls_count"]
     summary_date = options["summary_date"]
 
-    token_counter = TokenCountingHandler(
-        tokenizer=tiktoken.encoding_for_model("gpt-4-1106-preview").encode
+    # Every LLM call takes its share of the shared RPM/TPM budget before it is sent
+    token_counter = token_counter or RateLimitedTokenCounter(
+        llm_limiter, tokenizer=tiktoken.encoding_for_model("gpt-4-1106-preview").encode
     )
 
     callback_manager = CallbackManager([token_counter])
@@ -109,35 +111,32 @@ def summary_of_agent(options):
         ]
     )
 
-    vector_store = get_vector_store("call_transcripts")
-
-    storage_context = StorageContext.from_defaults(vector_store=vector_store)
-
-    gpt4 = OpenAI(temperature=0, model="gpt-4-1106-preview")
+    # 429s are retried by the caller through the shared limiter, so fail fast here
+    gpt4 = OpenAI(temperature=0, model="gpt-4-1106-preview", max_retries=2)
     service_context_gpt4 = ServiceContext.from_defaults(
         llm=gpt4,
         chunk_size=1024,
         callback_manager=callback_manager,
     )
-    set_global_service_context(service_context_gpt4)
-
-    index = VectorStoreIndex.from_documents(
-        [],
-        service_context=service_context_gpt4,
-        show_progress=False,
-        storage_context=storage_context,
-    )
-    query_engine = index.as_query_engine(
-        text_qa_template=summary_prompt,
-        similarity_top_k=row_count,
-        verbose=True,
-        filters=filters,
-        refine_prompt=CHAT_REFINE_PROMPT,
-        query_mode="compact_accumulate",
-    )
 
     query = f"Provide me a call summary of representative - {representative_name}."
-    response = query_engine.query(query)
+    if SUMMARY_RETRIEVAL_MODE == "direct":
+        summarizer = TreeSummarizer(service_context_gpt4, summary_prompt)
+        response = summarizer.summarize(query, iter_call_transcript_pages(representative_name, summary_date))
+    else:
+        index = get_vector_index("call_transcripts", service_context=service_context_gpt4)
+        query_engine = index.as_query_engine(
+            service_context=service_context_gpt4,
+            text_qa_template=summary_prompt,
+            similarity_top_k=row_count,
+            verbose=True,
+            filters=filters,
+            refine_prompt=CHAT_REFINE_PROMPT,
+            query_mode="compact_accumulate",
+        )
+        response = query_engine.query(query)
+    logging.info(f"Summary of {representative_name} used {token_counter.total_llm_token_count} LLM tokens "
+                 f"in {len(token_counter.llm_token_counts)} requests")
 
     try:
         summary_details = {
@@ -1,13 +1,15 @@
 import os
 import json
 import pika
-import pymssql
 import vertexai
 from vertexai.generative_models import GenerativeModel, SafetySetting
 from dotenv import load_dotenv
 import logging
 import time
+from concurrent.futures import ThreadPoolExecutor
 from langchain.text_splitter import CharacterTextSplitter
+from db_configurations.mssql_pool import get_mssql_connection, get_mssql_settings
+from publisher import get_publisher, get_publisher_settings
 
 load_dotenv()
 logging.basicConfig(level=logging.DEBUG,
@@ -20,6 +22,8 @@ MAX_TOKENS = 512
 BATCH_SIZE = 5
 FINAL_SUMMARY_LIMIT = 1500
 TOKEN_LIMIT = 10000
+# Maximum Gemini requests in flight across all call-notes messages; 1 runs them one at a time
+CALL_NOTES_CONCURRENCY = int(os.getenv("CALL_NOTES_CONCURRENCY", "4"))
 INITIAL_CONTEXT = """
 You will be receiving the transcript of a sales call. The goal is to generate notes summarizing the call's content.
 Do not provide any helper text. Skip any sort of text style formatting. 
@@ -57,6 +61,9 @@ safety_settings = [
     ),
 ]
 
+llm_executor = ThreadPoolExecutor(max_workers=max(1, CALL_NOTES_CONCURRENCY),
+                                  thread_name_prefix="call-notes-llm")
+
 def log_time(operation):
     def decorator(func):
         def wrapper(*args, **kwargs):
@@ -68,50 +75,27 @@ def log_time(operation):
         return wrapper
     return decorator
 
-@log_time("Getting database connection")
-def get_db_connection():
-    logging.info(f".......{os.getenv('SQL_DB_USER')}..........{os.getenv('SQL_DB_HOST')}.........{os.getenv('SQL_DB_NAME')}")
-    try:
-        server = os.getenv('SQL_DB_HOST')  
-        user = os.getenv('SQL_DB_USER')
-        password = os.getenv('SQL_DB_PASSWORD')
-        database = os.getenv('SQL_DB_NAME')
-        conn = pymssql.connect(server, user, password, database)
-        logging.info(f"Database connection successful for: {os.getenv('SQL_DB_HOST')} {os.getenv('SQL_DB_USER')} {os.getenv('SQL_DB_NAME')}")
-        return conn
-    except Exception as e:
-        logging.error(f"Unexpected error for: {os.getenv('SQL_DB_HOST')} {os.getenv('SQL_DB_USER')} {os.getenv('SQL_DB_NAME')}: {e}")
-        raise
-
-@log_time("Fetching transcript from database")
-def fetch_transcript_from_db(lead_transit_id):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT transcript FROM cas_calltranscript WHERE LeadTransitId = %s", (lead_transit_id,))
-    result = cursor.fetchone()
-    conn.close()
-
-    if result:
-        return result[0]
-    else:
-        raise ValueError("Transcript not found for the given lead_transit_id.")
-
-@log_time("Fetching prompt from database")
-def fetch_prompt_from_db(company_id):
-    conn = get_db_connection()
-    cursor = conn.cursor(as_dict=True)
+@log_time("Fetching transcript and prompt from database")
+def fetch_call_notes_inputs(lead_transit_id, company_id):
+    # One round trip on a pooled connection for both the transcript and the company prompt
     query = """
-        SELECT SettingValue FROM cas_CompanySetting
-        WHERE CompanyId = %s AND SettingKey = 'SummaryPrompt'
+        SELECT t.transcript,
+            (SELECT TOP 1 s.SettingValue FROM cas_CompanySetting s
+             WHERE s.CompanyId = %s AND s.SettingKey = 'SummaryPrompt') AS SettingValue
+        FROM cas_calltranscript t
+        WHERE t.LeadTransitId = %s
     """
-    cursor.execute(query, (company_id,))
-    row = cursor.fetchone()
-    conn.close()
+    with get_mssql_connection() as conn:
+        cursor = conn.cursor(as_dict=True)
+        cursor.execute(query, (company_id, lead_transit_id))
+        row = cursor.fetchone()
+        cursor.close()
 
-    if row:
-        return row['SettingValue']
-    else:
+    if not row:
+        raise ValueError("Transcript not found for the given lead_transit_id.")
+    if row['SettingValue'] is None:
         raise ValueError(f"No prompt found for CompanyID: {company_id}")
+    return row['transcript'], row['SettingValue']
 
 @log_time("Generating and saving call notes")
 def generate_and_save_call_notes(metadata):
@@ -119,8 +103,7 @@ def generate_and_save_call_notes(metadata):
         logging.info(f"Metadata that came: {metadata}")
         lead_transit_id = metadata["lead_transit_id"]
         logging.info(f"Lead Transit ID: {lead_transit_id}")
-        content = fetch_transcript_from_db(lead_transit_id)
-        prompt = fetch_prompt_from_db(metadata.get("company_id"))
+        content, prompt = fetch_call_notes_inputs(lead_transit_id, metadata.get("company_id"))
         logging.info(f"Content:::::::::::::::::::::: {len(content) // 3}")
         token_length = len(content) // 3
 
@@ -136,16 +119,18 @@ def generate_and_save_call_notes(metadata):
 
         logging.info(f"Call Notes: {final_summary_text}")
         save_transcript_summary(str(final_summary_text), metadata)
-        message = {
-            "notes": final_summary_text,
-            "user_id": metadata["user_id"],
-            "user_name": metadata["user_name"],
-            "lead_transit_id": metadata["lead_transit_id"]
-        }
-        publish_to_queue(message=message)
-        logging.info("Call Notes are saved and published successfully.")
     except Exception as e:
         logging.error(f"Error in generate_and_save_call_notes: {e}")
+        return
+    message = {
+        "notes": final_summary_text,
+        "user_id": metadata["user_id"],
+        "user_name": metadata["user_name"],
+        "lead_transit_id": metadata["lead_transit_id"]
+    }
+    # Raises if the notes could not be published, so the delivery is retried instead of acked
+    publish_to_queue(message=message)
+    logging.info("Call Notes are saved and published successfully.")
 
 @log_time("Splitting text into chunks")
 def split_text(text, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
@@ -158,13 +143,15 @@ def split_text(text, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
     )
     return splitter.split_text(text)
 
+def get_ai_responses(texts, prompt, model):
+    """Run get_ai_response for every text concurrently, returning the responses in input order."""
+    if CALL_NOTES_CONCURRENCY <= 1 or len(texts) <= 1:
+        return [get_ai_response(text, prompt, model) for text in texts]
+    return list(llm_executor.map(lambda text: get_ai_response(text, prompt, model), texts))
+
 @log_time("Summarizing chunks")
 def summarize_chunks(chunks, prompt, model):
-    summaries = []
-    for chunk in chunks:
-        response_text = get_ai_response(chunk, prompt, model)
-        summaries.append(response_text)
-    return summaries
+    return get_ai_responses(chunks, prompt, model)
 
 @log_time("Generating AI response")
 def get_ai_response(text, prompt, model):
@@ -178,12 +165,8 @@ def get_ai_response(text, prompt, model):
 
 @log_time("Combining summaries")
 def combine_summaries(summaries, prompt, model):
-    combined_summaries = []
-    for i in range(0, len(summaries), BATCH_SIZE):
-        batch = "\n\n".join(summaries[i:i + BATCH_SIZE])
-        response_text = get_ai_response(batch, prompt, model)
-        combined_summaries.append(response_text)
-    return combined_summaries
+    batches = ["\n\n".join(summaries[i:i + BATCH_SIZE]) for i in range(0, len(summaries), BATCH_SIZE)]
+    return get_ai_responses(batches, prompt, model)
 
 @log_time("Creating final summary")
 def final_summary(combined_summaries, prompt, model):
@@ -193,79 +176,49 @@ def final_summary(combined_summaries, prompt, model):
     else:
         final_chunks = [final_combined_summary]
 
-    final_summary_parts = []
-    for final_chunk in final_chunks:
-        response_text = get_ai_response(final_chunk, prompt, model)
-        final_summary_parts.append(response_text)
+    final_summary_parts = get_ai_responses(final_chunks, prompt, model)
 
     return "\n\n".join(final_summary_parts)
 
 @log_time("Saving transcript summary to database")
 def save_transcript_summary(call_notes, metadata):
-    conn = None
-    cursor = None
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
         user_id = metadata["user_id"]
         lead_transit_id = metadata["lead_transit_id"]
         notes = str(call_notes)
 
-        select_query = """
-        SELECT COUNT(*)
-        FROM cas_CallTranscript
+        update_query = """
+        UPDATE cas_CallTranscript
+        SET Notes = %s
         WHERE UserId = %s AND LeadTransitId = %s
         """
 
-        cursor.execute(select_query, (user_id, lead_transit_id))
-        record_exists = cursor.fetchone()[0]
-
-        if record_exists:
-            logging.info("The record exists")
-            update_query = """
-            UPDATE cas_CallTranscript
-            SET Notes = %s
-            WHERE UserId = %s AND LeadTransitId = %s
-            """
-
+        with get_mssql_connection() as conn:
+            cursor = conn.cursor()
             cursor.execute(update_query, (notes, user_id, lead_transit_id))
-        else:
+            updated_rows = cursor.rowcount
+            cursor.close()
+
+        if not updated_rows:
             raise ValueError("Record with user_id = {} and LeadTransitId = {} does not exist.".format(user_id, lead_transit_id))
-        
-        conn.commit()
         logging.info("Transcript summary saved successfully.")
 
     except Exception as e:
-        logging.error(f"Unexpected error for: {os.getenv('SQL_DB_HOST')} {os.getenv('SQL_DB_USER')} {os.getenv('SQL_DB_NAME')}: {e}")
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
+        mssql_settings = get_mssql_settings()
+        logging.error(f"Unexpected error for: {mssql_settings['server']} {mssql_settings['user']} {mssql_settings['database']}: {e}")
 
 @log_time("Publishing message to queue")
 def publish_to_queue(message):
     try:
-        logging.info(f"Publishing the notes to : {os.getenv('RABBITMQ_PUBLISH_QUEUE')} on host: {os.getenv('RABBITMQ_HOST')} {os.getenv('RABBITMQ_USERNAME')}")
-        credentials = pika.PlainCredentials(username=os.getenv('RABBITMQ_USERNAME'),
-                                            password=os.getenv('RABBITMQ_PASSWORD'))
-        connection = pika.BlockingConnection(
-            pika.ConnectionParameters(host=os.getenv('RABBITMQ_HOST'),
-                                      port=os.getenv('RABBITMQ_PORT'),
-                                      credentials=credentials,
-                                      virtual_host=os.getenv('RABBITMQ_VHOST')))
-
-        channel = connection.channel()
-        channel.queue_declare(queue=os.getenv('RABBITMQ_PUBLISH_QUEUE'), durable=True)
+        publisher_settings = get_publisher_settings()
+        logging.info(f"Publishing the notes to : {os.getenv('RABBITMQ_PUBLISH_QUEUE')} on host: {publisher_settings['host']} {publisher_settings['user']}")
         message_json = json.dumps(message)
-
-        channel.basic_publish(exchange=os.getenv('RABBITMQ_PUBLISH_EXCHANGE'),
-                              routing_key=os.getenv('RABBITMQ_PUBLISH_ROUTING_KEY'),
-                              body=message_json)
+        get_publisher(publisher_settings).publish(message_json)
         logging.info("Message published to the queue successfully.")
 
     except pika.exceptions.AMQPError as e:
         logging.error(f"An error occurred while publishing to the queue: {e}")
+        raise
     except Exception as e:
         logging.error(f"Unexpected error: {e}")
+        raise
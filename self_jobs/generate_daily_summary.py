@@ -1,25 +1,35 @@
+import hashlib
 import json
+import logging
 import sys
 from llama_index import (
     Prompt,
-    VectorStoreIndex,
     ServiceContext,
-    StorageContext,
-    set_global_service_context
 )
 from llama_index.llms import OpenAI
 import os
 from dotenv import load_dotenv
+from llama_index.schema import NodeWithScore, TextNode
 from llama_index.vector_stores.types import MetadataFilters, ExactMatchFilter
-from llama_index.callbacks import CallbackManager, TokenCountingHandler
+from llama_index.callbacks import CallbackManager
 import tiktoken
 
 # Add parent directory of self_jobs to sys.path
 project_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 sys.path.insert(0, project_dir)
-from db_configurations.auto_call_postgres_config import get_vector_store
+from db_configurations.auto_call_postgres_config import get_vector_index
 from generate_embeddings import generating_summaries_embeddings
-from db_configurations.auto_call_postgres_config import get_agent_summary_count_by_summary_date
+from db_configurations.auto_call_postgres_config import (
+    delete_daily_summaries,
+    get_agent_summary_count_by_summary_date,
+    get_daily_summary_row_ids,
+    get_daily_summary_state,
+    get_latest_representative_summaries,
+    save_daily_summary_state,
+)
+from rate_limiter import RateLimitedTokenCounter, llm_limiter
+from common.tree_summarizer import TreeSummarizer
+from dbConfig.node_fetch import SUMMARY_RETRIEVAL_MODE, iter_summary_pages
 
 load_dotenv()
 
@@ -31,64 +41,148 @@ db_password = os.getenv("DB_PASSWORD")
 db_name = os.getenv("DB_NAME")
 
 
-def summary_of_day(summary_date):
-    token_counter = TokenCountingHandler(
-        tokenizer=tiktoken.encoding_for_model("gpt-4-1106-preview").encode
-    )
-    callback_manager = CallbackManager([token_counter])
+SUMMARY_TEMPLATE = """
+    Act as if you are expert in math, statistical calculations. You have strong knowledge of how sales process works and you are very good at differentiating between successful and unsuccessful calls and aggregating the number of unsuccessful as well as successful calls separately. 
 
-    agent_summary_counts = get_agent_summary_count_by_summary_date(
-        summary_date=summary_date
-    )
+    You will have access to the agent level summary. In each one of them you will have successfulCallCount and unsuccessfulCallCount. We have to make sure the numbers get added correctly.
 
-    row_count = agent_summary_counts["row_count"]
-    daily_total_calls_count = agent_summary_counts["daily_total_calls_count"]
-    daily_successful_call_count = agent_summary_counts["daily_successful_call_count"]
-    daily_unsuccessful_call_count = agent_summary_counts["daily_unsuccessful_call_count"]
+    Using the call recording summaries provided, offer a concise summary that encompasses:
 
-    summary_template = f"""
-        Act as if you are expert in math, statistical calculations. You have strong knowledge of how sales process works and you are very good at differentiating between successful and unsuccessful calls and aggregating the number of unsuccessful as well as successful calls separately. 
+        1) Identification of the best sales representatives having most number of successful calls
+        2) Identification of the least successful representatives having most number of unsuccessful calls
+        3) Key insights into how sales reps understood and engaged with the prospects.
+        4) Highlighting of any main objections faced and the tactics representatives employed to handle them.
+        5) Notes on the overall tone, professionalism, and technical proficiency exhibited during the calls.
 
-        You will have access to the agent level summary. In each one of them you will have successfulCallCount and unsuccessfulCallCount. We have to make sure the numbers get added correctly.
-        
-        Using the call recording summaries provided, offer a concise summary that encompasses:
+    Remember to maintain a macro-level perspective, avoiding detailed breakdowns of individual calls. Structure your answer in coherent, meaningful paragraphs.
 
-            1) Identification of the best sales representatives having most number of successful calls
-            2) Identification of the least successful representatives having most number of unsuccessful calls
-            3) Key insights into how sales reps understood and engaged with the prospects.
-            4) Highlighting of any main objections faced and the tactics representatives employed to handle them.
-            5) Notes on the overall tone, professionalism, and technical proficiency exhibited during the calls.
-        
-        Remember to maintain a macro-level perspective, avoiding detailed breakdowns of individual calls. Structure your answer in coherent, meaningful paragraphs.
+    Keep it succinct.
 
-        Keep it succinct.
+    Example Response JSON Object (Only return this as your response):
 
-        Example Response JSON Object (Only return this as your response):
-            
-            "bestPerformer": "xyz pqr",
-            "leastPerformer": "qwe sdf",
-            "keyInsights": <Key Insights of the call-summaries>,
-            "objectionHandling": <Objection handing in the call-summaries>,
-            "otherNotes": <Other notes of the call-summaries>
-    """
+        "bestPerformer": "xyz pqr",
+        "leastPerformer": "qwe sdf",
+        "keyInsights": <Key Insights of the call-summaries>,
+        "objectionHandling": <Objection handing in the call-summaries>,
+        "otherNotes": <Other notes of the call-summaries>
+"""
 
-    summary_template += """
-        Below are the call recording summaries:
-        {context_str}
-    """
-    summary_prompt = Prompt(summary_template)
+SUMMARY_TEMPLATE += """
+    Below are the call recording summaries:
+    {context_str}
+"""
 
-    gpt4 = OpenAI(temperature=0, model="gpt-4-1106-preview")
+REFINE_TEMPLATE = """
+    Act as if you are expert in math, statistical calculations. You have strong knowledge of how sales process works.
 
-    vector_store = get_vector_store("sales_representative_summaries")
+    Below is the existing summary of the day, followed by agent level summaries that are new or have changed since it was written.
+    A changed agent summary replaces everything the existing summary says about that representative.
 
-    storage_context = StorageContext.from_defaults(vector_store=vector_store)
-    service_context_gpt4 = ServiceContext.from_defaults(
+    Update the existing summary with the new information, keeping everything that is still valid:
+
+        1) Re-evaluate the best sales representatives having most number of successful calls
+        2) Re-evaluate the least successful representatives having most number of unsuccessful calls
+        3) Key insights into how sales reps understood and engaged with the prospects.
+        4) Highlighting of any main objections faced and the tactics representatives employed to handle them.
+        5) Notes on the overall tone, professionalism, and technical proficiency exhibited during the calls.
+
+    The day now has {total_calls_count} calls in total: {successful_call_count} successful and {unsuccessful_call_count} unsuccessful.
+
+    Keep it succinct and answer in the same JSON format as the existing summary.
+
+    Existing summary of the day:
+    {existing_summary}
+
+    New or changed call recording summaries:
+    {context_str}
+"""
+
+# Refine the stored day summary with only the new/changed representative
+# summaries instead of re-reading the whole day on every run
+INCREMENTAL_DAILY_SUMMARY = os.getenv("INCREMENTAL_DAILY_SUMMARY", "true").lower() == "true"
+
+
+def _build_service_context():
+    token_counter = RateLimitedTokenCounter(
+        llm_limiter, tokenizer=tiktoken.encoding_for_model("gpt-4-1106-preview").encode
+    )
+    gpt4 = OpenAI(temperature=0, model="gpt-4-1106-preview", max_retries=2)
+    return ServiceContext.from_defaults(
         llm=gpt4,
         chunk_size=1024,
-        callback_manager=callback_manager,
+        callback_manager=CallbackManager([token_counter]),
+    )
+
+
+def _summary_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def incremental_summary_of_day(summary_date):
+    representatives = get_latest_representative_summaries(summary_date)
+    if not representatives:
+        logging.warning(f"No representative summaries found for {summary_date}")
+        return
+
+    current = {rep["representative_name"]: _summary_hash(rep["text"]) for rep in representatives}
+    existing_summary, covered = get_daily_summary_state(summary_date)
+    changed = [rep for rep in representatives if covered.get(rep["representative_name"]) != current[rep["representative_name"]]]
+    if existing_summary is not None and not changed:
+        logging.info(f"Daily summary for {summary_date} already covers all {len(current)} representative summaries")
+        return
+
+    totals = {
+        "total_calls_count": int(sum(rep["total_calls_count"] or 0 for rep in representatives)),
+        "successful_call_count": int(sum(rep["successful_call_count"] or 0 for rep in representatives)),
+        "unsuccessful_call_count": int(sum(rep["unsuccessful_call_count"] or 0 for rep in representatives)),
+    }
+    if existing_summary is None:
+        prompt = Prompt(SUMMARY_TEMPLATE)
+        delta = representatives
+    else:
+        prompt = Prompt(REFINE_TEMPLATE).partial_format(existing_summary=existing_summary, **totals)
+        delta = changed
+    logging.info(f"Updating daily summary for {summary_date} with {len(delta)} of {len(representatives)} representative summaries")
+
+    nodes = [
+        NodeWithScore(node=TextNode(text=rep["text"], metadata={"representative_name": rep["representative_name"]}), score=1.0)
+        for rep in delta
+    ]
+    summarizer = TreeSummarizer(_build_service_context(), prompt)
+    response = summarizer.summarize("Provide a concise summary.", [nodes])
+
+    # The refreshed row is stored before the old ones are removed, and the state
+    # only records the covered summaries once it is: a failed write leaves the
+    # previous day summary in place and the next run retries the delta.
+    replaced_row_ids = get_daily_summary_row_ids(summary_date)
+    stored_rows = generating_summaries_embeddings({
+        "table_name": "daily_summaries",
+        "summary_date": summary_date,
+        "summaries": str(response),
+        **totals,
+    })
+    if not stored_rows:
+        raise RuntimeError(f"Storing the daily summary for {summary_date} failed")
+    delete_daily_summaries(replaced_row_ids)
+    save_daily_summary_state(summary_date, str(response), current)
+
+
+def summary_of_day(summary_date):
+    if INCREMENTAL_DAILY_SUMMARY:
+        return incremental_summary_of_day(summary_date)
+
+    service_context_gpt4 = _build_service_context()
+
+    agent_summary_counts = get_agent_summary_count_by_summary_date(
+        summary_date=summary_date
     )
-    set_global_service_context(service_context_gpt4)
+
+    row_count = agent_summary_counts["row_count"]
+    daily_total_calls_count = agent_summary_counts["daily_total_calls_count"]
+    daily_successful_call_count = agent_summary_counts["daily_successful_call_count"]
+    daily_unsuccessful_call_count = agent_summary_counts["daily_unsuccessful_call_count"]
+
+    summary_prompt = Prompt(SUMMARY_TEMPLATE)
 
     filters = MetadataFilters(
         filters=[
@@ -96,21 +190,23 @@ def summary_of_day(summary_date):
         ]
     )
 
-    index = VectorStoreIndex.from_documents(
-        [], service_context=service_context_gpt4, storage_context=storage_context
-    )
-
-    query_engine_summarization = index.as_query_engine(
-        text_qa_template=summary_prompt,
-        similarity_top_k=row_count,
-        verbose=True,
-        filters=filters,
-        query_mode="compact_accumulate",
-    )
-
     query = "Provide a concise summary."
-
-    response = query_engine_summarization.query(query)
+    if SUMMARY_RETRIEVAL_MODE == "direct":
+        summarizer = TreeSummarizer(service_context_gpt4, summary_prompt)
+        response = summarizer.summarize(query, iter_summary_pages("sales_representative_summaries", summary_date, summary_date))
+    else:
+        index = get_vector_index(
+            "sales_representative_summaries", service_context=service_context_gpt4
+        )
+        query_engine_summarization = index.as_query_engine(
+            service_context=service_context_gpt4,
+            text_qa_template=summary_prompt,
+            similarity_top_k=row_count,
+            verbose=True,
+            filters=filters,
+            query_mode="compact_accumulate",
+        )
+        response = query_engine_summarization.query(query)
 
     try:
         summary_details = {
@@ -1,17 +1,144 @@
+import hashlib
 import os
 from datetime import datetime
 from pathlib import Path
 import logging
-from llama_index import StorageContext, VectorStoreIndex
+from llama_index import Document
 from llama_hub.file.unstructured import UnstructuredReader
-from audio_transcribe import audio_Transcriptions
-from db_configurations.auto_call_postgres_config import get_vector_store
+from audio_transcribe import audio_Transcriptions, get_model_version
+from audio_preprocess import PREPROCESS_AUDIO, preprocess_audio
+from ingest_batcher import ingest_documents
+from db_configurations.auto_call_postgres_config import (
+    add_call_to_rollup,
+    delete_transcript_rows,
+    get_cached_transcript,
+    get_ingested_transcript_hashes,
+    has_call_summary,
+    save_cached_transcript,
+    transcript_ingest_lock,
+)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
 logger = logging.getLogger(__name__)
 
-def generating_embeddings(filename, call_metadata):
+# Returned by generating_embeddings for a recording whose transcript and call summary are both stored
+ALREADY_INGESTED = object()
+
+def hash_file(filename, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(filename, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def get_transcription_version():
+    # Anything that changes the transcript text for the same audio belongs in the cache key
+    return f"{get_model_version()}:{'preprocessed' if PREPROCESS_AUDIO else 'raw'}"
+
+def transcribe_recording(filename, content_hash):
+    transcription_version = get_transcription_version()
+    cached_transcript = get_cached_transcript(content_hash, transcription_version)
+    if cached_transcript is not None:
+        logger.info(f"Reusing cached transcript for {filename} ({content_hash}, {transcription_version})")
+        return [Document(text=cached_transcript)]
+
+    transcription_input = filename
+    if PREPROCESS_AUDIO:
+        try:
+            transcription_input, preprocess_stats = preprocess_audio(filename)
+            logger.info(f"Audio preprocessing for {filename}: {preprocess_stats}")
+        except Exception as e:
+            logger.warning(f"Audio preprocessing failed for {filename}, transcribing original: {e}")
+    try:
+        documents = audio_Transcriptions(transcription_input)
+    finally:
+        if transcription_input != filename and os.path.exists(transcription_input):
+            os.remove(transcription_input)
+
+    save_cached_transcript(
+        content_hash, transcription_version, "\n".join(document.text for document in documents)
+    )
+    return documents
+
+def add_transcript_to_rollup(filename, content_hash, call_metadata):
+    """Count a stored recording in the call count rollup; a no-op if it was counted already."""
+    call_date = datetime.strptime(call_metadata["call_date"], "%m/%d/%Y %I:%M:%S %p").strftime("%Y-%m-%d")
+    try:
+        talk_time_seconds = float(call_metadata["call_talk_time"] or 0)
+    except (TypeError, ValueError):
+        talk_time_seconds = 0
+    add_call_to_rollup(filename, content_hash, call_date, call_metadata["user_name"],
+                       call_metadata["call_disposition"], talk_time_seconds)
+
+def ingest_transcript(filename, content_hash, call_metadata, summarize_recording=None):
+    """Store a recording's transcript embeddings once per (file, content), then its call summary.
+
+    A redelivered or re-uploaded recording with the same content is not
+    embedded again; if its call summary is stored too, ALREADY_INGESTED is
+    returned without transcribing. If the content changed, the file's old
+    rows are replaced. summarize_recording(documents) runs whenever the call
+    summary for this content is missing, so a summary that failed after the
+    embeddings were stored is made on redelivery.
+    """
+    stored_hashes = get_ingested_transcript_hashes(filename)
+    already_embedded = stored_hashes == {content_hash}
+    if already_embedded:
+        # Counts the call if the last attempt stopped between storing its rows and the rollup
+        add_transcript_to_rollup(filename, content_hash, call_metadata)
+    if already_embedded and (summarize_recording is None or has_call_summary(filename, content_hash)):
+        logger.info(f"Transcript for {filename} ({content_hash}) is already ingested, skipping")
+        return ALREADY_INGESTED
+
+    documents = transcribe_recording(filename, content_hash)
+    current_date_str = call_metadata["call_date"]
+    current_date = datetime.strptime(current_date_str, "%m/%d/%Y %I:%M:%S %p")
+    formatted_date = current_date.strftime("%Y-%m-%d")
+    formatted_time = current_date.strftime("%I:%M:%S %p")
+    for detail in documents:
+        detail.metadata.update({
+            "call_date": call_metadata["call_date"],
+            "date": formatted_date,
+            "time": formatted_time,
+            "company_name": call_metadata["company_name"],
+            "contact_first_name": call_metadata["contact_first_name"],
+            "contact_last_name": call_metadata["contact_last_name"],
+            "contact_country": call_metadata["contact_country"],
+            "contact_job_industry": call_metadata["contact_job_industry"],
+            "contact_job_level": call_metadata["contact_job_level"],
+            "contact_status": call_metadata["contact_status"],
+            "call_disposition": call_metadata["call_disposition"],
+            "sales_representative_name": call_metadata["user_name"],
+            "list_name": call_metadata["list_name"],
+            "contact_job_title": call_metadata["contact_job_title"],
+            "call_talk_time": f"{call_metadata['call_talk_time']} Seconds",
+            "file_name": filename,
+            "content_hash": content_hash,
+        })
+        # Bookkeeping only: keep it out of the embedded text and the prompts
+        detail.excluded_embed_metadata_keys.append("content_hash")
+        detail.excluded_llm_metadata_keys.append("content_hash")
+
+    if already_embedded:
+        logger.info(f"Transcript for {filename} ({content_hash}) is already ingested, generating its missing call summary")
+    else:
+        if stored_hashes:
+            logger.info(f"Replacing {delete_transcript_rows(filename)} outdated transcript rows for {filename}")
+        ingest_documents("call_transcripts", documents)
+        add_transcript_to_rollup(filename, content_hash, call_metadata)
+        logger.info(f"Successfully generated embeddings for {filename}")
+    if summarize_recording is not None:
+        summarize_recording(documents)
+    return documents
+
+def generating_embeddings(filename, call_metadata, summarize_recording=None):
+    """Ingest a downloaded recording; see ingest_transcript.
+
+    Returns its documents, ALREADY_INGESTED, or None if the file is missing or
+    empty. Transcription, embedding and database errors are raised, so the
+    message is retried. summarize_recording runs under the same per-file lock
+    as the ingest, so two deliveries of a file never both summarize it.
+    """
     logger.info(f"Starting generating_embeddings for {filename}")
     file_name = os.path.splitext(os.path.basename(filename))[0]
     file_path = Path(filename)
@@ -23,37 +150,9 @@ def generating_embeddings(filename, call_metadata):
 
             if file_size > 0:
                 logger.info(f"File {filename} is not empty")
-                documents = audio_Transcriptions(filename)
-                for detail in documents:
-                    current_date_str = call_metadata["call_date"]
-                    current_date = datetime.strptime(current_date_str, "%m/%d/%Y %I:%M:%S %p")
-                    formatted_date = current_date.strftime("%Y-%m-%d")
-                    formatted_time = current_date.strftime("%I:%M:%S %p")
-
-                    detail.metadata.update({
-                        "call_date": call_metadata["call_date"],
-                        "date": formatted_date,
-                        "time": formatted_time,
-                        "company_name": call_metadata["company_name"],
-                        "contact_first_name": call_metadata["contact_first_name"],
-                        "contact_last_name": call_metadata["contact_last_name"],
-                        "contact_country": call_metadata["contact_country"],
-                        "contact_job_industry": call_metadata["contact_job_industry"],
-                        "contact_job_level": call_metadata["contact_job_level"],
-                        "contact_status": call_metadata["contact_status"],
-                        "call_disposition": call_metadata["call_disposition"],
-                        "sales_representative_name": call_metadata["user_name"],
-                        "list_name": call_metadata["list_name"],
-                        "contact_job_title": call_metadata["contact_job_title"],
-                        "call_talk_time": f"{call_metadata['call_talk_time']} Seconds",
-                        "file_name": filename
-                    })
-
-                vector_store = get_vector_store("call_transcripts")
-                storage_context = StorageContext.from_defaults(vector_store=vector_store)
-                index = VectorStoreIndex.from_documents(documents, storage_context=storage_context)
-                logger.info(f"Successfully generated embeddings for {filename}")
-                return documents
+                content_hash = hash_file(filename)
+                with transcript_ingest_lock(filename):
+                    return ingest_transcript(filename, content_hash, call_metadata, summarize_recording)
             else:
                 logger.warning(f"File {filename} is empty")
                 return None
@@ -62,9 +161,10 @@ def generating_embeddings(filename, call_metadata):
             return None
     except Exception as e:
         logger.error(f"Error in generating_embeddings for {filename}: {e}", exc_info=True)
-        return None
+        raise
 
 def generating_summaries_embeddings(summary_details):
+    """Embed and store a summary; returns the number of rows stored, or None if that failed."""
     logger.info(f"Starting generating_summaries_embeddings")
     table_name = summary_details["table_name"]
     summary_date = summary_details["summary_date"]
@@ -93,11 +193,11 @@ def generating_summaries_embeddings(summary_details):
             if table_name == "sales_representative_summaries":
                 doc.metadata["representative_name"] = representative_name
 
-        vector_store = get_vector_store(table_name)
-        storage_context = StorageContext.from_defaults(vector_store=vector_store)
-        VectorStoreIndex.from_documents(documents, storage_context=storage_context)
+        row_count = ingest_documents(table_name, documents)
         os.remove(file_name)
         
         logger.info(f"Successfully generated summaries embeddings and removed {file_name}")
+        return row_count
     except Exception as e:
         logger.error(f"Error in generating_summaries_embeddings: {e}", exc_info=True)
+        return None
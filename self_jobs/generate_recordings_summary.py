@@ -10,6 +10,7 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(mess
 logger = logging.getLogger(__name__)
 
 def generating_summary_of_each_recordings(documents, filenameWithDate):
+    """Summarize a recording's transcript and store the call summary; raises if either step fails."""
     try:
         logger.info("Starting summary generation for recordings")
         gpt_data = OpenAI(temperature=0, model="gpt-3.5-turbo")
@@ -48,13 +49,16 @@ def generating_summary_of_each_recordings(documents, filenameWithDate):
         )
     except Exception as e:
         logger.error("Error during summary generation", exc_info=True)
-        return
+        raise
 
     try:
-        save_call_summary(str(response), str(documents[0].metadata['file_name']))
+        save_call_summary(
+            str(response), str(documents[0].metadata['file_name']), documents[0].metadata.get('content_hash')
+        )
         logger.info("Call summary saved successfully")
     except Exception as e:
         logger.error("Error saving call summary", exc_info=True)
+        raise
 
     try:
         directory = "summaries/daily_summaries"
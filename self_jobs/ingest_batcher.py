@@ -0,0 +1,169 @@
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+import psycopg2
+import psycopg2.extras
+from llama_index.embeddings import OpenAIEmbedding
+from llama_index.node_parser import SentenceSplitter
+from llama_index.schema import MetadataMode
+from llama_index.vector_stores.utils import node_to_metadata_dict
+
+from common.tenant_context import get_current_tenant
+from dbConfig.pool_registry import DEFAULT_TENANT, get_connection
+from dbConfig.vector_store_cache import get_vector_store
+
+logger = logging.getLogger(__name__)
+
+# A batch is written once it holds INGEST_BATCH_SIZE documents or its first
+# document has waited INGEST_BATCH_MAX_WAIT_SECONDS, whichever comes first.
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "32"))
+INGEST_BATCH_MAX_WAIT_SECONDS = float(os.getenv("INGEST_BATCH_MAX_WAIT_SECONDS", "1"))
+# Texts per embeddings API request
+INGEST_EMBED_BATCH_SIZE = int(os.getenv("INGEST_EMBED_BATCH_SIZE", "256"))
+
+# Same chunking as the default ServiceContext used by VectorStoreIndex.from_documents
+_node_parser = SentenceSplitter(chunk_size=1024, chunk_overlap=20)
+_embed_model = OpenAIEmbedding(embed_batch_size=INGEST_EMBED_BATCH_SIZE)
+
+_batches = {}
+_batches_lock = threading.Lock()
+
+_stats_lock = threading.Lock()
+_stats = {
+    "batches": 0,
+    "documents": 0,
+    "rows": 0,
+    "embed_seconds": 0.0,
+    "insert_seconds": 0.0,
+    "last_batch_documents": 0,
+    "last_batch_rows": 0,
+    "last_rows_per_second": 0.0,
+}
+
+
+class _Batch:
+    def __init__(self):
+        self.documents = []
+        # (documents, future) per submit_documents() call
+        self.submissions = []
+        self.timer = None
+
+
+def _insert_rows(environment_token, table_name, nodes):
+    rows = [
+        (
+            node.get_content(metadata_mode=MetadataMode.NONE),
+            json.dumps(node_to_metadata_dict(node, remove_text=True, flat_metadata=False)),
+            node.node_id,
+            str(node.get_embedding()),
+        )
+        for node in nodes
+    ]
+    try:
+        with get_connection(environment_token) as conn:
+            cursor = conn.cursor()
+            psycopg2.extras.execute_values(
+                cursor,
+                f"INSERT INTO data_{table_name} (text, metadata_, node_id, embedding) VALUES %s",
+                rows,
+                template="(%s, %s::json, %s, %s::vector)",
+                page_size=500,
+            )
+            cursor.close()
+    except psycopg2.errors.UndefinedTable:
+        # First write to this table: let the vector store create it (the nodes are already embedded)
+        get_vector_store(table_name, environment_token=environment_token).add(nodes)
+
+
+def _write_batch(environment_token, table_name, batch):
+    try:
+        start_time = time.monotonic()
+        nodes = []
+        node_counts = []
+        for documents, _ in batch.submissions:
+            submission_nodes = _node_parser.get_nodes_from_documents(documents)
+            nodes.extend(submission_nodes)
+            node_counts.append(len(submission_nodes))
+        embeddings = _embed_model.get_text_embedding_batch(
+            [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+        )
+        for node, embedding in zip(nodes, embeddings):
+            node.embedding = embedding
+        embedded_time = time.monotonic()
+        _insert_rows(environment_token, table_name, nodes)
+        end_time = time.monotonic()
+    except Exception as e:
+        logger.error(f"Writing a batch of {len(batch.documents)} documents to {table_name} failed: {e}")
+        for _, future in batch.submissions:
+            future.set_exception(e)
+        return
+
+    rows_per_second = len(nodes) / max(end_time - start_time, 1e-6)
+    with _stats_lock:
+        _stats["batches"] += 1
+        _stats["documents"] += len(batch.documents)
+        _stats["rows"] += len(nodes)
+        _stats["embed_seconds"] += embedded_time - start_time
+        _stats["insert_seconds"] += end_time - embedded_time
+        _stats["last_batch_documents"] = len(batch.documents)
+        _stats["last_batch_rows"] = len(nodes)
+        _stats["last_rows_per_second"] = round(rows_per_second, 1)
+    logger.info(
+        f"Ingested {len(batch.documents)} documents as {len(nodes)} rows into {table_name} for {environment_token} "
+        f"(embed {embedded_time - start_time:.2f}s, insert {end_time - embedded_time:.2f}s, {rows_per_second:.1f} rows/s)"
+    )
+    # Each caller gets the number of rows its own documents produced
+    for (_, future), node_count in zip(batch.submissions, node_counts):
+        future.set_result(node_count)
+
+
+def _flush(key, batch=None):
+    with _batches_lock:
+        current = _batches.get(key)
+        # A timer may fire after its batch was already flushed for being full
+        if current is None or (batch is not None and current is not batch):
+            return
+        del _batches[key]
+    if current.timer is not None:
+        current.timer.cancel()
+    _write_batch(key[0], key[1], current)
+
+
+def submit_documents(table_name, documents):
+    """Queue documents for the current tenant's table; the Future resolves once its batch is stored."""
+    tenant = get_current_tenant()
+    key = (tenant.environment_token if tenant is not None else DEFAULT_TENANT, table_name)
+    future = Future()
+    with _batches_lock:
+        batch = _batches.get(key)
+        if batch is None:
+            batch = _batches[key] = _Batch()
+        batch.documents.extend(documents)
+        batch.submissions.append((documents, future))
+        full = len(batch.documents) >= INGEST_BATCH_SIZE
+        if not full and batch.timer is None:
+            batch.timer = threading.Timer(INGEST_BATCH_MAX_WAIT_SECONDS, _flush, args=(key, batch))
+            batch.timer.daemon = True
+            batch.timer.start()
+    if full:
+        _flush(key, batch)
+    return future
+
+
+def ingest_documents(table_name, documents):
+    """Embed and store documents through the shared batch, blocking until they are written.
+
+    Returns the number of rows stored for these documents.
+    """
+    return submit_documents(table_name, documents).result()
+
+
+def get_ingest_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["avg_batch_rows"] = round(stats["rows"] / stats["batches"], 1) if stats["batches"] else 0.0
+    return stats
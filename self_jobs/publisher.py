@@ -0,0 +1,168 @@
+import atexit
+import logging
+import os
+import threading
+from concurrent.futures import Future
+
+import pika
+
+from common.tenant_context import get_current_tenant
+
+# Publishing more than one message per broker round trip is opt-in: with
+# PUBLISH_BATCH_SIZE > 1 messages are buffered and committed together in a
+# channel transaction, at the latest PUBLISH_BATCH_INTERVAL seconds after the
+# first one. Otherwise each message is published with a publisher confirm.
+# Either way publish() returns only once the broker has the message, so the
+# delivery that produced it is never acked before its result is safe.
+PUBLISH_BATCH_SIZE = int(os.getenv("PUBLISH_BATCH_SIZE", "1"))
+PUBLISH_BATCH_INTERVAL = float(os.getenv("PUBLISH_BATCH_INTERVAL", "0.5"))
+
+_publishers = {}
+_publishers_lock = threading.Lock()
+
+
+class _Publisher:
+    """One long-lived connection and channel to a tenant's broker, reconnected on failure."""
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.batching = PUBLISH_BATCH_SIZE > 1
+        self.lock = threading.Lock()
+        self.connection = None
+        self.channel = None
+        self.pending = []
+        # Resolved when the pending messages are committed, or failed with the error
+        self.batch = None
+        self.flush_timer = None
+
+    def _connect(self):
+        credentials = pika.PlainCredentials(username=self.settings["user"],
+                                            password=self.settings["password"])
+        self.connection = pika.BlockingConnection(
+            pika.ConnectionParameters(host=self.settings["host"],
+                                      port=self.settings["port"],
+                                      credentials=credentials,
+                                      virtual_host=self.settings["vhost"]))
+        self.channel = self.connection.channel()
+        if self.batching:
+            self.channel.tx_select()
+        else:
+            self.channel.confirm_delivery()
+        self.channel.queue_declare(queue=os.getenv('RABBITMQ_PUBLISH_QUEUE'), durable=True)
+        logging.info(f"Opened publisher connection to {self.settings['host']} {self.settings['vhost']}")
+
+    def _ensure_channel(self):
+        if self.connection is None or self.connection.is_closed or self.channel is None or self.channel.is_closed:
+            self._close()
+            self._connect()
+        else:
+            # Service heartbeats and detect a connection the broker dropped while idle
+            self.connection.process_data_events(time_limit=0)
+
+    def _close(self):
+        connection, self.connection, self.channel = self.connection, None, None
+        if connection is not None and connection.is_open:
+            try:
+                connection.close()
+            except Exception as e:
+                logging.warning(f"Error closing publisher connection: {e}")
+
+    def _publish_locked(self, bodies):
+        for attempt in (1, 2):
+            try:
+                self._ensure_channel()
+                for body in bodies:
+                    # In confirm mode this returns once the broker has confirmed the message
+                    self.channel.basic_publish(exchange=os.getenv('RABBITMQ_PUBLISH_EXCHANGE'),
+                                               routing_key=os.getenv('RABBITMQ_PUBLISH_ROUTING_KEY'),
+                                               body=body,
+                                               properties=pika.BasicProperties(delivery_mode=2))
+                if self.batching:
+                    self.channel.tx_commit()
+                return
+            except (pika.exceptions.AMQPConnectionError, pika.exceptions.AMQPChannelError) as e:
+                self._close()
+                if attempt == 2:
+                    raise
+                logging.warning(f"Publisher connection lost ({e}), reconnecting")
+
+    def _flush_locked(self):
+        if self.flush_timer is not None:
+            self.flush_timer.cancel()
+            self.flush_timer = None
+        bodies, self.pending = self.pending, []
+        batch, self.batch = self.batch, None
+        if not bodies:
+            return
+        try:
+            self._publish_locked(bodies)
+        except Exception as e:
+            batch.set_exception(e)
+            raise
+        batch.set_result(len(bodies))
+        logging.info(f"Published batch of {len(bodies)} messages.")
+
+    def flush(self):
+        with self.lock:
+            try:
+                self._flush_locked()
+            except Exception as e:
+                # Each publish() waiting on the batch raises it, so its delivery is retried
+                logging.error(f"An error occurred while flushing published messages: {e}")
+
+    def publish(self, body):
+        """Publish body, returning once the broker has it; raises if it could not be published."""
+        with self.lock:
+            if not self.batching:
+                self._publish_locked([body])
+                return
+            if self.batch is None:
+                self.batch = Future()
+            batch = self.batch
+            self.pending.append(body)
+            if len(self.pending) >= PUBLISH_BATCH_SIZE:
+                self._flush_locked()
+                return
+            if self.flush_timer is None:
+                self.flush_timer = threading.Timer(PUBLISH_BATCH_INTERVAL, self.flush)
+                self.flush_timer.daemon = True
+                self.flush_timer.start()
+        # Wait for the timer (or a later publish filling the batch) to commit it
+        batch.result()
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            self._close()
+
+
+def get_publisher_settings():
+    tenant = get_current_tenant()
+    if tenant is not None:
+        return tenant.rabbitmq
+    return {
+        "host": os.getenv('RABBITMQ_HOST'),
+        "port": os.getenv('RABBITMQ_PORT'),
+        "user": os.getenv('RABBITMQ_USERNAME'),
+        "password": os.getenv('RABBITMQ_PASSWORD'),
+        "vhost": os.getenv('RABBITMQ_VHOST'),
+    }
+
+
+def get_publisher(settings=None):
+    settings = settings or get_publisher_settings()
+    key = (settings["host"], settings["port"], settings["vhost"], settings["user"])
+    with _publishers_lock:
+        publisher = _publishers.get(key)
+        if publisher is None:
+            publisher = _publishers[key] = _Publisher(settings)
+    return publisher
+
+
+@atexit.register
+def close_publishers():
+    with _publishers_lock:
+        publishers = list(_publishers.values())
+        _publishers.clear()
+    for publisher in publishers:
+        publisher.close()
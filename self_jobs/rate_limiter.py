@@ -0,0 +1,159 @@
+import logging
+import os
+import random
+import threading
+import time
+
+import openai
+from llama_index.callbacks import TokenCountingHandler
+from llama_index.callbacks.schema import CBEventType, EventPayload
+from llama_index.callbacks.token_counting import get_llm_token_counts
+
+logger = logging.getLogger(__name__)
+
+# Budgets of the OpenAI key shared by every summary generated in this process
+LLM_REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE", "500"))
+LLM_TOKENS_PER_MINUTE = float(os.getenv("LLM_TOKENS_PER_MINUTE", "300000"))
+# Tokens reserved for the completion on top of the prompt; corrected to the real count afterwards
+LLM_COMPLETION_TOKENS_ESTIMATE = int(os.getenv("LLM_COMPLETION_TOKENS_ESTIMATE", "1024"))
+RATE_LIMIT_MAX_ATTEMPTS = int(os.getenv("RATE_LIMIT_MAX_ATTEMPTS", "5"))
+RATE_LIMIT_BASE_DELAY_SECONDS = float(os.getenv("RATE_LIMIT_BASE_DELAY_SECONDS", "10"))
+
+
+class TokenBucketLimiter:
+    """Requests-per-minute and tokens-per-minute buckets that refill continuously.
+
+    acquire() blocks until both buckets can cover a request. The token bucket
+    may go negative when a request turns out to use more than was reserved,
+    which delays the following callers until the budget has caught up.
+    """
+
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.available_requests = requests_per_minute
+        self.available_tokens = tokens_per_minute
+        self.paused_until = 0.0
+        self.updated_at = time.monotonic()
+        self.condition = threading.Condition()
+        self.requests = 0
+        self.tokens = 0
+        self.rate_limited = 0
+        self.total_wait_seconds = 0.0
+
+    def _refill(self, now):
+        elapsed = now - self.updated_at
+        self.updated_at = now
+        self.available_requests = min(self.requests_per_minute,
+                                      self.available_requests + elapsed * self.requests_per_minute / 60)
+        self.available_tokens = min(self.tokens_per_minute,
+                                    self.available_tokens + elapsed * self.tokens_per_minute / 60)
+
+    def acquire(self, tokens):
+        # A single request larger than the whole budget waits for a full bucket rather than forever
+        tokens = min(tokens, self.tokens_per_minute)
+        start_time = time.monotonic()
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self.paused_until and self.available_requests >= 1 and self.available_tokens >= tokens:
+                    self.available_requests -= 1
+                    self.available_tokens -= tokens
+                    self.requests += 1
+                    self.tokens += tokens
+                    self.total_wait_seconds += now - start_time
+                    return
+                wait = max(
+                    self.paused_until - now,
+                    (1 - self.available_requests) * 60 / self.requests_per_minute,
+                    (tokens - self.available_tokens) * 60 / self.tokens_per_minute,
+                )
+                self.condition.wait(timeout=max(wait, 0.05))
+
+    def adjust(self, token_delta):
+        """Charge (or refund) the difference between the reserved and the actual token count."""
+        with self.condition:
+            self.available_tokens -= token_delta
+            self.tokens += token_delta
+            self.condition.notify_all()
+
+    def pause(self, seconds):
+        """Hold every caller back for seconds, e.g. after the API answered 429."""
+        with self.condition:
+            self.rate_limited += 1
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.condition.notify_all()
+
+    def stats(self):
+        with self.condition:
+            return {
+                "requests": self.requests,
+                "tokens": self.tokens,
+                "rate_limited": self.rate_limited,
+                "total_wait_seconds": round(self.total_wait_seconds, 2),
+            }
+
+
+class RateLimitedTokenCounter(TokenCountingHandler):
+    """TokenCountingHandler that takes each LLM call's budget from a limiter before it is sent.
+
+    The reservation is the prompt's token count plus a completion estimate;
+    once the call finishes, the limiter is corrected with the actual total.
+    """
+
+    def __init__(self, limiter, tokenizer, completion_tokens_estimate=LLM_COMPLETION_TOKENS_ESTIMATE):
+        super().__init__(tokenizer=tokenizer)
+        self.tokenize = tokenizer
+        self.limiter = limiter
+        self.completion_tokens_estimate = completion_tokens_estimate
+        self.reserved_tokens = {}
+
+    def _prompt_text(self, payload):
+        if EventPayload.MESSAGES in payload:
+            return "\n".join(str(message.content or "") for message in payload[EventPayload.MESSAGES])
+        return str(payload.get(EventPayload.PROMPT, ""))
+
+    def on_event_start(self, event_type, payload=None, event_id="", parent_id="", **kwargs):
+        if event_type == CBEventType.LLM and payload is not None:
+            reserved = len(self.tokenize(self._prompt_text(payload))) + self.completion_tokens_estimate
+            self.limiter.acquire(reserved)
+            self.reserved_tokens[event_id] = reserved
+        return super().on_event_start(event_type, payload=payload, event_id=event_id, parent_id=parent_id, **kwargs)
+
+    def on_event_end(self, event_type, payload=None, event_id="", **kwargs):
+        super().on_event_end(event_type, payload=payload, event_id=event_id, **kwargs)
+        reserved = self.reserved_tokens.pop(event_id, None)
+        if reserved is None:
+            return
+        # Concurrent calls share this handler, so the correction is computed from
+        # this event's own payload rather than the last entry of llm_token_counts
+        if payload is not None and (EventPayload.PROMPT in payload or EventPayload.MESSAGES in payload):
+            actual = get_llm_token_counts(self._token_counter, payload, event_id).total_token_count
+            self.limiter.adjust(actual - reserved)
+
+
+def _retry_after_seconds(error, attempt):
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(retry_after)
+    except (TypeError, ValueError):
+        return RATE_LIMIT_BASE_DELAY_SECONDS * 2 ** (attempt - 1) * random.uniform(1, 1.5)
+
+
+def call_with_rate_limit_retries(limiter, fn, *args, **kwargs):
+    """Call fn, pausing the shared limiter and retrying when OpenAI still answers 429."""
+    for attempt in range(1, RATE_LIMIT_MAX_ATTEMPTS + 1):
+        try:
+            return fn(*args, **kwargs)
+        except openai.RateLimitError as e:
+            if attempt == RATE_LIMIT_MAX_ATTEMPTS:
+                raise
+            delay = _retry_after_seconds(e, attempt)
+            logger.warning("Rate limited by OpenAI (attempt %s of %s), backing off %.1fs",
+                           attempt, RATE_LIMIT_MAX_ATTEMPTS, delay)
+            limiter.pause(delay)
+
+
+llm_limiter = TokenBucketLimiter(LLM_REQUESTS_PER_MINUTE, LLM_TOKENS_PER_MINUTE)
@@ -0,0 +1,191 @@
+import argparse
+import json
+import logging
+import os
+import sys
+
+import pika
+
+logger = logging.getLogger(__name__)
+
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "5"))
+RETRY_BASE_DELAY_SECONDS = int(os.getenv("RETRY_BASE_DELAY_SECONDS", "30"))
+RETRY_MAX_DELAY_SECONDS = int(os.getenv("RETRY_MAX_DELAY_SECONDS", "1800"))
+# How long a deferred delivery (its summary is running elsewhere) waits before it is offered again
+DEFER_DELAY_SECONDS = int(os.getenv("DEFER_DELAY_SECONDS", "15"))
+
+ATTEMPTS_HEADER = "x-retry-attempts"
+LAST_ERROR_HEADER = "x-last-error"
+
+
+def retry_delay_seconds(attempt):
+    return min(RETRY_BASE_DELAY_SECONDS * 2 ** (attempt - 1), RETRY_MAX_DELAY_SECONDS)
+
+
+def retry_queue_name(queue, delay_seconds):
+    return f"{queue}.retry.{delay_seconds}s"
+
+
+def dead_letter_queue_name(queue):
+    return f"{queue}.dead"
+
+
+def defer_queue_name(queue):
+    return f"{queue}.deferred.{DEFER_DELAY_SECONDS}s"
+
+
+def declare_retry_topology(channel, queue):
+    """Declare the delay queues and the dead-letter queue for a work queue.
+
+    A delay queue has no consumers: messages sit there for its TTL and are
+    then dead-lettered through the default exchange straight back to the
+    work queue.
+    """
+    for delay_seconds in sorted({retry_delay_seconds(attempt) for attempt in range(1, RETRY_MAX_ATTEMPTS)}):
+        channel.queue_declare(
+            queue=retry_queue_name(queue, delay_seconds),
+            durable=True,
+            arguments={
+                "x-message-ttl": delay_seconds * 1000,
+                "x-dead-letter-exchange": "",
+                "x-dead-letter-routing-key": queue,
+            },
+        )
+    channel.queue_declare(
+        queue=defer_queue_name(queue),
+        durable=True,
+        arguments={
+            "x-message-ttl": DEFER_DELAY_SECONDS * 1000,
+            "x-dead-letter-exchange": "",
+            "x-dead-letter-routing-key": queue,
+        },
+    )
+    channel.queue_declare(queue=dead_letter_queue_name(queue), durable=True)
+
+
+def get_attempts(properties):
+    return int((properties.headers or {}).get(ATTEMPTS_HEADER, 0))
+
+
+def retry_or_dead_letter(channel, queue, properties, body, reason, permanent=False):
+    """Republish a failed delivery to its next delay queue, or to the dead-letter queue.
+
+    The caller acks the original delivery afterwards, once the channel's
+    publisher confirm for this copy arrived. Returns the queue the message
+    was published to.
+    """
+    attempts = get_attempts(properties) + 1
+    headers = dict(properties.headers or {})
+    headers[ATTEMPTS_HEADER] = attempts
+    headers[LAST_ERROR_HEADER] = str(reason)[:500]
+    republish_properties = pika.BasicProperties(
+        headers=headers,
+        delivery_mode=2,
+        content_type=properties.content_type,
+        message_id=properties.message_id,
+    )
+
+    if permanent or attempts >= RETRY_MAX_ATTEMPTS:
+        target_queue = dead_letter_queue_name(queue)
+        logger.error("Dead-lettering message after %s attempt(s): %s", attempts, reason)
+    else:
+        target_queue = retry_queue_name(queue, retry_delay_seconds(attempts))
+        logger.warning("Retrying message in %ss (attempt %s of %s): %s",
+                       retry_delay_seconds(attempts), attempts, RETRY_MAX_ATTEMPTS, reason)
+    channel.basic_publish(exchange="", routing_key=target_queue, body=body, properties=republish_properties)
+    return target_queue
+
+
+def defer_message(channel, queue, properties, body):
+    """Republish a delivery unchanged to the defer queue; it returns to the work queue after DEFER_DELAY_SECONDS.
+
+    Unlike a retry this is not a failed attempt, so the attempt count is kept.
+    The caller acks the original delivery afterwards.
+    """
+    target_queue = defer_queue_name(queue)
+    channel.basic_publish(exchange="", routing_key=target_queue, body=body, properties=properties)
+    return target_queue
+
+
+def inspect_dead_letters(channel, queue, limit):
+    """Return up to limit dead-lettered messages without removing them from the queue."""
+    messages = []
+    last_delivery_tag = None
+    for _ in range(limit):
+        method, properties, body = channel.basic_get(queue=dead_letter_queue_name(queue), auto_ack=False)
+        if method is None:
+            break
+        last_delivery_tag = method.delivery_tag
+        messages.append({
+            "attempts": get_attempts(properties),
+            "last_error": (properties.headers or {}).get(LAST_ERROR_HEADER),
+            "body": body.decode("utf-8", errors="replace"),
+        })
+    if last_delivery_tag is not None:
+        channel.basic_nack(delivery_tag=last_delivery_tag, multiple=True, requeue=True)
+    return messages
+
+
+def replay_dead_letters(channel, queue, limit):
+    """Move up to limit dead-lettered messages back to the work queue with a fresh attempt count."""
+    replayed = 0
+    for _ in range(limit):
+        method, properties, body = channel.basic_get(queue=dead_letter_queue_name(queue), auto_ack=False)
+        if method is None:
+            break
+        headers = {
+            key: value for key, value in (properties.headers or {}).items()
+            if key not in (ATTEMPTS_HEADER, LAST_ERROR_HEADER, "x-death")
+        }
+        channel.basic_publish(
+            exchange="",
+            routing_key=queue,
+            body=body,
+            properties=pika.BasicProperties(headers=headers, delivery_mode=2,
+                                            content_type=properties.content_type,
+                                            message_id=properties.message_id),
+        )
+        channel.basic_ack(delivery_tag=method.delivery_tag)
+        replayed += 1
+    return replayed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or replay dead-lettered messages")
+    parser.add_argument("command", choices=["inspect", "replay"])
+    parser.add_argument("--host", help="RabbitMQ host from RABBITMQ_HOSTS (defaults to the first one)")
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    from config_loader import load_and_set_config
+    load_and_set_config()
+
+    rabbitmq_hosts = json.loads(os.getenv("RABBITMQ_HOSTS", "[]"))
+    host_config = next(
+        (config for config in rabbitmq_hosts if args.host in (None, config["host"])), None
+    )
+    if host_config is None:
+        sys.exit(f"Unknown RabbitMQ host: {args.host}")
+
+    connection = pika.BlockingConnection(pika.ConnectionParameters(
+        host=host_config["host"],
+        port=host_config["port"],
+        virtual_host=host_config["vhost"],
+        credentials=pika.PlainCredentials(host_config["name"], host_config["password"]),
+    ))
+    channel = connection.channel()
+    # replay acks each dead letter only after its copy is confirmed on the work queue
+    channel.confirm_delivery()
+    queue = os.getenv("RABBITMQ_QUEUE")
+    try:
+        if args.command == "inspect":
+            for message in inspect_dead_letters(channel, queue, args.limit):
+                print(json.dumps(message))
+        else:
+            print(f"Replayed {replay_dead_letters(channel, queue, args.limit)} message(s) to {queue}")
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
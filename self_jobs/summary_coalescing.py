@@ -0,0 +1,97 @@
+import contextvars
+import logging
+import os
+import threading
+import time
+import uuid
+
+from db_configurations.auto_call_postgres_config import (
+    claim_summary_lease,
+    finish_summary_lease,
+    release_summary_lease,
+    renew_summary_lease,
+)
+
+logger = logging.getLogger(__name__)
+
+# A summary request waits this long after it was received before regenerating,
+# so the rest of a burst for the same date lands inside a single run.
+SUMMARY_COALESCE_WINDOW_SECONDS = float(os.getenv("SUMMARY_COALESCE_WINDOW_SECONDS", "30"))
+# The holder renews its lease every third of this while generating, so a lease
+# only expires (and can be taken over) shortly after its holder died.
+SUMMARY_LEASE_SECONDS = float(os.getenv("SUMMARY_LEASE_SECONDS", "120"))
+
+_waiting = {}
+_waiting_lock = threading.Lock()
+
+
+class SummaryDeferred(Exception):
+    """Another consumer holds the date's lease; the request must come back later rather than be acked.
+
+    The holder has been asked to run again, but if it died that request
+    would be lost, so the message is offered again until a run that started
+    after it covers it.
+    """
+
+
+def _renew_lease(stop, summary_date, lease_owner):
+    while not stop.wait(SUMMARY_LEASE_SECONDS / 3):
+        if not renew_summary_lease(summary_date, lease_owner, time.time(), SUMMARY_LEASE_SECONDS):
+            logger.warning("Lost the summary lease for %s while generating", summary_date)
+            return
+
+
+def generate_summaries_coalesced(environment_token, summary_date, requested_at, generate):
+    """Run generate() for a date unless a run that started after requested_at covers it.
+
+    Requests for the same tenant and date that are still inside the coalescing
+    window in this process share one waiter. Across replicas a lease row per
+    date decides who generates; a request that arrives while another consumer
+    holds the lease asks it to run once more instead of running in parallel.
+    Returns True if this call generated the summaries; raises SummaryDeferred
+    when the request is only recorded on another consumer's lease.
+    """
+    key = (environment_token, summary_date)
+    with _waiting_lock:
+        if key in _waiting:
+            # The waiter must be covered by a run starting after the latest request it absorbed
+            _waiting[key] = max(_waiting[key], requested_at)
+            logger.info("Summary request for %s %s coalesced with one already waiting", environment_token, summary_date)
+            return False
+        _waiting[key] = requested_at
+
+    try:
+        delay = requested_at + SUMMARY_COALESCE_WINDOW_SECONDS - time.time()
+        if delay > 0:
+            time.sleep(delay)
+    finally:
+        with _waiting_lock:
+            requested_at = _waiting.pop(key)
+
+    lease_owner = uuid.uuid4().hex
+    status = claim_summary_lease(summary_date, lease_owner, requested_at, time.time(), SUMMARY_LEASE_SECONDS)
+    if status == "rerun_requested":
+        raise SummaryDeferred(f"Summary generation for {summary_date} is running on another consumer")
+    if status != "acquired":
+        logger.info("Summary generation for %s %s skipped: %s", environment_token, summary_date, status)
+        return False
+
+    stop_renewing = threading.Event()
+    # The renewal thread queries the tenant's database, so it runs in this context
+    renewer = threading.Thread(
+        target=contextvars.copy_context().run, args=(_renew_lease, stop_renewing, summary_date, lease_owner),
+        name=f"summary-lease-{summary_date}", daemon=True,
+    )
+    renewer.start()
+    try:
+        while True:
+            generate()
+            if not finish_summary_lease(summary_date, lease_owner, time.time(), SUMMARY_LEASE_SECONDS):
+                return True
+            logger.info("New summary requests for %s %s arrived while generating, running again",
+                        environment_token, summary_date)
+    except Exception:
+        release_summary_lease(summary_date, lease_owner, time.time())
+        raise
+    finally:
+        stop_renewing.set()
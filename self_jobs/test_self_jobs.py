@@ -1,3 +1,117 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import pika
+
+from async_consumer import HostConsumer, RECONNECT_BASE_DELAY_SECONDS, RECONNECT_MAX_DELAY_SECONDS, reconnect_delay_seconds
+from audio_segments import parse_silencedetect_output, plan_segments, stitch_transcripts
+import publisher
+from retry_queues import RETRY_BASE_DELAY_SECONDS, RETRY_MAX_DELAY_SECONDS, retry_delay_seconds
+
+
 # Example content of test_common.py
 def test_example():
     assert 1 == 1
+
+
+def test_parse_silencedetect_output_pairs_starts_and_ends():
+    output = "\n".join([
+        "[silencedetect @ 0x1] silence_start: 12.5",
+        "[silencedetect @ 0x1] silence_end: 14.0 | silence_duration: 1.5",
+        "[silencedetect @ 0x1] silence_start: 58.25",
+    ])
+    assert parse_silencedetect_output(output, duration=60.0) == [(12.5, 14.0), (58.25, 60.0)]
+
+
+def test_plan_segments_cuts_inside_nearby_silence():
+    segments = plan_segments(700.0, [(295.0, 297.0), (610.0, 612.0)], target_seconds=300, overlap_seconds=2)
+    assert [(segment["cut_start"], segment["cut_end"]) for segment in segments] == [
+        (0.0, 296.0), (296.0, 611.0), (611.0, 700.0)
+    ]
+    assert segments[1]["start"] == 294.0 and segments[1]["end"] == 613.0
+
+
+def test_stitch_transcripts_drops_overlap_duplicates():
+    first = {"start": 0.0, "end": 12.0, "cut_start": 0.0, "cut_end": 10.0}
+    second = {"start": 8.0, "end": 20.0, "cut_start": 10.0, "cut_end": 20.0}
+    results = [
+        (second, {"segments": [{"start": 1.0, "end": 3.0, "text": " overlap"}, {"start": 4.0, "end": 6.0, "text": " world"}]}),
+        (first, {"segments": [{"start": 0.0, "end": 4.0, "text": " hello"}, {"start": 9.0, "end": 11.0, "text": " overlap"}]}),
+    ]
+    stitched = stitch_transcripts(results)
+    assert stitched["text"] == "hello overlap world"
+    assert [segment["start"] for segment in stitched["segments"]] == [0.0, 9.0, 12.0]
+
+
+def test_retry_delay_grows_exponentially_up_to_the_cap():
+    assert retry_delay_seconds(1) == RETRY_BASE_DELAY_SECONDS
+    assert retry_delay_seconds(2) == 2 * RETRY_BASE_DELAY_SECONDS
+    assert retry_delay_seconds(50) == RETRY_MAX_DELAY_SECONDS
+
+
+def test_reconnect_delay_is_jittered_below_the_backoff_ceiling():
+    for failures in (1, 3, 50):
+        ceiling = min(RECONNECT_BASE_DELAY_SECONDS * 2 ** (failures - 1), RECONNECT_MAX_DELAY_SECONDS)
+        assert 0 <= reconnect_delay_seconds(failures) <= ceiling
+
+
+class _FakeChannel:
+    is_open = True
+
+    def __init__(self):
+        self.acked = []
+        self.nacked = []
+
+    def basic_ack(self, delivery_tag):
+        self.acked.append(delivery_tag)
+
+    def basic_nack(self, delivery_tag, requeue):
+        self.nacked.append(delivery_tag)
+
+
+def test_failed_delivery_is_acked_only_after_its_republish_is_confirmed():
+    loop = asyncio.new_event_loop()
+    host_config = {"host": "h", "port": 5672, "name": "u", "password": "p", "vhost": "/"}
+    consumer = HostConsumer(loop, host_config, None, None, lambda *args: None,
+                            {"transcript": ("work.lane.transcript", 2)}, 1, 30)
+    lane_channel = consumer.channels[1]
+    lane_channel.channel = channel = _FakeChannel()
+
+    for delivery_tag in (7, 8, 9):
+        future = loop.create_future()
+        future.set_result(("retry", "boom"))
+        consumer.on_processed(lane_channel, channel, delivery_tag, None, b"{}", future)
+    assert channel.acked == []
+
+    lane_channel.on_delivery_confirmation(SimpleNamespace(method=pika.spec.Basic.Ack(delivery_tag=2, multiple=True)))
+    lane_channel.on_delivery_confirmation(SimpleNamespace(method=pika.spec.Basic.Nack(delivery_tag=3)))
+    assert channel.acked == [7, 8]
+    assert channel.nacked == [9]
+    loop.close()
+
+
+def test_failed_timer_flush_raises_in_every_publish_of_the_batch(monkeypatch):
+    monkeypatch.setattr(publisher, "PUBLISH_BATCH_SIZE", 3)
+    monkeypatch.setattr(publisher, "PUBLISH_BATCH_INTERVAL", 0.01)
+    batch_publisher = publisher._Publisher({})
+
+    def fail(bodies):
+        raise pika.exceptions.AMQPConnectionError("broker down")
+
+    monkeypatch.setattr(batch_publisher, "_publish_locked", fail)
+    errors = []
+
+    def publish(body):
+        try:
+            batch_publisher.publish(body)
+        except pika.exceptions.AMQPError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=publish, args=(body,)) for body in ("a", "b")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=5)
+    assert len(errors) == 2
+    assert batch_publisher.pending == []